@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
+import atexit
+import hashlib
 import json
+import ntpath
 import os
 import os.path
-from typing import Any, Dict, List
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 
 from chaoslib.discovery.discover import discover_actions, discover_probes, \
     initialize_discovery_result
@@ -11,76 +17,286 @@ from chaoslib.types import Configuration, Discovery, DiscoveredActivities, \
     Secrets
 from logzero import logger
 import requests
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-
-__all__ = ["salt_api_client", "discover", "__version__"]
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import InsecureRequestWarning, \
+    NewConnectionError
+
+from .grains import DEFAULT_GRAINS_MISSING_TTL, DEFAULT_GRAINS_TTL, \
+    GrainsCache
+from .metrics import MetricsCollector, RequestEvent, lowstate_labels
+from .output import DEFAULT_OUTPUT_HEAD, DEFAULT_OUTPUT_TAIL, OutputLimiter
+from .resilience import DEFAULT_BREAKER_RESET, DEFAULT_BREAKER_THRESHOLD, \
+    DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_RETRIES, \
+    DEFAULT_RETRY_BACKOFF, DEFAULT_RETRY_MAX_BACKOFF, CircuitBreaker, \
+    RetryPolicy, TransientError, is_idempotent
+from .throttle import DEFAULT_INITIAL_IN_FLIGHT, \
+    DEFAULT_LATENCY_TOLERANCE, DEFAULT_MAX_IN_FLIGHT, DEFAULT_RATE_LIMIT, \
+    ConcurrencyWindow, RequestThrottle
+
+__all__ = ["salt_api_client", "saltstack_api_client", "JobReturn",
+           "evict_saltstack_api_client", "close_saltstack_api_clients",
+           "discover", "__version__"]
 __version__ = '0.1.0'
 
+# Default settings of the pooled HTTP transport, a host keeps at least
+# enough connections for the requests in flight, see __create_session__
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+
+# Seconds before its expiry a cached token is renewed
+TOKEN_EXPIRY_MARGIN = 60
+
+# Default pacing of the job waiter, in seconds
+DEFAULT_POLL_INTERVAL = 1
+DEFAULT_POLL_MAX_INTERVAL = 5
+DEFAULT_POLL_BACKOFF = 1.5
+
+# What a minion reported for a job
+JobReturn = namedtuple('JobReturn', ['jid', 'minion', 'success', 'output'])
+
+# Clients shared by every activity of the process, see saltstack_api_client
+__clients__ = dict()
+__clients_lock__ = threading.Lock()
+
+# Experiment configuration keys forwarded to the client
+CLIENT_CONFIGURATION_KEYS = {
+    "saltstack_pool_connections": "pool_connections",
+    "saltstack_pool_maxsize": "pool_maxsize",
+    "saltstack_pool_block": "pool_block",
+    "saltstack_keep_alive": "keep_alive",
+    "saltstack_poll_interval": "poll_interval",
+    "saltstack_poll_max_interval": "poll_max_interval",
+    "saltstack_use_events": "use_events",
+    "saltstack_grains_ttl": "grains_ttl",
+    "saltstack_grains_missing_ttl": "grains_missing_ttl",
+    "saltstack_grains_cache_file": "grains_cache_file",
+    "saltstack_grains_timeout": "grains_timeout",
+    "saltstack_grains_master_cache": "grains_master_cache",
+    "saltstack_client": "client",
+    "saltstack_max_concurrency": "max_concurrency",
+    "saltstack_output_head": "output_head",
+    "saltstack_output_tail": "output_tail",
+    "saltstack_output_spool_dir": "output_spool_dir",
+    "saltstack_connect_timeout": "connect_timeout",
+    "saltstack_read_timeout": "read_timeout",
+    "saltstack_retries": "retries",
+    "saltstack_retry_backoff": "retry_backoff",
+    "saltstack_retry_max_backoff": "retry_max_backoff",
+    "saltstack_breaker_threshold": "breaker_threshold",
+    "saltstack_breaker_reset": "breaker_reset",
+    "saltstack_rate_limit": "rate_limit",
+    "saltstack_rate_burst": "rate_burst",
+    "saltstack_max_in_flight": "max_in_flight",
+    "saltstack_adaptive_concurrency": "adaptive_concurrency",
+    "saltstack_initial_in_flight": "initial_in_flight",
+    "saltstack_min_in_flight": "min_in_flight",
+    "saltstack_latency_tolerance": "latency_tolerance",
+}
+
 
 class salt_api_client:
     """
     Offically supported by NETAPI MODULES
     https://docs.saltstack.com/en/latest/topics/netapi/index.html
     However, generally you need to avoid http request verify by verify=False
+
+    All the calls of a client go through a single pooled, keep-alive
+    HTTP session, so close() the client once you are done with it.
+    A client may be shared between threads.
     """
     def __init__(self, configuration: Configuration):
         self.url = configuration['url']
+        # Default settings for Salt Master, never changed afterwards so
+        # threads can share them, see __request_headers__
+        self.headers = {"Content-type": "application/json"}
+        self.params = {'client': 'local', 'fun': '', 'tgt': ''}
         # Use Token
         self.useToken = False
+        self.token = None
+        self.token_expire = 0
+        self.lock = threading.RLock()
+        self.closed = False
         if 'token' in configuration:
             self.useToken = True
             self.token = configuration['token']
-            self.headers['X-Auth-Token'] = self.token
         elif 'username' in configuration:
             self.username = configuration['username']
             self.password = configuration['password']
-        # Default settings for Salt Master
-        self.headers = {"Content-type": "application/json"}
-        self.params = {'client': 'local', 'fun': '', 'tgt': ''}
-        # Use User/Pass
+            # Use User/Pass
+            self.login_params = {
+                'username': self.username, 'password': self.password,
+                'eauth': 'pam'
+            }
         self.login_url = self.url + "/login"
-        self.login_params = {
-            'username': self.username, 'password': self.password,
-            'eauth': 'pam'
-        }
+        self.session = self.__create_session__(configuration)
+        # Pacing of wait_for_jobs()
+        self.poll_interval = float(configuration.get(
+            'poll_interval', DEFAULT_POLL_INTERVAL))
+        self.poll_max_interval = float(configuration.get(
+            'poll_max_interval', DEFAULT_POLL_MAX_INTERVAL))
+        # Learn about job returns from the event bus rather than polling
+        self.use_events = __as_bool__(configuration.get('use_events', False))
+        self.event_listener = None
+        # Bounds of each request, and what happens when they are exceeded
+        self.connect_timeout = float(configuration.get(
+            'connect_timeout', DEFAULT_CONNECT_TIMEOUT))
+        self.read_timeout = float(configuration.get(
+            'read_timeout', DEFAULT_READ_TIMEOUT)) or None
+        self.retry_policy = RetryPolicy(
+            retries=configuration.get('retries', DEFAULT_RETRIES),
+            backoff=configuration.get('retry_backoff', DEFAULT_RETRY_BACKOFF),
+            max_backoff=configuration.get(
+                'retry_max_backoff', DEFAULT_RETRY_MAX_BACKOFF))
+        self.breaker = CircuitBreaker(
+            threshold=configuration.get(
+                'breaker_threshold', DEFAULT_BREAKER_THRESHOLD),
+            reset=configuration.get('breaker_reset', DEFAULT_BREAKER_RESET))
+        self.throttle = RequestThrottle(
+            rate=configuration.get('rate_limit', DEFAULT_RATE_LIMIT),
+            burst=configuration.get('rate_burst'),
+            window=self.__create_window__(configuration))
+        # Every request is reported to the hooks, see add_hook()
+        self.metrics = MetricsCollector()
+        self.hooks = [self.metrics]
+        if self.throttle.window is not None:
+            self.hooks.append(self.throttle.window)
+        # Bound of the outputs kept from the job returns
+        self.output_limiter = OutputLimiter(
+            head=configuration.get('output_head', DEFAULT_OUTPUT_HEAD),
+            tail=configuration.get('output_tail', DEFAULT_OUTPUT_TAIL),
+            spool_dir=configuration.get('output_spool_dir'))
+        # (minion, path) of the files known to be staged, see stage_file()
+        self.staged = set()
+        # Grains lookups, cached unless the TTL is 0
+        self.grains_timeout = configuration.get('grains_timeout')
+        self.grains_master_cache = __as_bool__(
+            configuration.get('grains_master_cache', True))
+        self.grains_cache = None
+        grains_ttl = float(configuration.get('grains_ttl', DEFAULT_GRAINS_TTL))
+        if grains_ttl > 0:
+            self.grains_cache = GrainsCache(
+                ttl=grains_ttl,
+                missing_ttl=float(configuration.get(
+                    'grains_missing_ttl', DEFAULT_GRAINS_MISSING_TTL)),
+                path=configuration.get('grains_cache_file'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Release the pooled connections held by this client.
+        """
+        self.closed = True
+        if self.event_listener is not None:
+            self.event_listener.stop()
+        self.session.close()
+
+    def add_hook(self, hook: Callable[[RequestEvent], None]):
+        """
+        Have `hook` called with a RequestEvent after each request: its
+        latency, payload sizes, HTTP status, whether it was a retry and the
+        lowstate `client` and `fun` it ran. `metrics`, a MetricsCollector,
+        is always hooked.
+        """
+        with self.lock:
+            self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[RequestEvent], None]):
+        with self.lock:
+            if hook in self.hooks:
+                self.hooks.remove(hook)
+
+    def events(self):
+        """
+        The listener of the salt-api event stream of this client, it is
+        subscribed on first use.
+        """
+        from .events import JobEventListener
 
-    def run_cmd(self, tgt, method: str, arg=None):
+        with self.lock:
+            if self.event_listener is None:
+                self.event_listener = JobEventListener(self)
+        self.event_listener.start()
+        return self.event_listener
+
+    def run_cmd(self, tgt, method: str, arg=None, kwarg=None, batch=None,
+                batch_wait=None, tgt_type: str = 'list'):
         """
            remote run commands，same with:
                salt 'client1' cmd.run 'ls -li'
+
+        With a `batch` size, e.g. 10 or '10%', the master runs the command
+        on that many minions at a time, waiting `batch_wait` seconds before
+        replacing a minion that returned, same with:
+               salt -b 10 --batch-wait 5 'client*' cmd.run 'ls -li'
+        The call then returns once every batch ran.
+
+        `tgt` is a list of minions, or any target expression of the given
+        `tgt_type` (glob, grain, pcre, compound, nodegroup...) resolved by
+        the master.
         """
         if arg:
             params = {
                 'client': 'local', 'fun': method, 'tgt': tgt, 'arg': arg,
-                'tgt_type': 'list'
+                'tgt_type': tgt_type
             }
 
         else:
             params = {
                 'client': 'local', 'fun': method, 'tgt': tgt,
-                'tgt_type': 'list'
+                'tgt_type': tgt_type
             }
+        if kwarg:
+            params['kwarg'] = kwarg
 
         # Refresh token for each execution
         self.__check_token__()
-        result = self.__get_http_data__(self.url, params)
+        if batch:
+            params['client'] = 'local_batch'
+            params['batch'] = str(batch)
+            if batch_wait:
+                params['batch_wait'] = batch_wait
+            # salt-api returns what each minion returned as its own item
+            result = dict()
+            for returned in self.__get_http_returns__(self.url, params):
+                result.update(returned or {})
+        else:
+            result = self.__get_http_data__(self.url, params)
+        if isinstance(result, dict):
+            result = {name: self.output_limiter.limit(name, output)
+                      for name, output in result.items()}
         return result
 
-    def async_run_cmd(self, tgt, method: str, arg=None):
+    def async_run_cmd(self, tgt, method: str, arg=None, kwarg=None,
+                      tgt_type: str = 'list'):
         """
         remote run commands asynchronized，same with:
             salt --async 'client1' cmd.run 'ls -li'
+
+        `tgt` may list many minions, they all run the command as a single
+        job. Keyword arguments of the salt function go in `kwarg`, e.g.
+        {'template': 'jinja'} to render grains on each minion. See run_cmd()
+        for `tgt_type`.
         """
         if arg:
             params = {
                 'client': 'local_async', 'fun': method, 'tgt': tgt,
-                'arg': arg, 'tgt_type': 'list'
+                'arg': arg, 'tgt_type': tgt_type
             }
         else:
             params = {
                 'client': 'local_async', 'fun': method, 'tgt': tgt,
-                'tgt_type': 'list'
+                'tgt_type': tgt_type
             }
+        if kwarg:
+            params['kwarg'] = kwarg
+        if self.use_events:
+            # Subscribe before dispatching so no return can be missed
+            self.events()
         self.__check_token__()
         jid = self.__get_http_data__(self.url, params)['jid']
         return jid
@@ -107,39 +323,421 @@ class salt_api_client:
         result = self.__get_http_data__(self.url, params)
         return result
 
-    def get_grains_get(self, tgt, item):
+    def get_grains_get(self, tgt, item, tgt_type: str = 'list'):
         """
             Get a specific grains atrribute/id
                 salt 'client1' grains.get kernel|os|os_family
+
+        Values are served from the grains cache while fresh, then from the
+        grains cached by the master, only the remaining minions are queried
+        live. Minions that did not answer are left out of the result.
+
+        Target expressions other than a list are always resolved and
+        queried live, the minions they match are not known beforehand.
+        """
+        if tgt_type != 'list' or not isinstance(tgt, list):
+            return self.__live_grains_get__(tgt, item, tgt_type)
+
+        if self.grains_cache is not None:
+            result, missing = self.grains_cache.get(item, tgt)
+        else:
+            result, missing = dict(), list(tgt)
+
+        if missing and self.grains_master_cache:
+            cached = self.get_cached_grains_get(missing, item)
+            if self.grains_cache is not None:
+                self.grains_cache.update(item, cached)
+            result.update(cached)
+            missing = [name for name in missing if name not in cached]
+
+        if missing:
+            live = self.__live_grains_get__(missing, item)
+            if self.grains_cache is not None:
+                self.grains_cache.update(item, live, missing)
+            result.update(live)
+        return result
+
+    def get_cached_grains_get(self, tgt, item, tgt_type: str = 'list'):
+        """
+            Get a specific grains attribute from the grains cached by the
+            master, without contacting the minions
+                salt-run cache.grains tgt='client1' tgt_type=list
+        return:
+            {'client1': 'Linux'}, minions unknown to the cache are left out
         """
         params = {
-            'client': 'local', 'fun': 'grains.get', 'tgt': tgt, 'arg': item,
-            'tgt_type': 'list'
+            'client': 'runner', 'fun': 'cache.grains', 'tgt': tgt,
+            'tgt_type': tgt_type
         }
         self.__check_token__()
-        result = self.__get_http_data__(self.url, params)
-        return result
+        return __cached_grains_values__(
+            self.__get_http_data__(self.url, params), item)
+
+    def run_many(self, chunks: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Run several lowstate chunks, of any client, in a single request:
+            [{'client': 'runner', 'fun': 'jobs.lookup_jid', 'jid': jid1},
+             {'client': 'runner', 'fun': 'jobs.exit_success', 'jid': jid1}]
+        return:
+            the result of each chunk, in the same order
+        """
+        if not chunks:
+            return []
+        self.__check_token__()
+        return self.__get_http_returns__(self.url, list(chunks))
+
+    def stage_file(self, tgt: List[str], path: str, content: str,
+                   mode: str = None) -> List[str]:
+        """
+        Write `content` at `path` on the minions that do not have it yet.
+        The path is expected to change with the content (e.g. to embed its
+        hash), a file already there is only trusted when its sha256 is the
+        one of `content` and is written again otherwise. The directory of
+        the file is created with `mode`, e.g. '0700', when given.
+
+        Raises FailedActivity when the file could not be written on some
+        minions, they are tried again by the next call.
+        return:
+            the minions the file was written to
+        """
+        with self.lock:
+            tgt = [name for name in tgt if (name, path) not in self.staged]
+        if not tgt:
+            return []
+        # minions that do not answer are left for the next call
+        hashes = self.run_cmd(
+            tgt, 'file.get_hash', [path, 'sha256']) or {}
+        missing = __unstaged_minions__(tgt, hashes, content)
+        written = dict()
+        if missing:
+            written = self.run_many(
+                __stage_chunks__(missing, path, content, mode))[1] or {}
+        failures = __write_failures__(missing, written)
+        with self.lock:
+            self.staged.update(
+                (name, path) for name in hashes if name not in failures)
+        __check_staged__(path, failures)
+        return missing
+
+    def wait_for_jobs(self, jids: Dict[str, List[str]], timeout: float) \
+            -> Tuple[Dict[str, JobReturn], Dict[str, List[str]]]:
+        """
+        Wait until every minion of the given jobs, as {jid: [minions]},
+        reported or the timeout (in seconds) elapsed.
+
+        With `use_events`, returns are read from the salt-api event stream
+        and the master is only polled once for the minions still missing
+        at the deadline. Otherwise outstanding jobs are polled right away
+        and then with an exponential backoff from `poll_interval` up to
+        `poll_max_interval`, so short jobs are collected as soon as they
+        finish. Each poll round is a single request whatever the number of
+        jobs.
+
+        return:
+            ({'client1': JobReturn(...)}, {'12345678987654321': ['client2']})
+            the returns by minion, and the minions still pending by jid when
+            the deadline passed.
+        """
+        returns = dict()
+        returned = set()
+        for job_return in self.iter_job_returns(jids, timeout):
+            returns[job_return.minion] = job_return
+            returned.add((job_return.jid, job_return.minion))
+        return returns, __pending_minions__(jids, returned)
+
+    def iter_job_returns(self, jids: Dict[str, List[str]], timeout: float,
+                         use_events: bool = None) -> Iterator[JobReturn]:
+        """
+        Yield the JobReturn of each minion of the given jobs, as
+        {jid: [minions]}, as soon as it is known, until every minion
+        reported or the timeout (in seconds) elapsed. Minions that did not
+        report by then are not yielded.
+
+        Same strategies as wait_for_jobs() but no return is kept, so the
+        caller decides what to hold on to. `use_events` overrides the
+        `use_events` setting of the client. Jobs are polled anyway while the
+        event stream is not connected.
+        """
+        if use_events is None:
+            use_events = self.use_events
+        listener = self.events() if use_events else None
+        if listener is None or not listener.connected.is_set():
+            if listener is not None:
+                logger.debug("salt-api event stream not connected, polling "
+                             "the job returns")
+            yield from self.__iter_polled_jobs__(jids, timeout)
+            return
+
+        returned = set()
+        for job_return in listener.iter_returns(jids, timeout):
+            returned.add((job_return.jid, job_return.minion))
+            yield job_return
+        pending = __pending_minions__(jids, returned)
+        if pending:
+            # Returns published while the stream was reconnecting
+            yield from self.__iter_polled_jobs__(pending, 0)
 
     ###########################################################################
     # Private methods
     ###########################################################################
+    def __create_session__(self, configuration: Configuration):
+        """
+        Build the HTTP session shared by every call of this client.
+
+        The connection pool is sized through `pool_connections` (number of
+        hosts kept in the pool) and `pool_maxsize` (connections per host).
+        By default a host keeps enough connections for `max_in_flight`
+        requests and the event stream, so none is opened and thrown away.
+        When `pool_block` is set, callers wait for a free connection rather
+        than opening throw-away ones. Keep-alive can be disabled with
+        `keep_alive`, in which case each response closes its connection.
+        """
+        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+        max_in_flight = int(configuration.get(
+            'max_in_flight', DEFAULT_MAX_IN_FLIGHT))
+        adapter = HTTPAdapter(
+            pool_connections=int(configuration.get(
+                'pool_connections', DEFAULT_POOL_CONNECTIONS)),
+            pool_maxsize=int(configuration.get(
+                'pool_maxsize',
+                max(DEFAULT_POOL_MAXSIZE, max_in_flight + 1))),
+            pool_block=__as_bool__(configuration.get('pool_block', False)))
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.verify = False
+        if not __as_bool__(configuration.get('keep_alive', True)):
+            session.headers['Connection'] = 'close'
+        return session
+
+    def __create_window__(self, configuration: Configuration):
+        """
+        The window of requests in flight, `max_in_flight` at most or
+        unbounded when 0. Unless `adaptive_concurrency` is disabled, it
+        starts at `initial_in_flight` and follows the load of the master.
+        """
+        max_in_flight = int(configuration.get(
+            'max_in_flight', DEFAULT_MAX_IN_FLIGHT))
+        if max_in_flight <= 0:
+            return None
+        adaptive = __as_bool__(
+            configuration.get('adaptive_concurrency', True))
+        return ConcurrencyWindow(
+            limit=configuration.get(
+                'initial_in_flight', DEFAULT_INITIAL_IN_FLIGHT)
+            if adaptive else max_in_flight,
+            min_limit=configuration.get('min_in_flight', 1),
+            max_limit=max_in_flight, adaptive=adaptive,
+            tolerance=configuration.get(
+                'latency_tolerance', DEFAULT_LATENCY_TOLERANCE))
+
+    def __live_grains_get__(self, tgt, item, tgt_type: str = 'list'):
+        params = {
+            'client': 'local', 'fun': 'grains.get', 'tgt': tgt, 'arg': item,
+            'tgt_type': tgt_type
+        }
+        if self.grains_timeout:
+            # Do not wait the master default for minions that are down
+            params['timeout'] = int(self.grains_timeout)
+        self.__check_token__()
+        result = self.__get_http_data__(self.url, params)
+        return result
+
+    def __iter_polled_jobs__(self, jids: Dict[str, List[str]],
+                             timeout: float) -> Iterator[JobReturn]:
+        deadline = time.time() + timeout
+        pending = {jid: list(names) for jid, names in jids.items()}
+        interval = self.poll_interval
+
+        while True:
+            # Outputs and exit status of every pending job in one request
+            polled = list(pending.items())
+            chunks = []
+            for jid, _ in polled:
+                chunks.append({
+                    'client': 'runner', 'fun': 'jobs.lookup_jid', 'jid': jid})
+                chunks.append({
+                    'client': 'runner', 'fun': 'jobs.exit_success',
+                    'jid': jid})
+            results = self.run_many(chunks)
+
+            for index, (jid, names) in enumerate(polled):
+                outputs = results[2 * index]
+                exit_success = results[2 * index + 1]
+                for name in names:
+                    if name in outputs:
+                        yield JobReturn(
+                            jid, name, exit_success.get(name, False),
+                            self.output_limiter.limit(
+                                name, outputs[name], jid))
+                names = [name for name in names if name not in outputs]
+                if names:
+                    pending[jid] = names
+                else:
+                    del pending[jid]
+
+            remaining = deadline - time.time()
+            if not pending or remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+            interval = min(
+                interval * DEFAULT_POLL_BACKOFF, self.poll_max_interval)
+
     def __get_http_data__(self, url: str, params: Dict[str, Any]):
+        return self.__get_http_returns__(url, params)[0]
+
+    def __get_http_returns__(self, url: str, params,
+                             retry_on_unauthorized: bool = True) -> List[Any]:
+        """
+        POST a lowstate chunk, or a list of them, and return the `return`
+        list of the response with one result per chunk.
+
+        Transient failures, see __post_once__, are retried with a jittered
+        backoff. A request that may already have reached the master is only
+        retried when it is idempotent, so a fault never runs twice. Once the
+        master keeps failing, the circuit breaker fails fast instead.
+        """
         send_data = json.dumps(params)
-        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-        request = requests.post(
-            url, data=send_data, headers=self.headers, verify=False)
-        response = request.json()
-        result = dict(response)
-        return result['return'][0]
+        sent_token = self.token
+        idempotent = url == self.login_url or is_idempotent(params)
+        attempt = 0
+        while True:
+            self.breaker.check()
+            try:
+                status, response = self.__post_once__(
+                    url, params, send_data, sent_token,
+                    retry=attempt > 0 or not retry_on_unauthorized)
+                break
+            except TransientError as x:
+                self.breaker.failure()
+                if not self.retry_policy.should_retry(attempt, x, idempotent):
+                    raise FailedActivity(str(x))
+                logger.debug("Retrying the Salt API request: {}".format(x))
+                time.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+            except BaseException:
+                self.breaker.release()
+                raise
+        self.breaker.success()
+
+        if status == 401:
+            if url == self.login_url:
+                raise FailedActivity(
+                    "Salt API refused the login of user '{}'".format(
+                        self.username))
+            if self.useToken is True or not retry_on_unauthorized:
+                raise FailedActivity(
+                    "Salt API refused the authentication token")
+            # Token was revoked or expired early on the master, login again
+            # unless another thread already did so meanwhile
+            with self.lock:
+                if self.token == sent_token:
+                    self.__obtain_token__()
+            return self.__get_http_returns__(
+                url, params, retry_on_unauthorized=False)
+        return response['return']
+
+    def __post_once__(self, url: str, params, send_data: str, token: str,
+                      retry: bool) -> Tuple[int, Any]:
+        """
+        A single POST, returns its status and decoded body, None when it
+        was refused with a 401. Connection errors, timeouts, 5xx statuses
+        and bodies that are not JSON raise a TransientError.
+
+        Every request of every thread goes through the throttle so no more
+        than `max_in_flight` are in flight and at most `rate_limit` are
+        sent per second.
+        """
+        with self.throttle:
+            started = time.time()
+            status = 0
+            response_bytes = 0
+            try:
+                request = self.session.post(
+                    url, data=send_data,
+                    headers=self.__request_headers__(token),
+                    timeout=self.__timeout__(params))
+                status = request.status_code
+                response_bytes = len(request.content)
+            except requests.exceptions.Timeout as x:
+                raise TransientError(
+                    "Salt API did not answer on time: {}".format(x),
+                    sent=not isinstance(
+                        x, requests.exceptions.ConnectTimeout))
+            except requests.exceptions.ConnectionError as x:
+                raise TransientError(
+                    "Salt API connection failed: {}".format(x),
+                    sent=not __refused__(x))
+            finally:
+                self.__notify_hooks__(RequestEvent(
+                    *self.__request_labels__(url, params), status=status,
+                    latency=time.time() - started,
+                    request_bytes=len(send_data),
+                    response_bytes=response_bytes, retry=retry))
+
+        if status >= 500:
+            raise TransientError("Salt API answered {} {}".format(
+                status, request.reason))
+        if status == 401:
+            return status, None
+        if status >= 400:
+            raise FailedActivity("Salt API answered {} {}".format(
+                status, request.reason))
+        try:
+            return status, request.json()
+        except ValueError:
+            raise TransientError(
+                "Salt API returned an invalid response: {}".format(
+                    request.text[:200]))
+
+    def __timeout__(self, params) -> Tuple[float, float]:
+        # batches keep the request open until every batch ran
+        if lowstate_labels(params)[0] == 'local_batch':
+            return self.connect_timeout, None
+        return self.connect_timeout, self.read_timeout
+
+    def __request_labels__(self, url: str, params) -> Tuple[str, str]:
+        if url == self.login_url:
+            return 'login', ''
+        return lowstate_labels(params)
+
+    def __notify_hooks__(self, event: RequestEvent):
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception as x:
+                logger.debug("Salt API hook {} failed: {}".format(hook, x))
 
     def __obtain_token__(self):
-        self.token = self.__get_http_data__(
-            self.login_url, self.login_params).get('token')
-        self.headers['X-Auth-Token'] = self.token
+        """
+        Login and cache the token until the expiry announced by the master.
+        """
+        login = self.__get_http_data__(self.login_url, self.login_params)
+        self.token = login.get('token')
+        self.token_expire = float(login.get('expire', 0))
+
+    def __request_headers__(self, token: str = None) -> Dict[str, str]:
+        """
+        Headers of a single request, built per call rather than shared.
+        """
+        headers = dict(self.headers)
+        token = token or self.token
+        if token:
+            headers['X-Auth-Token'] = token
+        return headers
 
     def __check_token__(self):
-        if self.useToken is not True:
-            self.__obtain_token__()
+        """
+        Login only when no token was obtained yet or when it is about to
+        expire, so a client logs in once for its whole lifetime.
+        """
+        if self.useToken is True:
+            return
+        with self.lock:
+            if self.token is None or \
+                    time.time() >= self.token_expire - TOKEN_EXPIRY_MARGIN:
+                self.__obtain_token__()
 
 
 # TODO Not implemented
@@ -150,7 +748,9 @@ def is_saltmaster_local():
     return False
 
 
-def saltstack_api_client(secrets: Secrets = None) -> salt_api_client:
+def saltstack_api_client(secrets: Secrets = None,
+                         configuration: Configuration = None) \
+        -> salt_api_client:
     """
     Create a SaltStack http(s) client from:
 
@@ -176,9 +776,23 @@ def saltstack_api_client(secrets: Secrets = None) -> salt_api_client:
 
         You may pass a secrets dictionary, in which case, values will be looked
         there before the environ.
+
+    The HTTP connection pool can be tuned from the experiment configuration
+    with `saltstack_pool_connections`, `saltstack_pool_maxsize`,
+    `saltstack_pool_block` and `saltstack_keep_alive`.
+
+    Clients are kept in a process-wide registry keyed by the Salt API URL,
+    credentials and `saltstack_*` settings, so every activity of a run
+    configured alike reuses the same logged in, warm client. Set
+    `saltstack_client` to `asyncio` to get a blocking façade over the
+    asyncio client instead, with at most `saltstack_max_concurrency`
+    requests in flight. Use
+    `evict_saltstack_api_client()` or `close_saltstack_api_clients()` to
+    release them earlier.
     """
     env = os.environ
     secrets = secrets or {}
+    experiment_configuration = configuration or {}
 
     def lookup(k: str, d: str = None) -> str:
         return secrets.get(k, env.get(k, d))
@@ -206,7 +820,58 @@ def saltstack_api_client(secrets: Secrets = None) -> salt_api_client:
                 "or a token! "
             )
 
-    return salt_api_client(configuration)
+        for key, name in CLIENT_CONFIGURATION_KEYS.items():
+            if key in experiment_configuration:
+                configuration[name] = experiment_configuration[key]
+
+    key = __client_key__(configuration)
+    with __clients_lock__:
+        client = __clients__.get(key)
+        if client is None or client.closed:
+            client = __new_client__(configuration)
+            __clients__[key] = client
+    return client
+
+
+def evict_saltstack_api_client(secrets: Secrets = None):
+    """
+    Close and forget the shared clients matching these secrets, whatever
+    their settings, the next activity using them gets a fresh client.
+    """
+    env = os.environ
+    secrets = secrets or {}
+
+    def lookup(k: str, d: str = None) -> str:
+        return secrets.get(k, env.get(k, d))
+
+    configuration = dict()
+    configuration['url'] = lookup("SALTMASTER_HOST", "http://localhost")
+    if "SALTMASTER_USER" in env or "SALTMASTER_USER" in secrets:
+        configuration['username'] = lookup("SALTMASTER_USER", "")
+        configuration['password'] = lookup("SALTMASTER_PASSWORD", "")
+    else:
+        configuration['token'] = lookup("SALTMASTER_TOKEN")
+
+    master = __master_key__(configuration)
+    with __clients_lock__:
+        clients = [__clients__.pop(key) for key in list(__clients__)
+                   if key[:len(master)] == master]
+    for client in clients:
+        client.close()
+
+
+def close_saltstack_api_clients():
+    """
+    Close every shared client, called automatically when the process exits.
+    """
+    with __clients_lock__:
+        clients = list(__clients__.values())
+        __clients__.clear()
+    for client in clients:
+        client.close()
+
+
+atexit.register(close_saltstack_api_clients)
 
 
 def discover(discover_system: bool = True) -> Discovery:
@@ -232,3 +897,125 @@ def load_exported_activities() -> List[DiscoveredActivities]:
     activities.extend(discover_actions("saltstack.machine.actions"))
     activities.extend(discover_probes("saltstack.machine.probes"))
     return activities
+
+
+def __new_client__(configuration: Configuration):
+    if configuration.get('client', 'requests') == 'asyncio':
+        from .aio import SyncSaltApiClient
+        return SyncSaltApiClient(configuration)
+    return salt_api_client(configuration)
+
+
+def __client_key__(configuration: Configuration) -> tuple:
+    """
+    Registry key of a client: its Salt API, see __master_key__(), and every
+    other setting it was built with, so a client is only shared by the
+    activities configuring it the same way.
+    """
+    settings = {k: v for k, v in configuration.items()
+                if k not in ('url', 'username', 'password', 'token')}
+    settings.setdefault('client', 'requests')
+    digest = hashlib.sha256(json.dumps(
+        settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return __master_key__(configuration) + (digest,)
+
+
+def __master_key__(configuration: Configuration) -> tuple:
+    """
+    The Salt API URL and credentials of a client, credentials are hashed so
+    they are not kept around in clear text.
+    """
+    credentials = "\0".join([
+        configuration.get('username') or '',
+        configuration.get('password') or '',
+        configuration.get('token') or ''])
+    return (configuration.get('url'),
+            hashlib.sha256(credentials.encode('utf-8')).hexdigest())
+
+
+def __pending_minions__(jids: Dict[str, List[str]], returned: set) \
+        -> Dict[str, List[str]]:
+    """
+    The minions of each job, as {jid: [minions]}, not in the (jid, minion)
+    pairs that returned.
+    """
+    pending = dict()
+    for jid, names in jids.items():
+        names = [name for name in names if (jid, name) not in returned]
+        if names:
+            pending[jid] = names
+    return pending
+
+
+def __cached_grains_values__(cached: Dict[str, Any], item: str) \
+        -> Dict[str, Any]:
+    """
+    The value of a grains item by minion, out of the grains returned by the
+    `cache.grains` runner, minions without it are left out.
+    """
+    result = dict()
+    for name, grains in (cached or {}).items():
+        value = grains
+        # nested grains are delimited by colons, like grains.get
+        for key in item.split(':'):
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            result[name] = value
+    return result
+
+
+def __unstaged_minions__(tgt: List[str], hashes: Dict[str, Any],
+                         content: str) -> List[str]:
+    """
+    The minions of `tgt` which answered `file.get_hash` with anything but
+    the sha256 of `content` as written by `file.write`, which ends it with
+    a newline.
+    """
+    digest = hashlib.sha256((content + "\n").encode('utf-8')).hexdigest()
+    return [name for name in tgt if name in hashes and hashes[name] != digest]
+
+
+def __stage_chunks__(tgt: List[str], path: str, content: str,
+                     mode: str = None) -> List[Dict[str, Any]]:
+    mkdir = {'client': 'local', 'fun': 'file.mkdir', 'tgt': tgt,
+             'arg': [ntpath.dirname(path)], 'tgt_type': 'list'}
+    if mode:
+        mkdir['kwarg'] = {'mode': mode}
+    return [mkdir, {'client': 'local', 'fun': 'file.write', 'tgt': tgt,
+                    'arg': [path, content], 'tgt_type': 'list'}]
+
+
+def __write_failures__(tgt: List[str], written: Dict[str, Any]) \
+        -> Dict[str, Any]:
+    """
+    What `file.write` returned on the minions of `tgt` it did not succeed
+    on, it answers "Wrote <n> lines to <path>" when it does.
+    """
+    return {name: written.get(name) for name in tgt
+            if not str(written.get(name, '')).startswith('Wrote')}
+
+
+def __check_staged__(path: str, failures: Dict[str, Any]):
+    if failures:
+        raise FailedActivity("Could not stage {} on machines: {}".format(
+            path, json.dumps(failures, default=str)))
+
+
+def __as_bool__(value: Any) -> bool:
+    """
+    Configuration values may come as strings from the environment.
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def __refused__(error: requests.exceptions.ConnectionError) -> bool:
+    """
+    Whether the connection itself could not be opened, in which case the
+    request never reached the master.
+    """
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
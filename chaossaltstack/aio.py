@@ -0,0 +1,573 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from chaoslib.exceptions import FailedActivity
+from chaoslib.types import Configuration
+from logzero import logger
+
+from . import DEFAULT_POLL_BACKOFF, DEFAULT_POLL_INTERVAL, \
+    DEFAULT_POLL_MAX_INTERVAL, TOKEN_EXPIRY_MARGIN, JobReturn, \
+    __as_bool__, __cached_grains_values__, __check_staged__, \
+    __stage_chunks__, __unstaged_minions__, __write_failures__
+from .grains import DEFAULT_GRAINS_MISSING_TTL, DEFAULT_GRAINS_TTL, \
+    GrainsCache
+from .metrics import MetricsCollector, RequestEvent, lowstate_labels
+from .output import DEFAULT_OUTPUT_HEAD, DEFAULT_OUTPUT_TAIL, OutputLimiter
+from .resilience import DEFAULT_BREAKER_RESET, DEFAULT_BREAKER_THRESHOLD, \
+    DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_RETRIES, \
+    DEFAULT_RETRY_BACKOFF, DEFAULT_RETRY_MAX_BACKOFF, CircuitBreaker, \
+    RetryPolicy, TransientError, is_idempotent
+from .throttle import DEFAULT_MAX_IN_FLIGHT, DEFAULT_RATE_LIMIT, \
+    TokenBucket
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+__all__ = ["AsyncSaltApiClient", "SyncSaltApiClient"]
+
+# Requests a client keeps in flight at most
+DEFAULT_MAX_CONCURRENCY = 64
+
+# Jobs polled by each concurrent request of a poll round
+DEFAULT_POLL_BATCH_SIZE = 50
+
+
+class AsyncSaltApiClient:
+    """
+    asyncio flavour of salt_api_client, built on aiohttp.
+
+    Every coroutine may be awaited concurrently, at most `max_concurrency`
+    requests, and never more than `max_in_flight` unless it is 0, are in
+    flight at any time. The window does not adapt to the master as the one
+    of salt_api_client does. Requires the `async` extra:
+        pip install chaostoolkit-saltstack[async]
+    """
+    def __init__(self, configuration: Configuration):
+        if not HAS_AIOHTTP:
+            raise FailedActivity(
+                "the asyncio Salt API client requires aiohttp, install "
+                "chaostoolkit-saltstack[async]")
+        self.url = configuration['url']
+        self.headers = {"Content-type": "application/json"}
+        self.useToken = False
+        self.token = None
+        self.token_expire = 0
+        if 'token' in configuration:
+            self.useToken = True
+            self.token = configuration['token']
+            self.headers['X-Auth-Token'] = self.token
+        elif 'username' in configuration:
+            self.username = configuration['username']
+            self.login_params = {
+                'username': configuration['username'],
+                'password': configuration['password'],
+                'eauth': 'pam'
+            }
+        self.login_url = self.url + "/login"
+        self.max_concurrency = int(configuration.get(
+            'max_concurrency', DEFAULT_MAX_CONCURRENCY))
+        max_in_flight = int(configuration.get(
+            'max_in_flight', DEFAULT_MAX_IN_FLIGHT))
+        if max_in_flight > 0:
+            self.max_concurrency = min(self.max_concurrency, max_in_flight)
+        self.poll_interval = float(configuration.get(
+            'poll_interval', DEFAULT_POLL_INTERVAL))
+        self.poll_max_interval = float(configuration.get(
+            'poll_max_interval', DEFAULT_POLL_MAX_INTERVAL))
+        self.connect_timeout = float(configuration.get(
+            'connect_timeout', DEFAULT_CONNECT_TIMEOUT))
+        self.read_timeout = float(configuration.get(
+            'read_timeout', DEFAULT_READ_TIMEOUT)) or None
+        self.retry_policy = RetryPolicy(
+            retries=configuration.get('retries', DEFAULT_RETRIES),
+            backoff=configuration.get('retry_backoff', DEFAULT_RETRY_BACKOFF),
+            max_backoff=configuration.get(
+                'retry_max_backoff', DEFAULT_RETRY_MAX_BACKOFF))
+        self.breaker = CircuitBreaker(
+            threshold=configuration.get(
+                'breaker_threshold', DEFAULT_BREAKER_THRESHOLD),
+            reset=configuration.get('breaker_reset', DEFAULT_BREAKER_RESET))
+        # Requests per second, in flight they are bounded by the semaphore
+        self.rate_limiter = TokenBucket(
+            rate=configuration.get('rate_limit', DEFAULT_RATE_LIMIT),
+            burst=configuration.get('rate_burst'))
+        # Every request is reported to the hooks, see add_hook()
+        self.metrics = MetricsCollector()
+        self.hooks = [self.metrics]
+        self.output_limiter = OutputLimiter(
+            head=configuration.get('output_head', DEFAULT_OUTPUT_HEAD),
+            tail=configuration.get('output_tail', DEFAULT_OUTPUT_TAIL),
+            spool_dir=configuration.get('output_spool_dir'))
+        # (minion, path) of the files known to be staged
+        self.staged = set()
+        # Grains lookups, cached unless the TTL is 0
+        self.grains_timeout = configuration.get('grains_timeout')
+        self.grains_master_cache = __as_bool__(
+            configuration.get('grains_master_cache', True))
+        self.grains_cache = None
+        grains_ttl = float(configuration.get('grains_ttl', DEFAULT_GRAINS_TTL))
+        if grains_ttl > 0:
+            self.grains_cache = GrainsCache(
+                ttl=grains_ttl,
+                missing_ttl=float(configuration.get(
+                    'grains_missing_ttl', DEFAULT_GRAINS_MISSING_TTL)),
+                path=configuration.get('grains_cache_file'))
+        # Bound to the running loop on first use
+        self.session = None
+        self.semaphore = None
+        self.token_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def add_hook(self, hook: Callable[[RequestEvent], None]):
+        """
+        Same as salt_api_client.add_hook().
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[RequestEvent], None]):
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    async def run_cmd(self, tgt, method: str, arg=None, kwarg=None,
+                      batch=None, batch_wait=None, tgt_type: str = 'list'):
+        params = {
+            'client': 'local', 'fun': method, 'tgt': tgt, 'tgt_type': tgt_type
+        }
+        if arg:
+            params['arg'] = arg
+        if kwarg:
+            params['kwarg'] = kwarg
+        if batch:
+            params['client'] = 'local_batch'
+            params['batch'] = str(batch)
+            if batch_wait:
+                params['batch_wait'] = batch_wait
+            result = dict()
+            for returned in await self.run_many([params]):
+                result.update(returned or {})
+        else:
+            result = (await self.run_many([params]))[0]
+        if isinstance(result, dict):
+            result = {name: self.output_limiter.limit(name, output)
+                      for name, output in result.items()}
+        return result
+
+    async def async_run_cmd(self, tgt, method: str, arg=None, kwarg=None,
+                            tgt_type: str = 'list'):
+        params = {
+            'client': 'local_async', 'fun': method, 'tgt': tgt,
+            'tgt_type': tgt_type
+        }
+        if arg:
+            params['arg'] = arg
+        if kwarg:
+            params['kwarg'] = kwarg
+        return (await self.run_many([params]))[0]['jid']
+
+    async def get_async_cmd_result(self, jid: str):
+        return (await self.run_many([
+            {'client': 'runner', 'fun': 'jobs.lookup_jid', 'jid': jid}]))[0]
+
+    async def async_cmd_exit_success(self, jid: str):
+        return (await self.run_many([
+            {'client': 'runner', 'fun': 'jobs.exit_success', 'jid': jid}]))[0]
+
+    async def get_grains_get(self, tgt, item, tgt_type: str = 'list'):
+        """
+        Same contract as salt_api_client.get_grains_get().
+        """
+        if tgt_type != 'list' or not isinstance(tgt, list):
+            return await self.__live_grains_get__(tgt, item, tgt_type)
+
+        if self.grains_cache is not None:
+            result, missing = self.grains_cache.get(item, tgt)
+        else:
+            result, missing = dict(), list(tgt)
+
+        if missing and self.grains_master_cache:
+            cached = await self.get_cached_grains_get(missing, item)
+            if self.grains_cache is not None:
+                self.grains_cache.update(item, cached)
+            result.update(cached)
+            missing = [name for name in missing if name not in cached]
+
+        if missing:
+            live = await self.__live_grains_get__(missing, item)
+            if self.grains_cache is not None:
+                self.grains_cache.update(item, live, missing)
+            result.update(live)
+        return result
+
+    async def get_cached_grains_get(self, tgt, item,
+                                    tgt_type: str = 'list'):
+        """
+        Same contract as salt_api_client.get_cached_grains_get().
+        """
+        cached = (await self.run_many([{
+            'client': 'runner', 'fun': 'cache.grains', 'tgt': tgt,
+            'tgt_type': tgt_type
+        }]))[0]
+        return __cached_grains_values__(cached, item)
+
+    async def run_many(self, chunks: List[Dict[str, Any]]) -> List[Any]:
+        if not chunks:
+            return []
+        await self.__check_token__()
+        return await self.__post__(self.url, list(chunks))
+
+    async def stage_file(self, tgt: List[str], path: str, content: str,
+                         mode: str = None) -> List[str]:
+        """
+        Same contract as salt_api_client.stage_file().
+        """
+        tgt = [name for name in tgt if (name, path) not in self.staged]
+        if not tgt:
+            return []
+        hashes = await self.run_cmd(
+            tgt, 'file.get_hash', [path, 'sha256']) or {}
+        missing = __unstaged_minions__(tgt, hashes, content)
+        written = dict()
+        if missing:
+            written = (await self.run_many(
+                __stage_chunks__(missing, path, content, mode)))[1] or {}
+        failures = __write_failures__(missing, written)
+        self.staged.update(
+            (name, path) for name in hashes if name not in failures)
+        __check_staged__(path, failures)
+        return missing
+
+    async def wait_for_jobs(self, jids: Dict[str, List[str]],
+                            timeout: float) \
+            -> Tuple[Dict[str, JobReturn], Dict[str, List[str]]]:
+        """
+        Same contract as salt_api_client.wait_for_jobs(), each poll round
+        spreads the pending jobs over concurrent requests.
+        """
+        deadline = time.time() + timeout
+        pending = {jid: list(names) for jid, names in jids.items()}
+        returns = dict()
+        interval = self.poll_interval
+
+        while True:
+            polled, pending = await self.poll_jobs(pending)
+            returns.update((r.minion, r) for r in polled)
+
+            remaining = deadline - time.time()
+            if not pending or remaining <= 0:
+                break
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(
+                interval * DEFAULT_POLL_BACKOFF, self.poll_max_interval)
+
+        return returns, pending
+
+    async def poll_jobs(self, jids: Dict[str, List[str]]) \
+            -> Tuple[List[JobReturn], Dict[str, List[str]]]:
+        """
+        A single poll round of the given jobs, spread over concurrent
+        requests.
+        return:
+            the returns of the minions that reported and the minions still
+            pending by jid
+        """
+        polled = list(jids.items())
+        batches = [polled[i:i + DEFAULT_POLL_BATCH_SIZE]
+                   for i in range(0, len(polled), DEFAULT_POLL_BATCH_SIZE)]
+        results = await asyncio.gather(*[
+            self.run_many([
+                chunk for jid, _ in batch for chunk in (
+                    {'client': 'runner', 'fun': 'jobs.lookup_jid',
+                     'jid': jid},
+                    {'client': 'runner', 'fun': 'jobs.exit_success',
+                     'jid': jid})
+            ]) for batch in batches])
+
+        returns = []
+        pending = dict()
+        for batch, result in zip(batches, results):
+            for index, (jid, names) in enumerate(batch):
+                outputs = result[2 * index]
+                exit_success = result[2 * index + 1]
+                for name in names:
+                    if name in outputs:
+                        returns.append(JobReturn(
+                            jid, name, exit_success.get(name, False),
+                            self.output_limiter.limit(
+                                name, outputs[name], jid)))
+                names = [n for n in names if n not in outputs]
+                if names:
+                    pending[jid] = names
+        return returns, pending
+
+    ###########################################################################
+    # Private methods
+    ###########################################################################
+    def __bind__(self):
+        if self.session is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.token_lock = asyncio.Lock()
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency, ssl=False))
+
+    async def __post__(self, url: str, params,
+                       retry_on_unauthorized: bool = True) -> List[Any]:
+        """
+        Same retries and circuit breaker as
+        salt_api_client.__get_http_returns__().
+        """
+        self.__bind__()
+        sent_token = self.token
+        send_data = json.dumps(params)
+        idempotent = url == self.login_url or is_idempotent(params)
+        attempt = 0
+        while True:
+            self.breaker.check()
+            try:
+                status, result = await self.__post_once__(
+                    url, params, send_data,
+                    retry=attempt > 0 or not retry_on_unauthorized)
+                break
+            except TransientError as x:
+                self.breaker.failure()
+                if not self.retry_policy.should_retry(attempt, x, idempotent):
+                    raise FailedActivity(str(x))
+                logger.debug("Retrying the Salt API request: {}".format(x))
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+            except BaseException:
+                self.breaker.release()
+                raise
+        self.breaker.success()
+
+        if status == 401:
+            if url == self.login_url:
+                raise FailedActivity(
+                    "Salt API refused the login of user '{}'".format(
+                        self.username))
+            if self.useToken is True or not retry_on_unauthorized:
+                raise FailedActivity(
+                    "Salt API refused the authentication token")
+            async with self.token_lock:
+                if self.token == sent_token:
+                    await self.__obtain_token__()
+            return await self.__post__(
+                url, params, retry_on_unauthorized=False)
+        return result['return']
+
+    async def __post_once__(self, url: str, params, send_data: str,
+                            retry: bool) -> Tuple[int, Any]:
+        status = 0
+        response_bytes = 0
+        async with self.semaphore:
+            await self.__pace__()
+            started = time.time()
+            try:
+                async with self.session.post(
+                        url, data=send_data, headers=self.headers,
+                        timeout=self.__timeout__(params)) as response:
+                    status = response.status
+                    reason = response.reason
+                    body = await response.read()
+                    response_bytes = len(body)
+            except asyncio.TimeoutError as x:
+                # aiohttp does not tell connect and read timeouts apart
+                raise TransientError(
+                    "Salt API did not answer on time: {}".format(x))
+            except aiohttp.ClientConnectorError as x:
+                raise TransientError(
+                    "Salt API connection failed: {}".format(x), sent=False)
+            except aiohttp.ClientError as x:
+                raise TransientError(
+                    "Salt API connection failed: {}".format(x))
+            finally:
+                self.__notify_hooks__(RequestEvent(
+                    *self.__request_labels__(url, params), status=status,
+                    latency=time.time() - started,
+                    request_bytes=len(send_data),
+                    response_bytes=response_bytes, retry=retry))
+
+        if status >= 500:
+            raise TransientError("Salt API answered {} {}".format(
+                status, reason))
+        if status == 401:
+            return status, None
+        if status >= 400:
+            raise FailedActivity("Salt API answered {} {}".format(
+                status, reason))
+        try:
+            return status, json.loads(body.decode("utf-8"))
+        except ValueError:
+            raise TransientError(
+                "Salt API returned an invalid response: {}".format(
+                    body[:200]))
+
+    async def __live_grains_get__(self, tgt, item, tgt_type: str = 'list'):
+        params = {
+            'client': 'local', 'fun': 'grains.get', 'tgt': tgt, 'arg': item,
+            'tgt_type': tgt_type
+        }
+        if self.grains_timeout:
+            # Do not wait the master default for minions that are down
+            params['timeout'] = int(self.grains_timeout)
+        return (await self.run_many([params]))[0]
+
+    async def __pace__(self):
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def __timeout__(self, params) -> 'aiohttp.ClientTimeout':
+        # batches keep the request open until every batch ran
+        read_timeout = self.read_timeout
+        if lowstate_labels(params)[0] == 'local_batch':
+            read_timeout = None
+        return aiohttp.ClientTimeout(
+            sock_connect=self.connect_timeout, sock_read=read_timeout)
+
+    def __request_labels__(self, url: str, params) -> Tuple[str, str]:
+        if url == self.login_url:
+            return 'login', ''
+        return lowstate_labels(params)
+
+    def __notify_hooks__(self, event: RequestEvent):
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception as x:
+                logger.debug("Salt API hook {} failed: {}".format(hook, x))
+
+    async def __obtain_token__(self):
+        login = (await self.__post__(self.login_url, self.login_params))[0]
+        self.token = login.get('token')
+        self.token_expire = float(login.get('expire', 0))
+        self.headers['X-Auth-Token'] = self.token
+
+    async def __check_token__(self):
+        if self.useToken is True:
+            return
+        self.__bind__()
+        async with self.token_lock:
+            if self.token is None or \
+                    time.time() >= self.token_expire - TOKEN_EXPIRY_MARGIN:
+                await self.__obtain_token__()
+
+
+class SyncSaltApiClient:
+    """
+    Blocking façade over an AsyncSaltApiClient so the actions can drive it
+    like a salt_api_client. The coroutines run on a private event loop
+    thread, calls may come from any thread and overlap on the wire.
+    """
+    def __init__(self, configuration: Configuration):
+        self.client = AsyncSaltApiClient(configuration)
+        self.metrics = self.client.metrics
+        self.closed = False
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="salt-api-asyncio",
+            daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.__run__(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def add_hook(self, hook: Callable[[RequestEvent], None]):
+        self.client.add_hook(hook)
+
+    def remove_hook(self, hook: Callable[[RequestEvent], None]):
+        self.client.remove_hook(hook)
+
+    def run_cmd(self, tgt, method: str, arg=None, kwarg=None, batch=None,
+                batch_wait=None, tgt_type: str = 'list'):
+        return self.__run__(self.client.run_cmd(
+            tgt, method, arg, kwarg, batch, batch_wait, tgt_type))
+
+    def async_run_cmd(self, tgt, method: str, arg=None, kwarg=None,
+                      tgt_type: str = 'list'):
+        return self.__run__(
+            self.client.async_run_cmd(tgt, method, arg, kwarg, tgt_type))
+
+    def get_async_cmd_result(self, jid: str):
+        return self.__run__(self.client.get_async_cmd_result(jid))
+
+    def async_cmd_exit_success(self, jid: str):
+        return self.__run__(self.client.async_cmd_exit_success(jid))
+
+    def get_grains_get(self, tgt, item, tgt_type: str = 'list'):
+        return self.__run__(self.client.get_grains_get(tgt, item, tgt_type))
+
+    def get_cached_grains_get(self, tgt, item, tgt_type: str = 'list'):
+        return self.__run__(
+            self.client.get_cached_grains_get(tgt, item, tgt_type))
+
+    def run_many(self, chunks: List[Dict[str, Any]]) -> List[Any]:
+        return self.__run__(self.client.run_many(chunks))
+
+    def stage_file(self, tgt: List[str], path: str, content: str,
+                   mode: str = None) -> List[str]:
+        return self.__run__(
+            self.client.stage_file(tgt, path, content, mode))
+
+    def wait_for_jobs(self, jids: Dict[str, List[str]], timeout: float) \
+            -> Tuple[Dict[str, JobReturn], Dict[str, List[str]]]:
+        return self.__run__(self.client.wait_for_jobs(jids, timeout))
+
+    def iter_job_returns(self, jids: Dict[str, List[str]], timeout: float,
+                         use_events: bool = None) -> Iterator[JobReturn]:
+        """
+        Same contract as salt_api_client.iter_job_returns(), the returns of
+        each poll round are yielded as soon as the round completes. The
+        asyncio client only polls.
+        """
+        if use_events:
+            raise FailedActivity(
+                "the asyncio Salt API client does not follow the event "
+                "stream, collect job returns by polling")
+        deadline = time.time() + timeout
+        pending = {jid: list(names) for jid, names in jids.items()}
+        interval = self.client.poll_interval
+
+        while True:
+            polled, pending = self.__run__(self.client.poll_jobs(pending))
+            yield from polled
+
+            remaining = deadline - time.time()
+            if not pending or remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+            interval = min(interval * DEFAULT_POLL_BACKOFF,
+                           self.client.poll_max_interval)
+
+    def __run__(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(
+            coroutine, self.loop).result()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Measure how the machine actions scale with the number of minions, against
+the in-process salt-api of chaossaltstack.testing.
+
+    $ chaossaltstack-benchmark --minions 10,100,1000 --output results.json
+    $ chaossaltstack-benchmark --baseline results.json
+
+For each action and number of minions, the report holds the wall time
+spent outside the fault window (dispatch and collection), the HTTP
+requests served, the bytes of the request and response bodies and the
+peak RSS of the controller. Each action runs in a fresh process while the
+simulator stays in this one, so the peak RSS is that of the run alone.
+Compared to a `--baseline`, any metric growing by more than `--tolerance`
+is a regression and the command exits with 1.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import logzero
+
+from . import close_saltstack_api_clients
+from .machine import actions
+from .testing import FakeSaltApi
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    HAS_RESOURCE = False
+
+__all__ = ["main", "run_benchmark", "find_regressions"]
+
+DEFAULT_ACTIONS = ["burn_cpu", "network_latency"]
+DEFAULT_MINIONS = [10, 100, 1000, 10000]
+DEFAULT_DURATION = 1
+DEFAULT_TOLERANCE = 0.25
+
+# Metrics compared against a baseline, and the slack each one is granted on
+# top of the tolerance so tiny values do not flap
+COMPARED_METRICS = {
+    "overhead_seconds": 0.05,
+    "requests": 2,
+    "bytes": 1024,
+    "peak_rss_kib": 10240
+}
+
+
+def run_benchmark(action: str, minions: int,
+                  duration: int = DEFAULT_DURATION,
+                  configuration: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Run an action once on `minions` simulated minions, each taking the
+    whole `duration` to run the fault, and measure it.
+
+    The action runs in a child process of its own, see __run_action__(),
+    so neither the simulator nor the previous runs weigh on its peak RSS.
+    """
+    configuration = dict(configuration or {})
+    with FakeSaltApi(minions=minions, latency=duration, seed=0) as salt_api:
+        pool = multiprocessing.get_context("spawn").Pool(1)
+        try:
+            wall, peak_rss_kib = pool.apply(__run_action__, (
+                action, salt_api.minion_ids, duration, configuration,
+                salt_api.secrets(), logzero.logger.level))
+        finally:
+            pool.terminate()
+            pool.join()
+        stats = salt_api.stats()
+
+    return {
+        "action": action,
+        "minions": minions,
+        "duration": duration,
+        "wall_seconds": round(wall, 3),
+        "overhead_seconds": round(max(wall - duration, 0), 3),
+        "requests": stats["requests"],
+        "bytes": stats["bytes_received"] + stats["bytes_sent"],
+        "peak_rss_kib": peak_rss_kib
+    }
+
+
+def find_regressions(results: List[Dict[str, Any]],
+                     baseline: List[Dict[str, Any]],
+                     tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    The metrics of `results` that grew by more than `tolerance` since the
+    `baseline` run of the same action and number of minions.
+    """
+    baselines = {(b["action"], b["minions"]): b for b in baseline}
+    regressions = []
+    for result in results:
+        before = baselines.get((result["action"], result["minions"]))
+        if before is None:
+            continue
+        for metric, slack in COMPARED_METRICS.items():
+            if result.get(metric) is None or before.get(metric) is None:
+                continue
+            if result[metric] > before[metric] * (1 + tolerance) + slack:
+                regressions.append(
+                    "{} on {} minions: {} went from {} to {}".format(
+                        result["action"], result["minions"], metric,
+                        before[metric], result[metric]))
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    args = __parse_args__(argv)
+    logzero.loglevel(logging.WARNING)
+
+    results = []
+    for minions in args.minions:
+        for action in args.actions:
+            result = run_benchmark(
+                action, minions, args.duration, args.configuration)
+            results.append(result)
+            print("{action:<20} {minions:>6} minions  "
+                  "overhead {overhead_seconds:>8.3f}s  "
+                  "requests {requests:>6}  bytes {bytes:>12}  "
+                  "peak RSS {peak_rss_kib} KiB".format(**result))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: {}".format(regression), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+###############################################################################
+# Private helper functions
+###############################################################################
+def __parse_args__(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="chaossaltstack-benchmark",
+        description="Benchmark the SaltStack machine actions against "
+                    "simulated minions")
+    parser.add_argument(
+        "--actions", type=__csv__, default=DEFAULT_ACTIONS,
+        help="comma separated actions to run, from {}".format(
+            ", ".join(actions.__all__)))
+    parser.add_argument(
+        "--minions", type=lambda v: [int(n) for n in __csv__(v)],
+        default=DEFAULT_MINIONS,
+        help="comma separated numbers of simulated minions")
+    parser.add_argument(
+        "--duration", type=int, default=DEFAULT_DURATION,
+        help="seconds the fault lasts on each minion")
+    parser.add_argument(
+        "--configuration", type=json.loads, default={},
+        help="experiment configuration as JSON, e.g. "
+             "'{\"saltstack_use_events\": true}'")
+    parser.add_argument(
+        "--output", help="file the results are saved to as JSON")
+    parser.add_argument(
+        "--baseline", help="JSON results of a previous run to compare to")
+    parser.add_argument(
+        "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+        help="relative growth of a metric reported as a regression")
+    args = parser.parse_args(argv)
+
+    unknown = [a for a in args.actions if a not in actions.__all__]
+    if unknown:
+        parser.error("unknown actions: {}".format(", ".join(unknown)))
+    return args
+
+
+def __run_action__(action: str, minion_ids: List[str], duration: int,
+                   configuration: Dict[str, Any], secrets: Dict[str, str],
+                   loglevel: int) -> Tuple[float, int]:
+    """
+    Run an action in the benchmark child process, returns its wall time and
+    the peak RSS of the process.
+    """
+    logzero.loglevel(loglevel)
+    started = time.time()
+    try:
+        getattr(actions, action)(
+            instance_ids=minion_ids, execution_duration=str(duration),
+            configuration=configuration, secrets=secrets)
+    finally:
+        wall = time.time() - started
+        close_saltstack_api_clients()
+    return wall, __peak_rss_kib__()
+
+
+def __csv__(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def __peak_rss_kib__():
+    # ru_maxrss survives fork and exec on Linux, so a spawned process would
+    # report the peak of its parent, the high-water mark of its own memory
+    # does not
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if not HAS_RESOURCE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kibibytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+if __name__ == "__main__":
+    sys.exit(main())
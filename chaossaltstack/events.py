@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import json
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError, as_completed
+from typing import Any, Dict, Iterator, List, Tuple
+
+from logzero import logger
+import requests
+
+__all__ = ["JobEventListener"]
+
+# Jobs whose returns are kept while nobody waits for them yet
+DEFAULT_BUFFERED_JOBS = 1024
+
+# Seconds to wait for the event stream before and between connections
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_RECONNECT_DELAY = 1
+
+
+class JobEventListener:
+    """
+    Follow the salt-api server-sent events stream at <salt_url>/events and
+    resolve a future per minion of a job as soon as its
+    `salt/job/<jid>/ret/<minion>` event is published by the master.
+
+    The stream is subscribed once per client, returns of jobs nobody waits
+    for yet are buffered so a job can be dispatched before being watched.
+    A stream the master refuses, with a 4xx status, is given up for good and
+    `connected` is never set again, callers then poll the master instead.
+    """
+    def __init__(self, client, buffered_jobs: int = DEFAULT_BUFFERED_JOBS):
+        self.client = client
+        self.buffered_jobs = buffered_jobs
+        self.lock = threading.Lock()
+        self.connected = threading.Event()
+        # set once the first connection attempt is over, whatever its outcome
+        self.settled = threading.Event()
+        self.running = False
+        self.refused = False
+        self.thread = None
+        self.response = None
+        # {jid: {minion: JobReturn}} and {jid: {minion: Future}}
+        self.returns = OrderedDict()
+        self.futures = dict()
+
+    def start(self, timeout: float = DEFAULT_CONNECT_TIMEOUT):
+        """
+        Subscribe to the event stream, waiting until it is connected so no
+        return of a job dispatched afterwards can be missed.
+
+        Only the first subscription waits, at most `timeout` seconds, later
+        calls return right away whether the stream is connected or not.
+        """
+        with self.lock:
+            if not self.running and not self.refused:
+                self.running = True
+                self.thread = threading.Thread(
+                    target=self.__follow__, name="salt-api-events",
+                    daemon=True)
+                self.thread.start()
+        if self.settled.is_set():
+            return
+        if not self.settled.wait(timeout):
+            logger.warning(
+                "salt-api event stream not connected after {}s".format(
+                    timeout))
+        self.settled.set()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            response = self.response
+        if response is not None:
+            # Closing alone would wait for the reader blocked on the stream
+            connection = getattr(response.raw, "connection", None)
+            sock = getattr(connection, "sock", None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            response.close()
+
+    def watch(self, jid: str, minions: List[str]) -> Dict[str, Future]:
+        """
+        Futures resolved with the JobReturn of each minion of a job.
+        """
+        futures = dict()
+        with self.lock:
+            returned = self.returns.get(jid, {})
+            watched = self.futures.setdefault(jid, {})
+            for minion in minions:
+                future = watched.setdefault(minion, Future())
+                if minion in returned and not future.done():
+                    future.set_result(returned[minion])
+                futures[minion] = future
+        return futures
+
+    def wait(self, jids: Dict[str, List[str]], timeout: float) \
+            -> Tuple[Dict[str, Any], Dict[str, List[str]]]:
+        """
+        Same contract as salt_api_client.wait_for_jobs() but driven by the
+        events, no request is issued while waiting.
+        """
+        returns = dict()
+        pending = {jid: list(minions) for jid, minions in jids.items()}
+        for job_return in self.iter_returns(jids, timeout):
+            returns[job_return.minion] = job_return
+            pending[job_return.jid].remove(job_return.minion)
+        return returns, {jid: minions for jid, minions in pending.items()
+                         if minions}
+
+    def iter_returns(self, jids: Dict[str, List[str]], timeout: float) \
+            -> Iterator[Any]:
+        """
+        Yield the JobReturn of each minion of the given jobs in the order
+        they are published, until all are or the timeout elapsed.
+        """
+        futures = dict()
+        for jid, minions in jids.items():
+            for minion, future in self.watch(jid, minions).items():
+                futures[future] = (jid, minion)
+
+        try:
+            for future in as_completed(list(futures),
+                                       timeout=max(timeout, 0)):
+                yield future.result()
+        except TimeoutError:
+            pass
+        finally:
+            with self.lock:
+                for jid in jids:
+                    self.futures.pop(jid, None)
+                    self.returns.pop(jid, None)
+
+    ###########################################################################
+    # Private methods
+    ###########################################################################
+    def __follow__(self):
+        while self.running:
+            try:
+                self.__consume__()
+            except requests.exceptions.HTTPError as x:
+                self.connected.clear()
+                if x.response is not None and x.response.status_code < 500:
+                    # reconnecting would be refused the same way
+                    logger.warning(
+                        "salt-api event stream refused, job returns are "
+                        "polled instead: {}".format(x))
+                    with self.lock:
+                        self.refused = True
+                        self.running = False
+                    self.settled.set()
+                    return
+                logger.debug(
+                    "salt-api event stream interrupted: {}".format(x))
+            except Exception as x:
+                if self.running:
+                    logger.debug(
+                        "salt-api event stream interrupted: {}".format(x))
+            self.connected.clear()
+            self.settled.set()
+            if self.running:
+                time.sleep(DEFAULT_RECONNECT_DELAY)
+
+    def __consume__(self):
+        self.client.__check_token__()
+        response = self.client.session.get(
+            self.client.url + "/events",
+            headers=self.client.__request_headers__(),
+            stream=True, timeout=(DEFAULT_CONNECT_TIMEOUT, None))
+        response.raise_for_status()
+        with self.lock:
+            self.response = response
+        self.connected.set()
+        self.settled.set()
+
+        data = []
+        for line in response.iter_lines(chunk_size=None,
+                                        decode_unicode=True):
+            if not self.running:
+                break
+            if line:
+                if line.startswith("data:"):
+                    data.append(line[5:].strip())
+                continue
+            # A blank line ends an event
+            if data:
+                self.__dispatch__("\n".join(data))
+                data = []
+
+    def __dispatch__(self, payload: str):
+        from . import JobReturn
+
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        parts = event.get("tag", "").split("/")
+        # salt/job/<jid>/ret/<minion>
+        if len(parts) < 5 or parts[:2] != ["salt", "job"] or \
+                parts[3] != "ret":
+            return
+
+        jid, minion = parts[2], "/".join(parts[4:])
+        data = event.get("data", {})
+        success = data.get("success", True) is not False and \
+            data.get("retcode", 0) == 0
+        job_return = JobReturn(
+            jid, minion, success,
+            self.client.output_limiter.limit(minion, data.get("return"), jid))
+
+        with self.lock:
+            self.returns.setdefault(jid, {})[minion] = job_return
+            self.returns.move_to_end(jid)
+            while len(self.returns) > self.buffered_jobs:
+                self.returns.popitem(last=False)
+            future = self.futures.get(jid, {}).get(minion)
+            if future is not None and not future.done():
+                future.set_result(job_return)
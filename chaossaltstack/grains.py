@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import os.path
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from logzero import logger
+
+__all__ = ["GrainsCache"]
+
+# Seconds a grains value, or the absence of answer of a minion, is trusted
+DEFAULT_GRAINS_TTL = 300
+DEFAULT_GRAINS_MISSING_TTL = 60
+
+
+class GrainsCache:
+    """
+    Time bounded cache of grains values per minion, so repeated lookups of
+    the same grains (e.g. `kernel`) do not query the minions again.
+
+    Minions that did not answer are remembered for `missing_ttl` seconds,
+    so an offline minion does not stall every lookup until it comes back.
+    When a `path` is given, the cache is loaded from and saved to that JSON
+    file and survives the process.
+    """
+    def __init__(self, ttl: float = DEFAULT_GRAINS_TTL,
+                 missing_ttl: float = DEFAULT_GRAINS_MISSING_TTL,
+                 path: str = None):
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.path = path
+        self.lock = threading.Lock()
+        # {item: {minion: [found, value, timestamp]}}
+        self.entries = dict()
+        if path:
+            self.__load__()
+
+    def get(self, item: str, minions: List[str]) \
+            -> Tuple[Dict[str, Any], List[str]]:
+        """
+        The cached values of a grains item and the minions to query live.
+        Minions recently known as not answering are in neither.
+        """
+        now = time.time()
+        found = dict()
+        missing = []
+        with self.lock:
+            entries = self.entries.get(item, {})
+            for minion in minions:
+                entry = entries.get(minion)
+                if entry is not None:
+                    answered, value, timestamp = entry
+                    ttl = self.ttl if answered else self.missing_ttl
+                    if now - timestamp < ttl:
+                        if answered:
+                            found[minion] = value
+                        continue
+                missing.append(minion)
+        return found, missing
+
+    def update(self, item: str, values: Dict[str, Any],
+               queried: List[str] = None):
+        """
+        Store the values returned by a live lookup, queried minions that are
+        not in `values` are recorded as not answering.
+        """
+        now = time.time()
+        with self.lock:
+            entries = self.entries.setdefault(item, {})
+            for minion, value in values.items():
+                entries[minion] = [True, value, now]
+            for minion in queried or []:
+                if minion not in values:
+                    entries[minion] = [False, None, now]
+            if self.path:
+                self.__save__()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.path:
+                self.__save__()
+
+    ###########################################################################
+    # Private methods
+    ###########################################################################
+    def __load__(self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as x:
+            logger.warning("Ignoring grains cache file {}: {}".format(
+                self.path, x))
+
+    def __save__(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as x:
+            logger.warning("Could not save grains cache file {}: {}".format(
+                self.path, x))
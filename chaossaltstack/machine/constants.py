@@ -7,3 +7,62 @@ BURN_CPU = "cpu_stress_test"
 BURN_IO = "burn_io"
 FILL_DISK = "fill_disk"
 NETWORK_UTIL = "network_advanced"
+
+# Prefix of each target type within a compound target
+COMPOUND_PREFIXES = {
+    "glob": "",
+    "compound": "",
+    "grain": "G@",
+    "grain_pcre": "P@",
+    "pillar": "I@",
+    "pillar_pcre": "J@",
+    "pcre": "E@",
+    "ipcidr": "S@",
+    "nodegroup": "N@"
+}
+
+# Rendered by each minion so one job can target many of them
+MINION_ID_GRAIN = "{{ grains['id'] }}"
+SCRIPT_KWARG = {"template": "jinja"}
+
+# Seconds granted to the minions on top of the execution duration
+DEFAULT_JOB_GRACE = 30
+
+# Threads dispatching and collecting jobs, and jobs each of them waits for
+DEFAULT_MAX_WORKERS = 8
+JOBS_PER_WORKER = 50
+
+# Scripts kept in memory, one per action and OS
+SCRIPT_CACHE_SIZE = 32
+
+# Where the minions keep the scripts staged by `saltstack_stage_scripts`:
+# under the default minion cachedir, which only the minion user can write
+# to, never a shared temporary directory, since the scripts are sourced as
+# that user
+STAGE_DIRS = {
+    OS_LINUX: "/var/cache/salt/minion/chaossaltstack",
+    OS_WINDOWS: "C:\\ProgramData\\Salt Project\\Salt\\var\\cache\\salt"
+                "\\minion\\chaossaltstack"
+}
+# Mode of the staging directory, Windows ones inherit the ACL of the cachedir
+STAGE_DIR_MODES = {
+    OS_LINUX: "0700"
+}
+
+# Runs a script and prints at most its first {head} and last {tail} bytes of
+# output, keeping its exit status
+BOUNDED_OUTPUT_LINUX = """__output=$(mktemp)
+(
+{script}
+) > "$__output" 2>&1
+__status=$?
+__size=$(wc -c < "$__output")
+if [ "$__size" -gt {limit} ]; then
+head -c {head} "$__output"
+printf '\\n... [%s bytes truncated] ...\\n' $((__size - {limit}))
+tail -c {tail} "$__output"
+else
+cat "$__output"
+fi
+rm -f "$__output"
+exit $__status"""
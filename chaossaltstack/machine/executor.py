@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+"""
+The fault execution engine behind every machine action: the machines are
+looked up, one script is rendered per OS, its jobs are dispatched and the
+returns of the minions are collected.
+
+How jobs are dispatched and collected are strategies picked through the
+experiment configuration:
+
+- `saltstack_dispatch`: "threaded", jobs submitted on a pool of
+  `saltstack_max_workers` threads (default), or "serial", one after the
+  other. A `batch_size` makes it "batched": the master paces the minions
+  and the returns come back with the call
+- `saltstack_collect`: "auto", the client setting (default), "polling" of
+  the master job cache or "events", the salt-api event stream
+"""
+import hashlib
+import ntpath
+import os
+import json
+import posixpath
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Union
+
+from chaoslib.exceptions import FailedActivity
+from chaoslib.types import Configuration, Secrets
+from logzero import logger
+
+from .. import saltstack_api_client, __as_bool__
+from ..metrics import export_metrics, summarize
+from ..output import DEFAULT_OUTPUT_HEAD, DEFAULT_OUTPUT_TAIL
+from ..tracing import Tracer
+from .constants import OS_LINUX, OS_WINDOWS, COMPOUND_PREFIXES, \
+    BOUNDED_OUTPUT_LINUX
+from .constants import MINION_ID_GRAIN, SCRIPT_KWARG, DEFAULT_JOB_GRACE, \
+    DEFAULT_MAX_WORKERS, JOBS_PER_WORKER, SCRIPT_CACHE_SIZE, STAGE_DIRS, \
+    STAGE_DIR_MODES
+
+__all__ = ["run_fault", "DISPATCH_STRATEGIES", "COLLECT_STRATEGIES",
+           "CollectStrategy"]
+
+
+def run_fault(name: str, action: str, parameters: Dict[str, Any],
+              instance_ids: Union[List[str], str] = None,
+              execution_duration: str = "60",
+              tgt_type: str = "list",
+              batch_size: str = None,
+              batch_wait: int = None,
+              configuration: Configuration = None,
+              secrets: Secrets = None):
+    """
+    Run the `action` script, e.g. BURN_CPU, with its `parameters` on the
+    targeted machines and wait for all of them to report, at most
+    `execution_duration` seconds and `saltstack_job_grace`.
+
+    `name` is the activity the fault is reported as. Raises FailedActivity
+    when no machine reported or when any of them failed.
+    """
+    logger.debug(
+        "Start {}: configuration='{}', instance_ids='{}'".format(
+            name, configuration, instance_ids))
+
+    tracer = Tracer.from_configuration(configuration)
+    try:
+        with tracer.span(name, tgt_type=tgt_type):
+            client = saltstack_api_client(secrets, configuration)
+            requests_before = client.metrics.snapshot()
+            tracer.follow(client)
+            with tracer.span("grains"):
+                machines = client.get_grains_get(
+                    instance_ids, 'kernel', tgt_type)
+            if not machines:
+                raise FailedActivity(
+                    "Cannot find any machines {}".format(instance_ids))
+
+            # One job per OS, the minion id is rendered on each minion
+            scripts = []
+            for os_type, names in __group_by_os__(machines).items():
+                with tracer.span("render", os=os_type):
+                    script_content = __prepare_script__(
+                        client, names, action, os_type, parameters,
+                        configuration)
+                logger.debug("{} of machines: {}".format(name, names))
+                target = __os_target__(instance_ids, tgt_type, os_type, names)
+                scripts.append((names, script_content, target))
+
+            returned, failures = __run_scripts__(
+                client, scripts, execution_duration, configuration,
+                batch_size, batch_wait, since=requests_before,
+                tracer=tracer)
+    except Exception as x:
+        raise FailedActivity(
+            "failed issuing a execute of shell script via salt API {}".format(
+                str(x)
+            ))
+
+    if not returned:
+        raise FailedActivity(
+            "{} operation did not finish on time. ".format(name)
+        )
+
+    if failures:
+        raise FailedActivity(
+            "One of experiments are failed among : {} ".format(failures)
+        )
+
+
+###############################################################################
+# Private helper functions
+###############################################################################
+def __group_by_os__(machines):
+    """
+    Group the minions returned by a `kernel` grains lookup per OS.
+    """
+    groups = dict()
+    for name, os_type in machines.items():
+        groups.setdefault(os_type, []).append(name)
+    return groups
+
+
+def __os_target__(instance_ids, tgt_type, os_type, names):
+    """
+    The (tgt, tgt_type) of the job of the machines of an OS: the minions
+    themselves when they were listed, otherwise the target expression
+    narrowed to the OS so the master resolves it again and the request
+    does not grow with the number of minions.
+    """
+    if tgt_type == "list":
+        return names, "list"
+    if tgt_type not in COMPOUND_PREFIXES:
+        raise FailedActivity(
+            "Unsupported target type: {}".format(tgt_type))
+    return "G@kernel:{} and ( {}{} )".format(
+        os_type, COMPOUND_PREFIXES[tgt_type], instance_ids), "compound"
+
+
+def __run_scripts__(client, scripts, execution_duration, configuration,
+                    batch_size=None, batch_wait=None, since=None, tracer=None):
+    """
+    Run each (minions, script, target) job and wait for its minions to report,
+    returns the number of minions that reported and the output of those that
+    failed, by minion.
+
+    Jobs are dispatched and collected following the `saltstack_dispatch`
+    and `saltstack_collect` strategies. With a `batch_size` the master paces
+    each job itself and the call blocks until every batch ran. Jobs then run
+    one after the other so no more than `batch_size` machines run a script
+    at once.
+
+    The Salt API requests sent since the `since` metrics snapshot are then
+    summarized, see __report_requests__(). Each phase is a span of `tracer`.
+    """
+    tracer = tracer or Tracer()
+    try:
+        if batch_size:
+            return __run_batches__(
+                client, scripts, batch_size, batch_wait, tracer)
+
+        # Do async cmd and get jid
+        dispatch = __strategy__(
+            configuration, "saltstack_dispatch", DISPATCH_STRATEGIES)
+        collect = __strategy__(
+            configuration, "saltstack_collect", COLLECT_STRATEGIES)
+        if collect.subscribe is not None:
+            collect.subscribe(client)
+        with tracer.span("dispatch", jobs=len(scripts)):
+            jids = dispatch(client, scripts, configuration, tracer)
+        logger.debug(json.dumps(jids))
+
+        # Wait for every minion to report, at most the duration and a grace
+        dispatched = time.time()
+        try:
+            with tracer.span("collect", jobs=len(jids)):
+                return __collect_results__(
+                    client, jids, execution_duration, configuration, tracer)
+        finally:
+            # when the faults were meant to run, next to the collection
+            tracer.record("fault_window", dispatched, min(
+                dispatched + int(execution_duration), time.time()))
+    finally:
+        __report_requests__(client, since, configuration)
+
+
+def __report_requests__(client, since, configuration):
+    """
+    Log what the Salt API requests of the action cost and, when
+    `saltstack_metrics_file` is set, export every request the client sent
+    to it, in `saltstack_metrics_format` ("prometheus" or "json").
+    """
+    configuration = configuration or {}
+    snapshot = client.metrics.snapshot()
+    logger.info("Salt API: {}".format(summarize(snapshot, since)))
+
+    path = configuration.get("saltstack_metrics_file")
+    if path:
+        export_metrics(snapshot, path, configuration.get(
+            "saltstack_metrics_format", "prometheus"))
+
+
+def __run_batches__(client, scripts, batch_size, batch_wait, tracer):
+    """
+    Run each job through `local_batch`, which drops the exit status of
+    `cmd.run`, so the scripts run with `cmd.run_all`: a minion fails on the
+    same terms as with the other dispatchers, see __collect_results__().
+    """
+    returned = 0
+    failures = dict()
+    missing = []
+    for names, script_content, (tgt, tgt_type) in scripts:
+        with tracer.span("batches", target=tgt, minions=len(names)):
+            returns = client.run_cmd(
+                tgt, 'cmd.run_all', script_content, kwarg=SCRIPT_KWARG,
+                batch=batch_size, batch_wait=batch_wait, tgt_type=tgt_type)
+        for name in names:
+            if name not in returns:
+                missing.append(name)
+                continue
+            returned += 1
+            success, output = __run_all_return__(returns[name])
+            logger.info("{} - {}".format(name, output))
+            if not success or 'fail' in output:
+                failures[name] = output
+
+    if missing:
+        logger.warning("Minions did not return: {}".format(
+            json.dumps(missing)))
+        failures.update((name, None) for name in missing)
+    return returned, failures
+
+
+def __run_all_return__(result):
+    """
+    (success, output) of a `cmd.run_all` return, anything else is the
+    error the minion reported.
+    """
+    if not isinstance(result, dict):
+        return False, str(result)
+    output = "\n".join(
+        stream for stream in (result.get('stdout'), result.get('stderr'))
+        if stream)
+    return result.get('retcode') == 0, output
+
+
+def __dispatch_serial__(client, scripts, configuration, tracer=None):
+    """
+    Submit each (minions, script, target) job in turn, returns
+    {jid: minions}.
+    """
+    tracer = tracer or Tracer()
+    return {
+        __submit__(client, tracer, names, script_content, tgt, tgt_type):
+        names for names, script_content, (tgt, tgt_type) in scripts}
+
+
+def __dispatch_threaded__(client, scripts, configuration, tracer=None):
+    """
+    Submit each (minions, script, target) job through a bounded pool of
+    `saltstack_max_workers` threads, returns {jid: minions}.
+    """
+    jids = dict()
+    if not scripts:
+        return jids
+    tracer = tracer or Tracer()
+    workers = min(__max_workers__(configuration), len(scripts))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            (names, executor.submit(
+                __submit__, client, tracer, names, script_content, tgt,
+                tgt_type))
+            for names, script_content, (tgt, tgt_type) in scripts]
+        for names, future in futures:
+            jids[future.result()] = names
+    return jids
+
+
+def __submit__(client, tracer, names, script_content, tgt, tgt_type):
+    with tracer.span("submit", target=tgt, minions=len(names)):
+        return client.async_run_cmd(
+            tgt, 'cmd.run', script_content, kwarg=SCRIPT_KWARG,
+            tgt_type=tgt_type)
+
+
+def __collect_results__(client, jids, execution_duration, configuration,
+                        tracer=None):
+    """
+    Stream the output of every minion of each job, a minion fails when its
+    job did not exit successfully, when its output reports a failure or when
+    it did not report within the duration plus `saltstack_job_grace`.
+
+    Outputs are logged as they arrive and only those of the minions that
+    failed are kept, returns (number of minions that reported, failures).
+    Many jobs are split in shards followed concurrently by the workers.
+    """
+    configuration = configuration or {}
+    tracer = tracer or Tracer()
+    timeout = int(execution_duration) + int(configuration.get(
+        "saltstack_job_grace", DEFAULT_JOB_GRACE))
+    collect = __strategy__(
+        configuration, "saltstack_collect", COLLECT_STRATEGIES).collect
+
+    items = list(jids.items())
+    size = max(JOBS_PER_WORKER,
+               -(-len(items) // __max_workers__(configuration)))
+    shards = [dict(items[i:i + size]) for i in range(0, len(items), size)]
+    if len(shards) > 1:
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            collected = list(executor.map(
+                lambda shard: __consume_returns__(
+                    client, shard, timeout, tracer, collect),
+                shards))
+    else:
+        collected = [
+            __consume_returns__(client, jids, timeout, tracer, collect)]
+
+    returned = 0
+    failures = dict()
+    pending = dict()
+    for shard_returned, shard_failures, shard_pending in collected:
+        returned += shard_returned
+        failures.update(shard_failures)
+        pending.update(shard_pending)
+
+    if pending:
+        logger.warning("Minions did not finish on time: {}".format(
+            json.dumps(pending)))
+        failures.update(
+            (name, None) for names in pending.values() for name in names)
+    return returned, failures
+
+
+def __consume_returns__(client, jids, timeout, tracer, collect=None):
+    collect = collect or __collect_auto__
+    pending = {jid: set(names) for jid, names in jids.items()}
+    returned = 0
+    failures = dict()
+    started = time.time()
+    for job_return in collect(client, jids, timeout):
+        pending[job_return.jid].discard(job_return.minion)
+        returned += 1
+        output = job_return.output
+        logger.info("{} - {}".format(job_return.minion, output))
+        if not job_return.success or 'fail' in output:
+            failures[job_return.minion] = output
+        if not pending[job_return.jid]:
+            tracer.record("job", started, time.time(), jid=job_return.jid,
+                          minions=len(jids[job_return.jid]))
+
+    # jobs some minions of which never reported
+    for jid, names in pending.items():
+        if names:
+            tracer.record("job", started, time.time(), jid=jid,
+                          minions=len(jids[jid]), pending=len(names))
+
+    pending = {jid: [name for name in jids[jid] if name in names]
+               for jid, names in pending.items() if names}
+    return returned, failures, pending
+
+
+def __collect_auto__(client, jids, timeout):
+    return client.iter_job_returns(jids, timeout)
+
+
+def __collect_polling__(client, jids, timeout):
+    return client.iter_job_returns(jids, timeout, use_events=False)
+
+
+def __collect_events__(client, jids, timeout):
+    return client.iter_job_returns(jids, timeout, use_events=True)
+
+
+def __subscribe_events__(client):
+    # before the jobs are dispatched so no return can be missed
+    if not hasattr(client, "events"):
+        raise FailedActivity(
+            "the asyncio Salt API client does not follow the event stream, "
+            "collect job returns by polling")
+    client.events()
+
+
+def __strategy__(configuration, key, strategies):
+    configuration = configuration or {}
+    name = configuration.get(key, next(iter(strategies)))
+    if name not in strategies:
+        raise FailedActivity(
+            "Unsupported {} strategy: {}, expected one of {}".format(
+                key, name, ", ".join(strategies)))
+    return strategies[name]
+
+
+def __max_workers__(configuration):
+    configuration = configuration or {}
+    return max(1, int(configuration.get(
+        "saltstack_max_workers", DEFAULT_MAX_WORKERS)))
+
+
+def __prepare_script__(client, names, action, os_type, parameters,
+                       configuration):
+    """
+    The script sent to the minions of a job: the whole script, or when
+    `saltstack_stage_scripts` is set, a reference to a copy staged on the
+    minions beforehand.
+    """
+    configuration = configuration or {}
+    if not __as_bool__(configuration.get("saltstack_stage_scripts", False)):
+        script_content = __construct_script_content__(
+            action, os_type, parameters)
+    else:
+        path, staged_content = __staged_script__(action, os_type)
+        staged = client.stage_file(names, path, staged_content,
+                                   STAGE_DIR_MODES.get(os_type))
+        if staged:
+            logger.debug("Staged {} on machines: {}".format(path, staged))
+        script_content = __construct_script_reference__(path, parameters)
+    return __bound_output__(script_content, os_type, configuration)
+
+
+def __bound_output__(script_content, os_type, configuration):
+    """
+    Have the minions return only the first `saltstack_output_head` and
+    last `saltstack_output_tail` characters of the script output, so large
+    outputs do not travel through the master. The exit status of the script
+    is kept.
+
+    Only Linux scripts are bounded on the minions, the client bounds the
+    outputs of every minion anyway. So it does alone when outputs are
+    spooled to `saltstack_output_spool_dir`, which then gets them whole.
+    """
+    head = int(configuration.get("saltstack_output_head", DEFAULT_OUTPUT_HEAD))
+    tail = int(configuration.get("saltstack_output_tail", DEFAULT_OUTPUT_TAIL))
+    if os_type != OS_LINUX or head + tail <= 0 or \
+            configuration.get("saltstack_output_spool_dir"):
+        return script_content
+    return BOUNDED_OUTPUT_LINUX.format(
+        script=script_content, head=max(head, 0), tail=max(tail, 0),
+        limit=max(head, 0) + max(tail, 0))
+
+
+def __construct_script_content__(action, os_type, parameters):
+    """
+    The script is shared by every minion of a job: `instance_id` is a jinja
+    expression rendered by each minion (see SCRIPT_KWARG) while the script
+    body itself is kept out of the templating.
+
+    Only the parameters prelude is rendered per call, the body comes from
+    the in-memory script cache.
+    """
+    script_content = __load_script__(action, os_type)
+    return __construct_parameters__(parameters) + "\n" + \
+        "{% raw %}\n" + script_content + "\n{% endraw %}"
+
+
+def __construct_script_reference__(path, parameters):
+    """
+    Same as __construct_script_content__() for a script staged on the
+    minions, which is sourced rather than sent.
+    """
+    return __construct_parameters__(parameters) + "\n. '{}'".format(path)
+
+
+def __construct_parameters__(parameters):
+    parameters = dict(parameters, instance_id=MINION_ID_GRAIN)
+    # TODO in ps1
+    return '\n'.join(
+        ["{}='{}'".format(k, v) for k, v in parameters.items()])
+
+
+@lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+def __staged_script__(action, os_type):
+    """
+    Where a script is staged on the minions, the file name embeds the hash
+    of the content so an updated script is staged again.
+    return: (path, content)
+    """
+    script_content = __load_script__(action, os_type)
+    digest = hashlib.sha256(script_content.encode("utf-8")).hexdigest()
+    name, extension = os.path.splitext(__script_name__(action, os_type))
+    join = ntpath.join if os_type == OS_WINDOWS else posixpath.join
+    path = join(STAGE_DIRS[os_type], "{}-{}{}".format(
+        name, digest[:16], extension))
+    return path, script_content
+
+
+@lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+def __load_script__(action, os_type):
+    """
+    Read a script from `machine/scripts` once per process.
+    """
+    with open(os.path.join(os.path.dirname(__file__), "scripts",
+                           __script_name__(action, os_type))) as file:
+        return file.read()
+
+
+def __script_name__(action, os_type):
+    if os_type == OS_WINDOWS:
+        return action+".ps1"
+    elif os_type == OS_LINUX:
+        return action+".sh"
+    raise FailedActivity(
+        "Cannot find corresponding script for {} on OS: {}".format(
+            action, os_type))
+
+
+# How job returns are collected: `subscribe(client)`, when set, runs
+# before the jobs are dispatched and `collect(client, jids, timeout)`
+# yields the JobReturns
+CollectStrategy = namedtuple('CollectStrategy', ['subscribe', 'collect'])
+
+# Strategies by name, the first one is the default. Each dispatcher takes
+# (client, scripts, configuration, tracer) and returns {jid: minions}.
+DISPATCH_STRATEGIES = OrderedDict([
+    ("threaded", __dispatch_threaded__),
+    ("serial", __dispatch_serial__),
+])
+COLLECT_STRATEGIES = OrderedDict([
+    ("auto", CollectStrategy(None, __collect_auto__)),
+    ("polling", CollectStrategy(None, __collect_polling__)),
+    ("events", CollectStrategy(__subscribe_events__, __collect_events__)),
+])
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import List
+from typing import List, Union
 
 from chaoslib.types import Configuration, Secrets
 from chaoslib.exceptions import FailedActivity
@@ -9,7 +9,8 @@ from .. import saltstack_api_client
 __all__ = ["is_minion_online", "is_iproute_tc_installed"]
 
 
-def is_minion_online(instance_ids: List[str],
+def is_minion_online(instance_ids: Union[List[str], str],
+                     tgt_type: str = "list",
                      configuration: Configuration = None,
                      secrets: Secrets = None):
     """
@@ -24,14 +25,19 @@ def is_minion_online(instance_ids: List[str],
         this function will return dict otherwise raise exception
             {'client1': 'Online', 'client2': 'Offline',
                 'client3':'Not a Salt Minion' }
+        tgt_type : str
+            any Salt target type, e.g. glob, grain, compound or nodegroup,
+            makes `clients` an expression resolved by the master, only
+            the minions that answered are then reported
     """
     try:
-        client = saltstack_api_client(secrets)
-        machines = client.run_cmd(instance_ids, 'test.ping')
+        client = saltstack_api_client(secrets, configuration)
+        machines = client.run_cmd(
+            instance_ids, 'test.ping', tgt_type=tgt_type)
 
         result = dict()
 
-        for k in instance_ids:
+        for k in __targeted_minions__(instance_ids, tgt_type, machines):
             if k not in machines:
                 result[k] = "Not a Salt Minion"
             else:
@@ -50,7 +56,8 @@ def is_minion_online(instance_ids: List[str],
         )
 
 
-def is_iproute_tc_installed(instance_ids: List[str],
+def is_iproute_tc_installed(instance_ids: Union[List[str], str],
+                            tgt_type: str = "list",
                             configuration: Configuration = None,
                             secrets: Secrets = None):
     """
@@ -70,14 +77,17 @@ def is_iproute_tc_installed(instance_ids: List[str],
             tc [-force] -batch filename where  OBJECT := { qdisc | class | filter | action | monitor | exec }
             OPTIONS := { -s[tatistics] | -d[etails] | -r[aw] | -p[retty] | -b[atch] [filename] | -n[etns] name |
             -nm | -nam[es] | { -cf | -conf } path }'}
+        tgt_type : str
+            same as is_minion_online()
     """  # noqa: E501
     try:
-        client = saltstack_api_client(secrets)
-        machines = client.run_cmd(instance_ids, 'cmd.run', 'tc -help')
+        client = saltstack_api_client(secrets, configuration)
+        machines = client.run_cmd(
+            instance_ids, 'cmd.run', 'tc -help', tgt_type=tgt_type)
 
         result = dict()
 
-        for k in instance_ids:
+        for k in __targeted_minions__(instance_ids, tgt_type, machines):
             if k not in machines:
                 result[k] = "Not a Salt Minion"
             else:
@@ -94,3 +104,16 @@ def is_iproute_tc_installed(instance_ids: List[str],
                 str(x)
             )
         )
+
+
+###############################################################################
+# Private helper functions
+###############################################################################
+def __targeted_minions__(instance_ids, tgt_type, machines):
+    """
+    Listed minions are all reported, a target expression only matches the
+    minions that answered.
+    """
+    if tgt_type == "list":
+        return instance_ids
+    return sorted(machines)
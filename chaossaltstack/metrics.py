@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import os.path
+import tempfile
+import threading
+from collections import namedtuple
+from typing import Any, Dict, Tuple
+
+from logzero import logger
+
+__all__ = ["RequestEvent", "MetricsCollector", "to_prometheus", "to_json",
+           "export_metrics", "summarize", "lowstate_labels"]
+
+# What a hook of salt_api_client learns about each request. `client` and
+# `fun` come from the lowstate chunks, `status` is 0 when no response came
+# back and `retry` tells the request is the retry of a refused or failed
+# one.
+RequestEvent = namedtuple('RequestEvent', [
+    'client', 'fun', 'status', 'latency', 'request_bytes', 'response_bytes',
+    'retry'])
+
+# Labels of the requests of a run_many() mixing several clients or funs
+MIXED = "mixed"
+
+
+class MetricsCollector:
+    """
+    In-memory aggregate of the requests a client sent, by lowstate client,
+    function and HTTP status. It is a hook of salt_api_client, any other
+    callable taking a RequestEvent can be added next to it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {(client, fun, status): {count, seconds, max_seconds, ...}}
+        self.requests = dict()
+
+    def __call__(self, event: RequestEvent):
+        key = (event.client, event.fun, str(event.status))
+        with self.lock:
+            stats = self.requests.get(key)
+            if stats is None:
+                stats = self.requests[key] = {
+                    "count": 0, "seconds": 0.0, "max_seconds": 0.0,
+                    "request_bytes": 0, "response_bytes": 0, "retries": 0
+                }
+            stats["count"] += 1
+            stats["seconds"] += event.latency
+            stats["max_seconds"] = max(stats["max_seconds"], event.latency)
+            stats["request_bytes"] += event.request_bytes
+            stats["response_bytes"] += event.response_bytes
+            stats["retries"] += 1 if event.retry else 0
+
+    def snapshot(self) -> Dict[Tuple[str, str, str], Dict[str, Any]]:
+        with self.lock:
+            return {key: dict(stats) for key, stats in self.requests.items()}
+
+    def clear(self):
+        with self.lock:
+            self.requests.clear()
+
+
+def to_prometheus(snapshot: Dict[Tuple[str, str, str], Dict[str, Any]]) \
+        -> str:
+    """
+    The snapshot of a collector in the Prometheus text exposition format,
+    e.g. for the textfile collector of the node exporter.
+    """
+    metrics = [
+        ("saltstack_api_requests_total", "counter", "count",
+         "Salt API requests"),
+        ("saltstack_api_request_seconds_total", "counter", "seconds",
+         "Seconds spent in Salt API requests"),
+        ("saltstack_api_request_max_seconds", "gauge", "max_seconds",
+         "Longest Salt API request"),
+        ("saltstack_api_request_bytes_total", "counter", "request_bytes",
+         "Bytes of the Salt API request bodies"),
+        ("saltstack_api_response_bytes_total", "counter", "response_bytes",
+         "Bytes of the Salt API response bodies"),
+        ("saltstack_api_retries_total", "counter", "retries",
+         "Salt API requests retried after being refused"),
+    ]
+    lines = []
+    for name, kind, field, description in metrics:
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for (client, fun, status), stats in sorted(snapshot.items()):
+            lines.append('{}{{client="{}",fun="{}",status="{}"}} {}'.format(
+                name, __escape__(client), __escape__(fun), status,
+                stats[field]))
+    return "\n".join(lines) + "\n"
+
+
+def to_json(snapshot: Dict[Tuple[str, str, str], Dict[str, Any]]) -> str:
+    return json.dumps([
+        dict(stats, client=client, fun=fun, status=status)
+        for (client, fun, status), stats in sorted(snapshot.items())
+    ], indent=2)
+
+
+def export_metrics(snapshot: Dict[Tuple[str, str, str], Dict[str, Any]],
+                   path: str, fmt: str = "prometheus"):
+    """
+    Replace `path` with the snapshot as a Prometheus textfile or as JSON,
+    atomically so a scraper never reads a partial file.
+    """
+    content = to_json(snapshot) if fmt == "json" else to_prometheus(snapshot)
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError as x:
+        logger.warning("Could not export Salt API metrics to {}: {}".format(
+            path, x))
+
+
+def summarize(after: Dict[Tuple[str, str, str], Dict[str, Any]],
+              before: Dict[Tuple[str, str, str], Dict[str, Any]] = None) \
+        -> str:
+    """
+    One line describing the requests sent between two snapshots, slowest
+    kind of request first:
+        7 requests in 1.204s (runner/jobs.lookup_jid: 5 in 1.1s, ...),
+        2.1 KiB sent, 40.3 KiB received, 0 retries, 0 errors
+    """
+    before = before or {}
+    per_call = dict()
+    total = {"count": 0, "seconds": 0.0, "request_bytes": 0,
+             "response_bytes": 0, "retries": 0, "errors": 0}
+    for key, stats in after.items():
+        previous = before.get(key, {})
+        delta = {field: stats[field] - previous.get(field, 0)
+                 for field in ("count", "seconds", "request_bytes",
+                               "response_bytes", "retries")}
+        if not delta["count"]:
+            continue
+        client, fun, status = key
+        call = per_call.setdefault("{}/{}".format(client, fun), [0, 0.0])
+        call[0] += delta["count"]
+        call[1] += delta["seconds"]
+        for field in delta:
+            total[field] += delta[field]
+        if not status.startswith("2"):
+            total["errors"] += delta["count"]
+
+    calls = ", ".join(
+        "{}: {} in {:.3f}s".format(name, count, seconds)
+        for name, (count, seconds) in sorted(
+            per_call.items(), key=lambda item: -item[1][1]))
+    return "{} requests in {:.3f}s ({}), {:.1f} KiB sent, {:.1f} KiB " \
+        "received, {} retries, {} errors".format(
+            total["count"], total["seconds"], calls,
+            total["request_bytes"] / 1024, total["response_bytes"] / 1024,
+            total["retries"], total["errors"])
+
+
+def lowstate_labels(params: Any) -> Tuple[str, str]:
+    """
+    The (client, fun) a request is tagged with, `mixed` when a list of
+    chunks has several of them.
+    """
+    chunks = params if isinstance(params, list) else [params]
+    clients = {str(chunk.get('client', '')) for chunk in chunks}
+    funs = {str(chunk.get('fun', '')) for chunk in chunks}
+    return (clients.pop() if len(clients) == 1 else MIXED,
+            funs.pop() if len(funs) == 1 else MIXED)
+
+
+def __escape__(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import os
+import os.path
+import re
+import time
+from typing import Any
+
+from logzero import logger
+
+__all__ = ["OutputLimiter"]
+
+# Characters of an output kept from its start and from its end
+DEFAULT_OUTPUT_HEAD = 32768
+DEFAULT_OUTPUT_TAIL = 32768
+
+TRUNCATED_MARKER = "\n... [{} characters truncated] ...\n"
+# Marker of the outputs the minions bounded themselves, see
+# chaossaltstack.machine.constants.BOUNDED_OUTPUT_LINUX
+MINION_TRUNCATED_MARKER = re.compile(
+    r"\n\.\.\. \[\d+ bytes truncated\] \.\.\.\n")
+
+
+class OutputLimiter:
+    """
+    Bound the output a minion returned to its first `head` and last `tail`
+    characters, the middle is replaced by a marker. `0` for both keeps the
+    outputs whole.
+
+    When a `spool_dir` is given, outputs that are truncated are first
+    written whole to <spool_dir>/<jid>/<minion>.log so nothing is lost
+    while the controller only holds the bounded copy.
+    """
+    def __init__(self, head: int = DEFAULT_OUTPUT_HEAD,
+                 tail: int = DEFAULT_OUTPUT_TAIL, spool_dir: str = None):
+        self.head = max(0, int(head))
+        self.tail = max(0, int(tail))
+        self.spool_dir = spool_dir
+
+    @property
+    def enabled(self) -> bool:
+        return self.head + self.tail > 0
+
+    def limit(self, minion: str, output: Any, jid: str = None) -> Any:
+        """
+        The bounded output, outputs that are not text are left untouched
+        but for the `stdout` and `stderr` of a `cmd.run_all` return.
+        """
+        if isinstance(output, dict) and 'stdout' in output:
+            return dict(
+                output, stdout=self.limit(minion, output['stdout'], jid),
+                stderr=self.limit(
+                    minion + ".stderr", output.get('stderr'), jid))
+        if not self.enabled or not isinstance(output, str) or \
+                len(output) <= self.head + self.tail or \
+                self.__minion_bounded__(output):
+            return output
+
+        if self.spool_dir:
+            self.__spool__(minion, output, jid)
+        truncated = len(output) - self.head - self.tail
+        return output[:self.head] + TRUNCATED_MARKER.format(truncated) + \
+            output[len(output) - self.tail:]
+
+    ###########################################################################
+    # Private methods
+    ###########################################################################
+    def __minion_bounded__(self, output: str) -> bool:
+        # already cut by the minion with the same head and tail, bounding it
+        # again would hide how much was dropped
+        marker = MINION_TRUNCATED_MARKER.search(output)
+        return marker is not None and \
+            len(output) - len(marker.group()) <= self.head + self.tail
+
+    def __spool__(self, minion: str, output: str, jid: str = None):
+        # jobs run synchronously have no jid
+        jid = jid or time.strftime("%Y%m%d%H%M%S")
+        directory = os.path.join(self.spool_dir, __safe_name__(jid))
+        path = os.path.join(directory, __safe_name__(minion) + ".log")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(output)
+        except OSError as x:
+            logger.warning("Could not spool the output of {}: {}".format(
+                minion, x))
+
+
+def __safe_name__(name: str) -> str:
+    return re.sub(r"[^\w.-]", "_", str(name))
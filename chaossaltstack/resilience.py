@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+from typing import Any
+
+from chaoslib.exceptions import FailedActivity
+
+__all__ = ["RetryPolicy", "CircuitBreaker", "TransientError",
+           "is_idempotent"]
+
+# Seconds to wait for a connection to, and for a response from, the master
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 120
+
+# Retries of a request failing transiently, and their exponential backoff
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_RETRY_MAX_BACKOFF = 10
+
+# Requests failing in a row before the client fails fast, and for how long
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 30
+
+# Functions that can safely run twice, a request running anything else is
+# only retried when it is known it never reached the master
+IDEMPOTENT_FUNS = frozenset([
+    "cache.grains", "file.file_exists", "file.get_hash", "file.mkdir",
+    "file.write",
+    "grains.get", "grains.items", "jobs.exit_success", "jobs.list_job",
+    "jobs.lookup_jid", "test.ping"
+])
+
+
+class TransientError(Exception):
+    """
+    A request that failed in a way worth retrying. `sent` tells whether the
+    master may have received, and run, it.
+    """
+    def __init__(self, message: str, sent: bool = True):
+        super().__init__(message)
+        self.sent = sent
+
+
+class RetryPolicy:
+    """
+    Retry transient failures up to `retries` times, sleeping a random time
+    between 0 and an exponential backoff capped at `max_backoff` (the
+    so-called full jitter) so clients retrying together do not stampede.
+    """
+    def __init__(self, retries: int = DEFAULT_RETRIES,
+                 backoff: float = DEFAULT_RETRY_BACKOFF,
+                 max_backoff: float = DEFAULT_RETRY_MAX_BACKOFF):
+        self.retries = max(0, int(retries))
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+
+    def should_retry(self, attempt: int, error: TransientError,
+                     idempotent: bool) -> bool:
+        return attempt < self.retries and (idempotent or not error.sent)
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Fail fast once `threshold` requests failed in a row, until `reset`
+    seconds went by. A single request, the probe, is then let through while
+    the others keep failing fast: it closes the circuit when it succeeds and
+    opens it again when it fails. A `threshold` of 0 disables the breaker.
+    """
+    def __init__(self, threshold: int = DEFAULT_BREAKER_THRESHOLD,
+                 reset: float = DEFAULT_BREAKER_RESET):
+        self.threshold = max(0, int(threshold))
+        self.reset = float(reset)
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+
+    @property
+    def open(self) -> bool:
+        with self.lock:
+            return self.__open__()
+
+    def check(self):
+        """
+        Raise FailedActivity unless a request may be sent, every request let
+        through must be followed by success(), failure() or release().
+        """
+        with self.lock:
+            if self.__open__():
+                raise FailedActivity(
+                    "Salt API is unavailable, {} requests failed in a row, "
+                    "not trying again for {:.0f}s".format(
+                        self.failures,
+                        self.opened_at + self.reset - time.time()))
+            if self.__tripped__():
+                if self.probing:
+                    raise FailedActivity(
+                        "Salt API is unavailable, {} requests failed in a "
+                        "row, waiting for a probe request".format(
+                            self.failures))
+                self.probing = True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.__tripped__():
+                self.opened_at = time.time()
+
+    def release(self):
+        """
+        A request ended with neither a success nor a failure of the master,
+        e.g. it was refused, another may probe it.
+        """
+        with self.lock:
+            self.probing = False
+
+    ###########################################################################
+    # Private methods
+    ###########################################################################
+    def __tripped__(self) -> bool:
+        return self.threshold > 0 and self.failures >= self.threshold
+
+    def __open__(self) -> bool:
+        return self.__tripped__() and \
+            time.time() < self.opened_at + self.reset
+
+
+def is_idempotent(params: Any) -> bool:
+    """
+    Whether every lowstate chunk of a request can safely run twice.
+    """
+    chunks = params if isinstance(params, list) else [params]
+    return all(chunk.get('fun') in IDEMPOTENT_FUNS for chunk in chunks)
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+In-process stand-in of salt-api, for tests and benchmarks of the extension
+without a Salt master.
+
+    with FakeSaltApi(minions=100, latency=(0.1, 0.5), failure_rate=0.01) \
+            as salt_api:
+        burn_cpu(salt_api.minion_ids, execution_duration="1",
+                 secrets=salt_api.secrets())
+
+The simulated minions answer `/login`, the `local`, `local_async` and
+`local_batch` clients, the `jobs.lookup_jid`, `jobs.exit_success` and
+`cache.grains` runners and publish their job returns on `/events`.
+"""
+import fnmatch
+import hashlib
+import heapq
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, List, Union
+
+__all__ = ["FakeSaltApi"]
+
+DEFAULT_USERNAME = "salt"
+DEFAULT_PASSWORD = "salt"
+DEFAULT_TOKEN_TTL = 3600
+
+# Seconds an /events stream waits for new events before a keep-alive
+EVENTS_KEEP_ALIVE = 0.5
+
+# Seconds between checks of the server for a shutdown
+SHUTDOWN_POLL_INTERVAL = 0.05
+
+
+class FakeSaltApi:
+    """
+    A salt-api serving `minions` simulated minions, either a number or
+    their ids, on a local port.
+
+    - `latency`: seconds a minion takes to return a job, a number or a
+      (min, max) range drawn per minion and job
+    - `failure_rate`: probability a minion fails a job, its output then
+      reports the failure and its exit status is not 0
+    - `output_size`: characters of output of each command run
+    - `request_latency`: seconds each HTTP request takes to be answered
+    - `grains`: grains of the minions, a dict shared by all of them or a
+      callable of the minion id, `{'kernel': 'Linux'}` by default
+    - `nodegroups`: {name: compound expression} for the `nodegroup` target
+
+    Every request is counted, see stats().
+    """
+    def __init__(self, minions: Union[int, List[str]] = 10,
+                 latency: Union[float, tuple] = 0.0,
+                 failure_rate: float = 0.0, output_size: int = 0,
+                 request_latency: float = 0.0, grains=None,
+                 nodegroups: Dict[str, str] = None,
+                 username: str = DEFAULT_USERNAME,
+                 password: str = DEFAULT_PASSWORD,
+                 token_ttl: float = DEFAULT_TOKEN_TTL, seed: int = None):
+        if isinstance(minions, int):
+            minions = ["minion{:05d}".format(i) for i in range(minions)]
+        self.minion_ids = list(minions)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.output_size = output_size
+        self.request_latency = request_latency
+        self.grains = grains if grains is not None else {"kernel": "Linux"}
+        self.nodegroups = nodegroups or {}
+        self.username = username
+        self.password = password
+        self.token_ttl = token_ttl
+        self.random = random.Random(seed)
+
+        self.lock = threading.Condition()
+        self.tokens = dict()
+        self.files = dict()
+        self.jids = itertools.count(20190830103239148771)
+        # {jid: {minion: (success, output)}} of the minions that returned
+        self.jobs = dict()
+        # (due, sequence, jid, minion, success, output) not returned yet
+        self.scheduled = []
+        self.sequence = itertools.count()
+        # published events, as (tag, JSON payload)
+        self.events = []
+        self.stopped = threading.Event()
+        self.reset_stats()
+
+        self.server = None
+        self.threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def secrets(self) -> Dict[str, str]:
+        """
+        The secrets of the extension logging in this salt-api.
+        """
+        return {
+            "SALTMASTER_HOST": self.url,
+            "SALTMASTER_USER": self.username,
+            "SALTMASTER_PASSWORD": self.password
+        }
+
+    def start(self):
+        self.stopped.clear()
+        self.server = _ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.salt_api = self
+        self.threads = [
+            threading.Thread(target=self.server.serve_forever,
+                             args=(SHUTDOWN_POLL_INTERVAL,),
+                             name="fake-salt-api", daemon=True),
+            threading.Thread(target=self.__run_minions__,
+                             name="fake-salt-minions", daemon=True)
+        ]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        with self.lock:
+            self.lock.notify_all()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self.threads:
+            thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Requests served, bytes received and sent, the lowstate chunks run
+        by `client/fun` and the most requests in flight at once.
+        """
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+                "lowstates": dict(self.lowstates),
+                "max_in_flight": self.max_in_flight
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_received = 0
+            self.bytes_sent = 0
+            self.lowstates = Counter()
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+    def minion_grains(self, minion: str) -> Dict[str, Any]:
+        grains = self.grains(minion) if callable(self.grains) else \
+            self.grains
+        return dict(grains, id=minion)
+
+    def match(self, tgt: Any, tgt_type: str = "glob") -> List[str]:
+        """
+        The minions a target expression matches.
+        """
+        if tgt_type == "list":
+            names = set(tgt.split(",") if isinstance(tgt, str) else tgt)
+            return [minion for minion in self.minion_ids if minion in names]
+        return [minion for minion in self.minion_ids
+                if self.__matches__(minion, tgt, tgt_type)]
+
+    def run(self, chunk: Dict[str, Any]) -> List[Any]:
+        """
+        Run a lowstate chunk, as the items it adds to the `return` list.
+        """
+        client = chunk.get("client")
+        fun = chunk.get("fun")
+        with self.lock:
+            self.lowstates["{}/{}".format(client, fun)] += 1
+
+        if client == "runner":
+            return [self.__run_runner__(fun, chunk)]
+        minions = self.match(chunk.get("tgt"), chunk.get("tgt_type", "glob"))
+        if client == "local":
+            return [{minion: self.__execute__(minion, fun, chunk)[1]
+                     for minion in minions}]
+        elif client == "local_async":
+            return [{"jid": self.__dispatch__(minions, fun, chunk),
+                     "minions": minions}]
+        elif client == "local_batch":
+            return self.__run_batches__(minions, fun, chunk)
+        raise ValueError("unsupported client: {}".format(client))
+
+    ###########################################################################
+    # Private methods
+    ###########################################################################
+    def __matches__(self, minion: str, tgt: Any, tgt_type: str) -> bool:
+        if tgt_type == "list":
+            names = tgt.split(",") if isinstance(tgt, str) else tgt
+            return minion in names
+        elif tgt_type == "glob":
+            return fnmatch.fnmatch(minion, tgt)
+        elif tgt_type == "pcre":
+            return re.match(tgt, minion) is not None
+        elif tgt_type == "grain":
+            key, _, pattern = tgt.partition(":")
+            value = self.minion_grains(minion)
+            for part in key.split(":"):
+                value = value.get(part) if isinstance(value, dict) else None
+            return fnmatch.fnmatch(str(value), pattern)
+        elif tgt_type == "nodegroup":
+            return self.__matches__(
+                minion, self.nodegroups.get(tgt, ""), "compound")
+        elif tgt_type == "compound":
+            return self.__matches_compound__(minion, tgt)
+        raise ValueError("unsupported tgt_type: {}".format(tgt_type))
+
+    def __matches_compound__(self, minion: str, tgt: str) -> bool:
+        types = {"G": "grain", "E": "pcre", "L": "list", "N": "nodegroup"}
+        expression = []
+        for word in tgt.split():
+            if word in ("and", "or", "not", "(", ")"):
+                expression.append(word)
+            elif len(word) > 2 and word[1] == "@" and word[0] in types:
+                expression.append(str(self.__matches__(
+                    minion, word[2:], types[word[0]])))
+            else:
+                expression.append(str(self.__matches__(minion, word, "glob")))
+        # only True, False and boolean operators are left
+        return bool(eval(" ".join(expression), {"__builtins__": {}}))
+
+    def __execute__(self, minion: str, fun: str, chunk: Dict[str, Any]):
+        """
+        What a minion returns for a function, as (success, output).
+        """
+        arg = chunk.get("arg")
+        args = arg if isinstance(arg, list) else [arg]
+        if fun == "test.ping":
+            return True, True
+        elif fun == "grains.get":
+            return True, self.minion_grains(minion).get(args[0], "")
+        elif fun == "file.file_exists":
+            return True, (minion, args[0]) in self.files
+        elif fun == "file.get_hash":
+            if (minion, args[0]) not in self.files:
+                return False, "ERROR: {} not found".format(args[0])
+            return True, hashlib.sha256(
+                self.files[(minion, args[0])].encode("utf-8")).hexdigest()
+        elif fun == "file.mkdir":
+            return True, True
+        elif fun == "file.write":
+            with self.lock:
+                self.files[(minion, args[0])] = "".join(
+                    "{}\n".format(line) for line in args[1:])
+            return True, "Wrote {} lines to \"{}\"".format(
+                len(args) - 1, args[0])
+
+        success = self.random.random() >= self.failure_rate
+        output = "x" * self.output_size + "\nexperiment <{}> -> {}".format(
+            minion, "success" if success else "fail")
+        if fun == "cmd.run_all":
+            return success, {"pid": 0, "retcode": 0 if success else 1,
+                             "stdout": output, "stderr": ""}
+        return success, output
+
+    def __latency__(self) -> float:
+        if isinstance(self.latency, (tuple, list)):
+            return self.random.uniform(*self.latency)
+        return self.latency
+
+    def __dispatch__(self, minions: List[str], fun: str,
+                     chunk: Dict[str, Any]) -> str:
+        now = time.time()
+        with self.lock:
+            jid = str(next(self.jids))
+            self.jobs[jid] = dict()
+            for minion in minions:
+                success, output = self.__execute__(minion, fun, chunk)
+                heapq.heappush(self.scheduled, (
+                    now + self.__latency__(), next(self.sequence), jid,
+                    minion, success, output))
+            self.lock.notify_all()
+        return jid
+
+    def __run_minions__(self):
+        """
+        Complete the scheduled returns once due and publish their events.
+        """
+        with self.lock:
+            while not self.stopped.is_set():
+                now = time.time()
+                while self.scheduled and self.scheduled[0][0] <= now:
+                    _, _, jid, minion, success, output = \
+                        heapq.heappop(self.scheduled)
+                    self.jobs[jid][minion] = (success, output)
+                    tag = "salt/job/{}/ret/{}".format(jid, minion)
+                    self.events.append((tag, json.dumps({
+                        "tag": tag,
+                        "data": {"jid": jid, "id": minion, "return": output,
+                                 "retcode": 0 if success else 1,
+                                 "success": True}
+                    })))
+                    self.lock.notify_all()
+                timeout = self.scheduled[0][0] - now \
+                    if self.scheduled else None
+                self.lock.wait(timeout)
+
+    def __run_batches__(self, minions: List[str], fun: str,
+                        chunk: Dict[str, Any]) -> List[Dict[str, Any]]:
+        batch = str(chunk.get("batch", len(minions)))
+        if batch.endswith("%"):
+            size = int(len(minions) * float(batch[:-1]) / 100)
+        else:
+            size = int(batch)
+        size = max(size, 1)
+
+        returns = []
+        for i in range(0, len(minions), size):
+            latency = max([self.__latency__()
+                           for _ in minions[i:i + size]] or [0])
+            time.sleep(latency + float(chunk.get("batch_wait") or 0))
+            for minion in minions[i:i + size]:
+                returns.append(
+                    {minion: self.__execute__(minion, fun, chunk)[1]})
+        return returns
+
+    def __run_runner__(self, fun: str, chunk: Dict[str, Any]) -> Any:
+        if fun == "jobs.lookup_jid":
+            with self.lock:
+                job = self.jobs.get(chunk.get("jid"), {})
+                return {minion: output for minion, (_, output) in job.items()}
+        elif fun == "jobs.exit_success":
+            with self.lock:
+                job = self.jobs.get(chunk.get("jid"), {})
+                return {minion: success
+                        for minion, (success, _) in job.items()}
+        elif fun == "cache.grains":
+            minions = self.match(
+                chunk.get("tgt", "*"), chunk.get("tgt_type", "glob"))
+            return {minion: self.minion_grains(minion) for minion in minions}
+        raise ValueError("unsupported runner: {}".format(fun))
+
+    def __login__(self, body: Dict[str, Any]) -> Union[Dict[str, Any], None]:
+        if body.get("username") != self.username or \
+                body.get("password") != self.password:
+            return None
+        expire = time.time() + self.token_ttl
+        token = "{:032x}".format(self.random.getrandbits(128))
+        with self.lock:
+            self.tokens[token] = expire
+        return {"token": token, "expire": expire, "start": time.time(),
+                "user": self.username, "eauth": body.get("eauth"),
+                "perms": [".*", "@runner", "@wheel", "@jobs"]}
+
+    def __authorized__(self, token: str) -> bool:
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        salt_api = self.server.salt_api
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with salt_api.lock:
+            salt_api.requests += 1
+            salt_api.bytes_received += len(body)
+            salt_api.in_flight += 1
+            salt_api.max_in_flight = max(
+                salt_api.max_in_flight, salt_api.in_flight)
+        try:
+            if salt_api.request_latency:
+                time.sleep(salt_api.request_latency)
+            self.__answer__(salt_api, json.loads(body.decode("utf-8")))
+        finally:
+            with salt_api.lock:
+                salt_api.in_flight -= 1
+
+    def do_GET(self):
+        salt_api = self.server.salt_api
+        with salt_api.lock:
+            salt_api.requests += 1
+        if self.path.split("?")[0] != "/events":
+            return self.__send__(404, {"status": 404})
+        if not salt_api.__authorized__(self.headers.get("X-Auth-Token")):
+            return self.__send__(401, {"status": 401})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.__write_chunk__(salt_api, b"retry: 400\n\n")
+        with salt_api.lock:
+            sent = len(salt_api.events)
+        while not salt_api.stopped.is_set():
+            with salt_api.lock:
+                if sent == len(salt_api.events):
+                    salt_api.lock.wait(EVENTS_KEEP_ALIVE)
+                events = salt_api.events[sent:]
+                sent += len(events)
+            payload = "".join(
+                "tag: {}\ndata: {}\n\n".format(tag, data)
+                for tag, data in events) if events else ": keep-alive\n\n"
+            try:
+                self.__write_chunk__(salt_api, payload.encode("utf-8"))
+            except OSError:
+                break
+        self.close_connection = True
+
+    def __answer__(self, salt_api: FakeSaltApi, body: Any):
+        if self.path == "/login":
+            login = salt_api.__login__(body)
+            if login is None:
+                return self.__send__(401, {"status": 401})
+            return self.__send__(200, {"return": [login]})
+
+        if not salt_api.__authorized__(self.headers.get("X-Auth-Token")):
+            return self.__send__(401, {"status": 401})
+        results = []
+        for chunk in body if isinstance(body, list) else [body]:
+            results.extend(salt_api.run(chunk))
+        self.__send__(200, {"return": results})
+
+    def __send__(self, status: int, result: Dict[str, Any]):
+        salt_api = self.server.salt_api
+        payload = json.dumps(result).encode("utf-8")
+        with salt_api.lock:
+            salt_api.bytes_sent += len(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def __write_chunk__(self, salt_api: FakeSaltApi, data: bytes):
+        with salt_api.lock:
+            salt_api.bytes_sent += len(data)
+        self.wfile.write(
+            "{:x}\r\n".format(len(data)).encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
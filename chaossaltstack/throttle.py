@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from logzero import logger
+
+from .metrics import RequestEvent
+
+__all__ = ["TokenBucket", "ConcurrencyWindow", "RequestThrottle"]
+
+# Requests per second sent to the Salt API, and how many may go at once
+DEFAULT_RATE_LIMIT = 50
+# Requests in flight at most, whatever the number of threads
+DEFAULT_MAX_IN_FLIGHT = 16
+
+# Adaptive window: where it starts, how much slower than the fastest
+# requests a request may be before the master is deemed congested, and
+# the share of the window kept when it is
+DEFAULT_INITIAL_IN_FLIGHT = 4
+DEFAULT_LATENCY_TOLERANCE = 2.0
+WINDOW_DECREASE = 0.5
+# Latency differences below it, in seconds, are noise rather than load
+LATENCY_SLACK = 0.05
+# How fast the latency baseline forgets a faster past
+BASELINE_DRIFT = 0.01
+
+# Requests blocking until minions return, their latency does not tell how
+# loaded the master is
+BLOCKING_CLIENTS = frozenset(["local", "local_batch", "login"])
+
+
+class TokenBucket:
+    """
+    Hand out `rate` tokens per second, up to `burst` at once. A `rate` of 0
+    never waits.
+
+    Tokens are reserved rather than waited for under the lock: the bucket
+    may go in debt and each caller is told how long to wait for its own
+    token, so callers are served in order from any thread or event loop.
+    """
+    def __init__(self, rate: float = DEFAULT_RATE_LIMIT, burst: float = None):
+        self.rate = max(0.0, float(rate))
+        self.burst = max(1.0, float(burst or self.rate or 1))
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """
+        Take a token, returns the seconds to wait before it is due.
+        """
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+
+class ConcurrencyWindow:
+    """
+    Bound the requests in flight to `limit`, at least `min_limit` and at
+    most `max_limit`.
+
+    When `adaptive`, the window follows an AIMD scheme fed with the
+    RequestEvent of each request, it is a hook of the client: it grows by
+    one request per window of successful requests and is halved, at most
+    once per window, when a request fails or when it is `tolerance` times
+    slower than the baseline, the fastest requests lately seen.
+    """
+    def __init__(self, limit: int = DEFAULT_INITIAL_IN_FLIGHT,
+                 min_limit: int = 1, max_limit: int = DEFAULT_MAX_IN_FLIGHT,
+                 adaptive: bool = True,
+                 tolerance: float = DEFAULT_LATENCY_TOLERANCE):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = min(max(1, int(min_limit)), self.max_limit)
+        self.limit = float(min(max(int(limit), self.min_limit),
+                               self.max_limit))
+        self.adaptive = adaptive
+        self.tolerance = float(tolerance)
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.baseline = None
+        # requests completed, and how many were when it last decreased
+        self.completed = 0
+        self.decreased_at = 0
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def __call__(self, event: RequestEvent):
+        failed = event.status == 0 or event.status >= 500
+        if not self.adaptive or \
+                (not failed and event.client in BLOCKING_CLIENTS):
+            return
+        with self.condition:
+            self.completed += 1
+            if failed or self.__slow__(event.latency):
+                self.__decrease__()
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.condition.notify_all()
+
+    ###########################################################################
+    # Private methods
+    ###########################################################################
+    def __slow__(self, latency: float) -> bool:
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+            return False
+        slow = latency > self.baseline * self.tolerance + LATENCY_SLACK
+        self.baseline += (latency - self.baseline) * BASELINE_DRIFT
+        return slow
+
+    def __decrease__(self):
+        # requests sent before the last decrease report congestion too
+        if self.completed - self.decreased_at < self.limit:
+            return
+        self.decreased_at = self.completed
+        limit = max(self.min_limit, self.limit * WINDOW_DECREASE)
+        if int(limit) < int(self.limit):
+            logger.debug("Salt API looks congested, {} requests in flight "
+                         "at most".format(int(limit)))
+        self.limit = limit
+
+
+class RequestThrottle:
+    """
+    Context manager each request of a client goes through: it waits for a
+    place in the `window` of requests in flight, if any, then for its token
+    of the `rate` limit.
+    """
+    def __init__(self, rate: float = DEFAULT_RATE_LIMIT, burst: float = None,
+                 window: ConcurrencyWindow = None):
+        self.bucket = TokenBucket(rate, burst)
+        self.window = window
+
+    def __enter__(self):
+        if self.window is not None:
+            self.window.acquire()
+        delay = self.bucket.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.window is not None:
+            self.window.release()
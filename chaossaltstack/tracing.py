@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import itertools
+import json
+import os
+import os.path
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+from chaoslib.exceptions import FailedActivity
+from chaoslib.types import Configuration
+from logzero import logger
+
+from .metrics import RequestEvent
+
+__all__ = ["Tracer", "TRACE_FORMATS"]
+
+# Layouts of a trace file: one JSON span per line, or the Trace Event Format
+# read by chrome://tracing, Perfetto or speedscope
+TRACE_FORMATS = ("jsonl", "chrome")
+
+
+class Tracer:
+    """
+    Nested spans timing the phases of an activity, written to `path` when
+    the outermost span ends. A tracer without `path` records nothing.
+
+    Spans nest on the thread that opened them, spans opened by a worker
+    thread are children of the outermost span. Once following a client,
+    see follow(), each Salt API request is a span too.
+
+    Spans are appended to the file so the activities of an experiment
+    share one trace. A Chrome trace is a JSON array which, as the format
+    allows, is left unterminated.
+    """
+    def __init__(self, path: str = None, fmt: str = "jsonl"):
+        if fmt not in TRACE_FORMATS:
+            raise FailedActivity("Unsupported trace format: {}".format(fmt))
+        self.path = path
+        self.fmt = fmt
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.ids = itertools.count(1)
+        self.root = None
+        self.spans = []
+        self.clients = []
+
+    @classmethod
+    def from_configuration(cls, configuration: Configuration = None) \
+            -> 'Tracer':
+        configuration = configuration or {}
+        return cls(configuration.get("saltstack_trace_file"),
+                   configuration.get("saltstack_trace_format", "jsonl"))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """
+        Time the enclosed block as a span called `name`, `args` are kept
+        with it.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        span_id = next(self.ids)
+        stack = self.__stack__()
+        parent = stack[-1] if stack else self.root
+        if self.root is None:
+            self.root = span_id
+        stack.append(span_id)
+        start = time.time()
+        try:
+            yield
+        finally:
+            stack.pop()
+            self.__keep__(span_id, parent, name, start, time.time(), args)
+            if span_id == self.root:
+                self.root = None
+                self.flush()
+
+    def record(self, name: str, start: float, end: float, **args):
+        """
+        Add a span which already ended, e.g. measured by its caller.
+        """
+        if not self.enabled:
+            return
+        stack = self.__stack__()
+        parent = stack[-1] if stack else self.root
+        self.__keep__(next(self.ids), parent, name, start, end, args)
+
+    def follow(self, client: Any):
+        """
+        Record the requests of a Salt API client until the outermost span
+        ends.
+        """
+        if not self.enabled:
+            return
+        client.add_hook(self)
+        self.clients.append(client)
+
+    def __call__(self, event: RequestEvent):
+        end = time.time()
+        self.record("{}/{}".format(event.client, event.fun) if event.fun
+                    else event.client, end - event.latency, end,
+                    status=event.status, request_bytes=event.request_bytes,
+                    response_bytes=event.response_bytes, retry=event.retry)
+
+    def flush(self):
+        for client in self.clients:
+            client.remove_hook(self)
+        self.clients = []
+
+        with self.lock:
+            spans, self.spans = self.spans, []
+        if not spans:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                if self.fmt == "chrome":
+                    if f.tell() == 0:
+                        f.write("[\n")
+                    f.writelines(
+                        json.dumps(__chrome_event__(span)) + ",\n"
+                        for span in spans)
+                else:
+                    f.writelines(json.dumps(span) + "\n" for span in spans)
+        except OSError as x:
+            logger.warning("Could not write the trace to {}: {}".format(
+                self.path, x))
+
+    ###########################################################################
+    # Private methods
+    ###########################################################################
+    def __stack__(self) -> List[int]:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def __keep__(self, span_id: int, parent: int, name: str, start: float,
+                 end: float, args: Dict[str, Any]):
+        span = {
+            "id": span_id, "parent": parent, "name": name,
+            "start": start, "end": end, "duration": end - start,
+            "thread": threading.current_thread().name,
+            "tid": threading.get_ident(), "args": args
+        }
+        with self.lock:
+            self.spans.append(span)
+
+
+def __chrome_event__(span: Dict[str, Any]) -> Dict[str, Any]:
+    # a complete event, timestamps are in microseconds
+    return {
+        "name": span["name"], "cat": "chaossaltstack", "ph": "X",
+        "ts": int(span["start"] * 1e6), "dur": int(span["duration"] * 1e6),
+        "pid": os.getpid(), "tid": span["tid"],
+        "args": dict(span["args"], id=span["id"], parent=span["parent"],
+                     thread=span["thread"])
+    }
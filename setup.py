@@ -75,6 +75,14 @@ setup_params = dict(
     packages=packages,
     include_package_data=True,
     install_requires=install_require,
+    extras_require={
+        'async': ['aiohttp>=3.5']
+    },
+    entry_points={
+        'console_scripts': [
+            'chaossaltstack-benchmark = chaossaltstack.benchmark:main'
+        ]
+    },
     tests_require=test_require,
     setup_requires=pytest_runner,
     python_requires='>=3.5.*'
@@ -6,20 +6,55 @@ import pytest
 from chaossaltstack.machine.actions import burn_cpu, burn_io, \
     network_advanced, network_corruption, network_latency, network_loss, \
     fill_disk
-from chaossaltstack import saltstack_api_client
+from chaossaltstack.machine.executor import __collect_results__, \
+    __construct_script_content__, __load_script__, __staged_script__
+from chaossaltstack import JobReturn
+from chaossaltstack.metrics import MetricsCollector
+from chaossaltstack.output import OutputLimiter
+from chaossaltstack import saltstack_api_client, salt_api_client
 import chaossaltstack
 
 
+@pytest.fixture(autouse=True)
+def clear_script_cache():
+    # scripts are read through the mocked open()
+    __load_script__.cache_clear()
+    __staged_script__.cache_clear()
+    yield
+    __load_script__.cache_clear()
+    __staged_script__.cache_clear()
+
+
 class AnyStringWith(str):
     def __eq__(self, other):
         return self in other
 
 
+def mock_client():
+    # the job waiter polls through the mocked calls
+    client = MagicMock()
+    client.poll_interval = 0.1
+    client.poll_max_interval = 0.1
+    client.output_limiter = OutputLimiter()
+    client.metrics = MetricsCollector()
+    client.iter_job_returns.side_effect = \
+        lambda jids, timeout: salt_api_client.__iter_polled_jobs__(
+            client, jids, timeout)
+
+    def run_many(chunks):
+        return [client.get_async_cmd_result(c['jid'])
+                if c['fun'] == 'jobs.lookup_jid'
+                else client.async_cmd_exit_success(c['jid'])
+                for c in chunks]
+    client.run_many.side_effect = run_many
+    return client
+
+
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_burn_cpu_on_windows(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Windows"}
@@ -32,17 +67,17 @@ def test_burn_cpu_on_windows(init, open):
              execution_duration="1")
 
     open.assert_called_with(AnyStringWith("cpu_stress_test.ps1"))
-    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel')
-    client.async_run_cmd.assert_called_with('CLIENT1', 'cmd.run', AnyStringWith('script'))
+    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel', 'list')
+    client.async_run_cmd.assert_called_with(['CLIENT1'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')
     client.async_cmd_exit_success.assert_called_with('20190830103239148771')
     client.get_async_cmd_result.assert_called_with('20190830103239148771')
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_burn_cpu_on_linux(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux"}
@@ -55,17 +90,17 @@ def test_burn_cpu_on_linux(init, open):
              execution_duration="1")
 
     open.assert_called_with(AnyStringWith("cpu_stress_test.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel')
-    client.async_run_cmd.assert_called_with('CLIENT1', 'cmd.run', AnyStringWith('script'))
+    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel', 'list')
+    client.async_run_cmd.assert_called_with(['CLIENT1'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')
     client.async_cmd_exit_success.assert_called_with('20190830103239148771')
     client.get_async_cmd_result.assert_called_with('20190830103239148771')
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_burn_cpu_on_linux_two(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -79,18 +114,17 @@ def test_burn_cpu_on_linux_two(init, open):
              execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("cpu_stress_test.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_burn_cpu_on_linux_two_error_in_script(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -104,18 +138,17 @@ def test_burn_cpu_on_linux_two_error_in_script(init, open):
         burn_cpu(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("cpu_stress_test.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_burn_cpu_on_linux_two_error_in_execution(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -129,32 +162,31 @@ def test_burn_cpu_on_linux_two_error_in_execution(init, open):
         burn_cpu(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("cpu_stress_test.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_burn_cpu_on_linux_wrong_os_type(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
     client.get_grains_get.return_value = {'CLIENT1': "invalid"}
     # do
     with pytest.raises(FailedActivity, match=r"failed issuing a execute of shell script via salt API Cannot find corresponding script for cpu_stress_test on OS: invalid"):
         burn_cpu(instance_ids=['CLIENT1'], execution_duration="1")
     # assert
-    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel')
+    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel', 'list')
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_burn_io_on_linux(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux"}
@@ -167,17 +199,17 @@ def test_burn_io_on_linux(init, open):
              execution_duration="1")
 
     open.assert_called_with(AnyStringWith("burn_io.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel')
-    client.async_run_cmd.assert_called_with('CLIENT1', 'cmd.run', AnyStringWith('script'))
+    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel', 'list')
+    client.async_run_cmd.assert_called_with(['CLIENT1'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')
     client.async_cmd_exit_success.assert_called_with('20190830103239148771')
     client.get_async_cmd_result.assert_called_with('20190830103239148771')
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_burn_io_on_linux_two(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -191,18 +223,17 @@ def test_burn_io_on_linux_two(init, open):
              execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("burn_io.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_burn_io_on_linux_two_error_script(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -216,18 +247,17 @@ def test_burn_io_on_linux_two_error_script(init, open):
         burn_io(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("burn_io.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_burn_io_on_linux_two_error_execution(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -241,18 +271,17 @@ def test_burn_io_on_linux_two_error_execution(init, open):
         burn_io(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("burn_io.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_fill_disk_on_windows(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Windows"}
@@ -264,17 +293,17 @@ def test_fill_disk_on_windows(init, open):
     fill_disk(instance_ids=['CLIENT1'], execution_duration="1")
 
     open.assert_called_with(AnyStringWith("fill_disk.ps1"))
-    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel')
-    client.async_run_cmd.assert_called_with('CLIENT1', 'cmd.run', AnyStringWith('script'))
+    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel', 'list')
+    client.async_run_cmd.assert_called_with(['CLIENT1'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')
     client.async_cmd_exit_success.assert_called_with('20190830103239148771')
     client.get_async_cmd_result.assert_called_with('20190830103239148771')
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_fill_disk_on_linux(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux"}
@@ -286,17 +315,17 @@ def test_fill_disk_on_linux(init, open):
     fill_disk(instance_ids=['CLIENT1'], execution_duration="1")
 
     open.assert_called_with(AnyStringWith("fill_disk.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel')
-    client.async_run_cmd.assert_called_with('CLIENT1', 'cmd.run', AnyStringWith('script'))
+    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel', 'list')
+    client.async_run_cmd.assert_called_with(['CLIENT1'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')
     client.async_cmd_exit_success.assert_called_with('20190830103239148771')
     client.get_async_cmd_result.assert_called_with('20190830103239148771')
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_fill_disk_on_linux_two(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -310,18 +339,17 @@ def test_fill_disk_on_linux_two(init, open):
             execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("fill_disk.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_fill_disk_on_linux_two_error_script(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -335,18 +363,17 @@ def test_fill_disk_on_linux_two_error_script(init, open):
         fill_disk(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("fill_disk.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_fill_disk_on_linux_two_error_execution(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -360,18 +387,17 @@ def test_fill_disk_on_linux_two_error_execution(init, open):
         fill_disk(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("fill_disk.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_latency_on_linux(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux"}
@@ -383,17 +409,17 @@ def test_network_latency_on_linux(init, open):
     network_latency(instance_ids=['CLIENT1'], execution_duration="1")
 
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel')
-    client.async_run_cmd.assert_called_with('CLIENT1', 'cmd.run', AnyStringWith('script'))
+    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel', 'list')
+    client.async_run_cmd.assert_called_with(['CLIENT1'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')
     client.async_cmd_exit_success.assert_called_with('20190830103239148771')
     client.get_async_cmd_result.assert_called_with('20190830103239148771')
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_latency_on_linux_two(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -407,18 +433,17 @@ def test_network_latency_on_linux_two(init, open):
              execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_latency_on_linux_two_error_in_script(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -432,18 +457,17 @@ def test_network_latency_on_linux_two_error_in_script(init, open):
         network_latency(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_latency_on_linux_two_error_in_execution(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -457,18 +481,17 @@ def test_network_latency_on_linux_two_error_in_execution(init, open):
         network_latency(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_loss_on_linux(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux"}
@@ -480,17 +503,17 @@ def test_network_loss_on_linux(init, open):
     network_loss(instance_ids=['CLIENT1'], execution_duration="1")
 
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel')
-    client.async_run_cmd.assert_called_with('CLIENT1', 'cmd.run', AnyStringWith('script'))
+    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel', 'list')
+    client.async_run_cmd.assert_called_with(['CLIENT1'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')
     client.async_cmd_exit_success.assert_called_with('20190830103239148771')
     client.get_async_cmd_result.assert_called_with('20190830103239148771')
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_loss_on_linux_two(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -504,18 +527,17 @@ def test_network_loss_on_linux_two(init, open):
                     execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_loss_on_linux_two_error_in_script(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -529,18 +551,17 @@ def test_network_loss_on_linux_two_error_in_script(init, open):
         network_loss(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_loss_on_linux_two_error_in_execution(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -554,18 +575,17 @@ def test_network_loss_on_linux_two_error_in_execution(init, open):
         network_loss(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_corruption_on_linux(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux"}
@@ -577,17 +597,17 @@ def test_network_corruption_on_linux(init, open):
     network_corruption(instance_ids=['CLIENT1'], execution_duration="1")
 
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel')
-    client.async_run_cmd.assert_called_with('CLIENT1', 'cmd.run', AnyStringWith('script'))
+    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel', 'list')
+    client.async_run_cmd.assert_called_with(['CLIENT1'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')
     client.async_cmd_exit_success.assert_called_with('20190830103239148771')
     client.get_async_cmd_result.assert_called_with('20190830103239148771')
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_corruption_on_linux_two(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -601,18 +621,17 @@ def test_network_corruption_on_linux_two(init, open):
                     execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_corruption_on_linux_two_error_in_script(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -626,18 +645,17 @@ def test_network_corruption_on_linux_two_error_in_script(init, open):
         network_corruption(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_corruption_on_linux_two_error_in_execution(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -651,18 +669,17 @@ def test_network_corruption_on_linux_two_error_in_execution(init, open):
         network_corruption(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_advanced_on_linux(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux"}
@@ -674,17 +691,17 @@ def test_network_advanced_on_linux(init, open):
     network_advanced(instance_ids=['CLIENT1'], execution_duration="1", command="loss 5%")
 
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel')
-    client.async_run_cmd.assert_called_with('CLIENT1', 'cmd.run', AnyStringWith('script'))
+    client.get_grains_get.assert_called_with(['CLIENT1'], 'kernel', 'list')
+    client.async_run_cmd.assert_called_with(['CLIENT1'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')
     client.async_cmd_exit_success.assert_called_with('20190830103239148771')
     client.get_async_cmd_result.assert_called_with('20190830103239148771')
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_advanced_on_linux_two(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -697,18 +714,17 @@ def test_network_advanced_on_linux_two(init, open):
     network_advanced(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1", command="loss 5%")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_advanced_on_linux_two_error_in_script(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -722,18 +738,17 @@ def test_network_advanced_on_linux_two_error_in_script(init, open):
         network_advanced(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1", command="loss 5%")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
 
 
 @patch("builtins.open", new_callable=mock_open, read_data="script")
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
 def test_network_advanced_on_linux_two_error_in_execution(init, open):
     # mock
-    client = MagicMock()
+    client = mock_client()
     init.return_value = client
 
     client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
@@ -747,8 +762,258 @@ def test_network_advanced_on_linux_two_error_in_execution(init, open):
         network_advanced(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1", command="loss 5%")
     # assert
     open.assert_called_with(AnyStringWith("network_advanced.sh"))
-    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel')
-    assert client.async_run_cmd.mock_calls == [call('CLIENT1', 'cmd.run', AnyStringWith('script')),
-                                               call('CLIENT2', 'cmd.run', AnyStringWith('script'))]
-    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
-    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772'), call('20190830103239148772')]
\ No newline at end of file
+    client.get_grains_get.assert_called_with(['CLIENT1', 'CLIENT2'], 'kernel', 'list')
+    assert client.async_run_cmd.mock_calls == [call(['CLIENT1', 'CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    assert client.async_cmd_exit_success.mock_calls == [call('20190830103239148772')]
+    assert client.get_async_cmd_result.mock_calls == [call('20190830103239148772')]
+
+@patch("builtins.open", new_callable=mock_open, read_data="script")
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
+def test_burn_cpu_dispatches_one_job_per_os(init, open):
+    # mock
+    client = mock_client()
+    init.return_value = client
+
+    client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Windows", 'CLIENT3': "Linux"}
+    client.async_run_cmd.side_effect = \
+        lambda tgt, *args, **kwargs: "20190830103239148771" if 'CLIENT1' in tgt else "20190830103239148772"
+    client.get_async_cmd_result.side_effect = \
+        lambda jid: {'CLIENT1': "success", 'CLIENT3': "success"} if jid.endswith('1') else {'CLIENT2': "success"}
+    client.async_cmd_exit_success.side_effect = \
+        lambda jid: {'CLIENT1': True, 'CLIENT3': True} if jid.endswith('1') else {'CLIENT2': True}
+
+    # do
+    burn_cpu(instance_ids=['CLIENT1', 'CLIENT2', 'CLIENT3'], execution_duration="1")
+
+    # assert
+    assert sorted(client.async_run_cmd.mock_calls) == [
+        call(['CLIENT1', 'CLIENT3'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list'),
+        call(['CLIENT2'], 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='list')]
+    script = client.async_run_cmd.mock_calls[0][1][2]
+    assert "instance_id='{{ grains['id'] }}'" in script
+    assert "{% raw %}\nscript\n{% endraw %}" in script
+    client.iter_job_returns.assert_called_once_with(
+        {'20190830103239148771': ['CLIENT1', 'CLIENT3'], '20190830103239148772': ['CLIENT2']}, 31)
+
+
+@patch("builtins.open", new_callable=mock_open, read_data="script")
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
+def test_burn_cpu_fails_when_a_minion_did_not_return(init, open):
+    # mock
+    client = mock_client()
+    init.return_value = client
+
+    client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
+    client.async_run_cmd.return_value = "20190830103239148772"
+    client.get_async_cmd_result.return_value = {'CLIENT1': "success"}
+    client.async_cmd_exit_success.return_value = {'CLIENT1': True, 'CLIENT2': False}
+
+    # do
+    with pytest.raises(FailedActivity, match=r"One of experiments are failed among.*"):
+        burn_cpu(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="0",
+                 configuration={'saltstack_job_grace': 0})
+    # assert
+    client.iter_job_returns.assert_called_once_with(
+        {'20190830103239148772': ['CLIENT1', 'CLIENT2']}, 0)
+
+
+def test_collection_is_sharded_across_workers():
+    client = MagicMock()
+    jids = {str(i): ['CLIENT{}'.format(i)] for i in range(120)}
+    client.iter_job_returns.side_effect = lambda shard, timeout: iter(
+        [JobReturn(jid, names[0], True, "success")
+         for jid, names in shard.items()])
+
+    returned, failures = __collect_results__(
+        client, jids, "1", {'saltstack_max_workers': 4, 'saltstack_job_grace': 0})
+
+    assert returned == 120
+    assert failures == {}
+    assert sorted(len(c[1][0]) for c in client.iter_job_returns.mock_calls) == [20, 50, 50]
+
+
+def test_scripts_are_read_once_per_action_and_os():
+    with patch("builtins.open", new_callable=mock_open, read_data="script") as open:
+        scripts = [__construct_script_content__(
+                       'cpu_stress_test', 'Linux', {'duration': str(i)})
+                   for i in range(100)]
+        __construct_script_content__('cpu_stress_test', 'Windows', {'duration': '1'})
+
+    assert open.call_count == 2
+    assert scripts[42].startswith("duration='42'\ninstance_id=")
+    assert scripts[42].endswith("{% raw %}\nscript\n{% endraw %}")
+
+
+@patch("builtins.open", new_callable=mock_open, read_data="script")
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
+def test_burn_cpu_sends_a_reference_to_the_staged_script(init, open):
+    # mock
+    client = mock_client()
+    init.return_value = client
+
+    client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
+    client.stage_file.return_value = ['CLIENT2']
+    client.async_run_cmd.return_value = "20190830103239148771"
+    client.get_async_cmd_result.return_value = {'CLIENT1': "success", 'CLIENT2': "success"}
+    client.async_cmd_exit_success.return_value = {'CLIENT1': True, 'CLIENT2': True}
+
+    # do
+    burn_cpu(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1",
+             configuration={'saltstack_stage_scripts': True})
+
+    # assert
+    path = "/var/cache/salt/minion/chaossaltstack/cpu_stress_test-21a0270b7f66a1e4.sh"
+    client.stage_file.assert_called_once_with(['CLIENT1', 'CLIENT2'], path, "script", "0700")
+    script = client.async_run_cmd.mock_calls[0][1][2]
+    assert "\nduration='1'\ninstance_id='{{ grains['id'] }}'\n. '" + path + "'\n" in script
+
+
+@patch("builtins.open", new_callable=mock_open, read_data="script")
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
+def test_network_loss_in_batches(init, open):
+    # mock
+    client = mock_client()
+    init.return_value = client
+
+    client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux", 'CLIENT3': "Linux"}
+    client.run_cmd.return_value = {
+        'CLIENT1': {'retcode': 0, 'stdout': "success", 'stderr': ""},
+        'CLIENT2': {'retcode': 0, 'stdout': "fail", 'stderr': ""}}
+
+    # do
+    with pytest.raises(FailedActivity, match=r"One of experiments are failed among.*"):
+        network_loss(instance_ids=['CLIENT1', 'CLIENT2', 'CLIENT3'],
+                     execution_duration="1", batch_size="10%", batch_wait=5)
+
+    # assert
+    client.run_cmd.assert_called_once_with(
+        ['CLIENT1', 'CLIENT2', 'CLIENT3'], 'cmd.run_all', AnyStringWith('script'),
+        kwarg={'template': 'jinja'}, batch="10%", batch_wait=5, tgt_type='list')
+    client.async_run_cmd.assert_not_called()
+    client.iter_job_returns.assert_not_called()
+
+
+@patch("builtins.open", new_callable=mock_open, read_data="script")
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
+def test_batches_fail_on_the_exit_status_of_the_script(init, open):
+    # mock
+    client = mock_client()
+    init.return_value = client
+
+    client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Linux"}
+    client.run_cmd.return_value = {
+        'CLIENT1': {'retcode': 0, 'stdout': "success", 'stderr': ""},
+        'CLIENT2': {'retcode': 2, 'stdout': "", 'stderr': "no such device"}}
+
+    # do
+    with pytest.raises(FailedActivity) as x:
+        network_loss(instance_ids=['CLIENT1', 'CLIENT2'],
+                     execution_duration="1", batch_size="1")
+
+    # assert
+    assert "CLIENT2" in str(x.value)
+    assert "no such device" in str(x.value)
+    assert "CLIENT1" not in str(x.value)
+
+
+@patch("builtins.open", new_callable=mock_open, read_data="script")
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
+def test_burn_io_on_a_nodegroup(init, open):
+    # mock
+    client = mock_client()
+    init.return_value = client
+
+    client.get_grains_get.return_value = {'web1': "Linux", 'web2': "Windows"}
+    client.async_run_cmd.side_effect = \
+        lambda tgt, *args, **kwargs: "20190830103239148771" if 'Linux' in tgt else "20190830103239148772"
+    client.get_async_cmd_result.side_effect = \
+        lambda jid: {'web1': "success"} if jid.endswith('1') else {'web2': "success"}
+    client.async_cmd_exit_success.side_effect = \
+        lambda jid: {'web1': True} if jid.endswith('1') else {'web2': True}
+
+    # do
+    burn_io(instance_ids="web", tgt_type="nodegroup", execution_duration="1")
+
+    # assert
+    client.get_grains_get.assert_called_with("web", 'kernel', 'nodegroup')
+    assert sorted(client.async_run_cmd.mock_calls) == [
+        call("G@kernel:Linux and ( N@web )", 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='compound'),
+        call("G@kernel:Windows and ( N@web )", 'cmd.run', AnyStringWith('script'), kwarg={'template': 'jinja'}, tgt_type='compound')]
+    client.iter_job_returns.assert_called_once_with(
+        {'20190830103239148771': ['web1'], '20190830103239148772': ['web2']}, 31)
+
+
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
+def test_unsupported_target_type(init):
+    client = mock_client()
+    init.return_value = client
+    client.get_grains_get.return_value = {'web1': "Linux"}
+
+    with pytest.raises(FailedActivity, match=r".*Unsupported target type: range"):
+        burn_cpu(instance_ids="%web", tgt_type="range")
+
+
+def test_only_failures_are_kept_while_streaming_returns():
+    client = MagicMock()
+    jids = {'1': ['CLIENT1', 'CLIENT2'], '2': ['CLIENT3', 'CLIENT4']}
+    client.iter_job_returns.return_value = iter([
+        JobReturn('1', 'CLIENT1', True, "success"),
+        JobReturn('2', 'CLIENT3', False, "exit 1"),
+        JobReturn('1', 'CLIENT2', True, "experiment failed")])
+
+    returned, failures = __collect_results__(
+        client, jids, "1", {'saltstack_job_grace': 0})
+
+    assert returned == 3
+    assert failures == {'CLIENT2': "experiment failed", 'CLIENT3': "exit 1", 'CLIENT4': None}
+
+
+@patch("builtins.open", new_callable=mock_open, read_data="script")
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
+def test_fill_disk_output_is_bounded_on_linux_minions(init, open):
+    # mock
+    client = mock_client()
+    init.return_value = client
+
+    client.get_grains_get.return_value = {'CLIENT1': "Linux", 'CLIENT2': "Windows"}
+    client.async_run_cmd.side_effect = \
+        lambda tgt, *args, **kwargs: "20190830103239148771" if 'CLIENT1' in tgt else "20190830103239148772"
+    client.get_async_cmd_result.side_effect = \
+        lambda jid: {'CLIENT1': "success"} if jid.endswith('1') else {'CLIENT2': "success"}
+    client.async_cmd_exit_success.side_effect = \
+        lambda jid: {'CLIENT1': True} if jid.endswith('1') else {'CLIENT2': True}
+
+    # do
+    fill_disk(instance_ids=['CLIENT1', 'CLIENT2'], execution_duration="1",
+              configuration={'saltstack_output_head': 100, 'saltstack_output_tail': 200})
+
+    # assert
+    scripts = {c[1][0][0]: c[1][2] for c in client.async_run_cmd.mock_calls}
+    assert 'head -c 100 "$__output"' in scripts['CLIENT1']
+    assert 'tail -c 200 "$__output"' in scripts['CLIENT1']
+    assert scripts['CLIENT1'].endswith("exit $__status")
+    assert "__output" not in scripts['CLIENT2']
+
+
+
+@patch("builtins.open", new_callable=mock_open, read_data="script")
+@patch('chaossaltstack.machine.executor.export_metrics', autospec=True)
+@patch('chaossaltstack.machine.executor.saltstack_api_client', autospec=True)
+def test_burn_cpu_exports_the_salt_api_metrics(init, export, open):
+    # mock
+    client = mock_client()
+    init.return_value = client
+
+    client.get_grains_get.return_value = {'CLIENT1': "Linux"}
+    client.async_run_cmd.return_value = "20190830103239148771"
+    client.get_async_cmd_result.return_value = {'CLIENT1': "success"}
+    client.async_cmd_exit_success.return_value = {'CLIENT1': True}
+
+    # do
+    burn_cpu(instance_ids=['CLIENT1'], execution_duration="1",
+             configuration={'saltstack_metrics_file': "saltstack.json",
+                            'saltstack_metrics_format': "json"})
+
+    # assert
+    export.assert_called_once_with(
+        client.metrics.snapshot(), "saltstack.json", "json")
@@ -0,0 +1,113 @@
+import threading
+from unittest.mock import MagicMock, patch, mock_open
+
+from chaoslib.exceptions import FailedActivity
+import pytest
+
+from chaossaltstack import JobReturn, close_saltstack_api_clients
+from chaossaltstack.machine.actions import fill_disk
+from chaossaltstack.machine.constants import BURN_CPU, OS_LINUX
+from chaossaltstack.machine.executor import run_fault, __bound_output__, \
+    __collect_results__, __dispatch_serial__
+from chaossaltstack.metrics import MetricsCollector
+from chaossaltstack.testing import FakeSaltApi
+
+
+def mock_client(machines):
+    client = MagicMock()
+    client.metrics = MetricsCollector()
+    client.get_grains_get.return_value = machines
+    client.async_run_cmd.side_effect = \
+        lambda tgt, *args, **kwargs: "jid-" + tgt[0]
+    client.iter_job_returns.side_effect = \
+        lambda jids, timeout, **kwargs: iter([
+            JobReturn(jid, name, True, "-> success")
+            for jid, names in jids.items() for name in names])
+    return client
+
+
+def test_serial_dispatch_submits_jobs_in_turn():
+    client = mock_client({})
+    threads = []
+    client.async_run_cmd.side_effect = \
+        lambda tgt, *args, **kwargs: threads.append(
+            threading.current_thread()) or "jid-" + tgt[0]
+
+    jids = __dispatch_serial__(client, [
+        (["CLIENT1"], "script", (["CLIENT1"], "list")),
+        (["CLIENT2"], "script", (["CLIENT2"], "list"))], {})
+
+    assert jids == {"jid-CLIENT1": ["CLIENT1"], "jid-CLIENT2": ["CLIENT2"]}
+    assert threads == [threading.current_thread()] * 2
+
+
+@pytest.mark.parametrize("strategy,use_events", [
+    ("polling", False), ("events", True)])
+def test_collect_strategy_is_picked_by_configuration(strategy, use_events):
+    client = mock_client({})
+
+    returned, failures = __collect_results__(
+        client, {"1": ["CLIENT1"]}, "1", {"saltstack_collect": strategy})
+
+    assert (returned, failures) == (1, {})
+    client.iter_job_returns.assert_called_once_with(
+        {"1": ["CLIENT1"]}, 31, use_events=use_events)
+
+
+@patch("builtins.open", new_callable=mock_open, read_data="script")
+@patch("chaossaltstack.machine.executor.saltstack_api_client", autospec=True)
+def test_unknown_strategies_are_refused(init, open):
+    init.return_value = mock_client({"CLIENT1": "Linux"})
+
+    with pytest.raises(FailedActivity) as x:
+        run_fault("burn_cpu", BURN_CPU, {"duration": "1"}, ["CLIENT1"], "1",
+                  configuration={"saltstack_dispatch": "random"})
+
+    assert "Unsupported saltstack_dispatch strategy: random" in str(x.value)
+
+
+@patch("chaossaltstack.machine.executor.saltstack_api_client", autospec=True)
+def test_faults_need_machines(init):
+    init.return_value = mock_client({})
+
+    with pytest.raises(FailedActivity) as x:
+        run_fault("burn_cpu", BURN_CPU, {"duration": "1"}, ["CLIENT1"], "1")
+
+    assert "Cannot find any machines" in str(x.value)
+
+
+@patch("builtins.open", new_callable=mock_open, read_data="script")
+@patch("chaossaltstack.machine.executor.saltstack_api_client", autospec=True)
+def test_fill_disk_passes_the_size_to_the_script(init, open):
+    client = init.return_value = mock_client({"CLIENT1": "Linux"})
+
+    fill_disk(instance_ids=["CLIENT1"], execution_duration="1", size=20)
+
+    script = client.async_run_cmd.call_args[0][2]
+    assert "duration='1'" in script
+    assert "size='20'" in script
+
+
+@pytest.mark.parametrize("configuration", [
+    {"saltstack_dispatch": "serial", "saltstack_collect": "polling"},
+    {"saltstack_dispatch": "threaded", "saltstack_collect": "events"},
+])
+def test_strategies_run_faults_end_to_end(configuration):
+    configuration = dict(configuration, saltstack_poll_interval=0.01)
+    try:
+        with FakeSaltApi(minions=20, latency=0, seed=0) as salt_api:
+            run_fault("burn_cpu", BURN_CPU, {"duration": "0"},
+                      salt_api.minion_ids, "0",
+                      configuration=configuration,
+                      secrets=salt_api.secrets())
+            lowstates = salt_api.stats()["lowstates"]
+    finally:
+        close_saltstack_api_clients()
+
+    assert lowstates["local_async/cmd.run"] == 1
+
+
+def test_spooled_outputs_are_not_bounded_on_the_minions(tmpdir):
+    assert "__output" in __bound_output__("ls", OS_LINUX, {})
+    assert __bound_output__("ls", OS_LINUX, {
+        "saltstack_output_spool_dir": str(tmpdir)}) == "ls"
@@ -14,7 +14,7 @@ NO_MINION = ["CLIENT3"]
 ONLINE_MINIONS = ["CLIENT1", "CLIENT4"]
 
 
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
 def test_is_minion_online_multiple_minions(init):
     # mock
     client = MagicMock()
@@ -29,7 +29,7 @@ def test_is_minion_online_multiple_minions(init):
     assert res["CLIENT3"] == "Not a Salt Minion"
 
 
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
 def test_is_minion_online_offline_single(init):
     # mock
     client = MagicMock()
@@ -42,7 +42,7 @@ def test_is_minion_online_offline_single(init):
     assert res["CLIENT2"] == "Offline"
 
 
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
 def test_is_minion_online_online_single(init):
     # mock
     client = MagicMock()
@@ -55,7 +55,7 @@ def test_is_minion_online_online_single(init):
     assert res["CLIENT1"] == "Online"
 
 
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
 def test_is_minion_online_not_minion(init):
     # mock
     client = MagicMock()
@@ -68,7 +68,7 @@ def test_is_minion_online_not_minion(init):
     assert res["CLIENT3"] == "Not a Salt Minion"
 
 
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
 def test_is_minion_online_online_two(init):
     # mock
     client = MagicMock()
@@ -82,7 +82,7 @@ def test_is_minion_online_online_two(init):
     assert res["CLIENT1"] == "Online"
 
 
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
 def test_is_iproute_tc_installed_multiple_minions(init):
     # mock
     client = MagicMock()
@@ -97,7 +97,7 @@ def test_is_iproute_tc_installed_multiple_minions(init):
     assert res["CLIENT3"] == "Not a Salt Minion"
 
 
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
 def test_is_iproute_tc_installed_single_not_installed(init):
     # mock
     client = MagicMock()
@@ -110,7 +110,7 @@ def test_is_iproute_tc_installed_single_not_installed(init):
     assert res["CLIENT1"] == "Installed"
 
 
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
 def test_is_iproute_tc_installed_single_installed(init):
     # mock
     client = MagicMock()
@@ -123,7 +123,7 @@ def test_is_iproute_tc_installed_single_installed(init):
     assert res["CLIENT2"] == "Not Installed"
 
 
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
 def test_is_iproute_tc_installed_two_installed(init):
     # mock
     client = MagicMock()
@@ -137,7 +137,7 @@ def test_is_iproute_tc_installed_two_installed(init):
     assert res["CLIENT4"] == "Installed"
 
 
-@patch('chaossaltstack.saltstack_api_client', autospec=True)
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
 def test_is_iproute_tc_installed_not_minion(init):
     # mock
     client = MagicMock()
@@ -149,3 +149,17 @@ def test_is_iproute_tc_installed_not_minion(init):
     # assert
     assert res["CLIENT3"] == "Not a Salt Minion"
 
+
+@patch('chaossaltstack.machine.probes.saltstack_api_client', autospec=True)
+def test_is_minion_online_with_a_target_expression(init):
+    # mock
+    client = MagicMock()
+    init.return_value = client
+    cmd_return_value = {"web1": True, "web2": False}
+    client.run_cmd.return_value = cmd_return_value
+    # do
+    res = is_minion_online(instance_ids="web*", tgt_type="glob")
+    # assert
+    client.run_cmd.assert_called_with("web*", 'test.ping', tgt_type="glob")
+    assert res == {"web1": "Online", "web2": "Offline"}
+
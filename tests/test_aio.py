@@ -0,0 +1,159 @@
+import asyncio
+
+from chaoslib.exceptions import FailedActivity
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from chaossaltstack import close_saltstack_api_clients, saltstack_api_client
+from chaossaltstack.aio import AsyncSaltApiClient, SyncSaltApiClient
+from chaossaltstack.testing import FakeSaltApi
+
+
+@pytest.fixture
+def salt_api():
+    # a small delay per request so concurrent requests overlap
+    with FakeSaltApi(minions=["CLIENT1", "CLIENT2"],
+                     request_latency=0.05) as salt_api:
+        yield salt_api
+
+
+def configuration(salt_api, **kwargs):
+    configuration = {
+        "url": salt_api.url, "username": "salt", "password": "salt"
+    }
+    configuration.update(kwargs)
+    return configuration
+
+
+def test_async_client_bounds_concurrent_requests(salt_api):
+    async def ping_many():
+        async with AsyncSaltApiClient(
+                configuration(salt_api, max_concurrency=4)) as client:
+            return await asyncio.gather(*[
+                client.run_cmd(["CLIENT{}".format(i)], "test.ping")
+                for i in range(20)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(ping_many())
+    finally:
+        loop.close()
+
+    assert len(results) == 20
+    # one login then the 20 calls, 4 at a time
+    assert salt_api.stats()["requests"] == 21
+    assert 1 < salt_api.stats()["max_in_flight"] <= 4
+
+
+def test_async_client_never_exceeds_the_requests_in_flight(salt_api):
+    assert AsyncSaltApiClient(
+        configuration(salt_api)).max_concurrency == 16
+    assert AsyncSaltApiClient(configuration(
+        salt_api, max_concurrency=64, max_in_flight=4)).max_concurrency == 4
+    assert AsyncSaltApiClient(configuration(
+        salt_api, max_concurrency=8, max_in_flight=0)).max_concurrency == 8
+
+
+def test_sync_facade_drives_a_whole_job(salt_api):
+    with SyncSaltApiClient(configuration(salt_api)) as client:
+        jid = client.async_run_cmd(["CLIENT1", "CLIENT2"], "cmd.run", "ls",
+                                   kwarg={"template": "jinja"})
+        returns, pending = client.wait_for_jobs(
+            {jid: ["CLIENT1", "CLIENT2"]}, 5)
+
+    assert jid == "20190830103239148771"
+    assert pending == {}
+    assert returns["CLIENT1"].success is True
+    assert returns["CLIENT2"].output == "\nexperiment <CLIENT2> -> success"
+    assert salt_api.stats()["lowstates"]["local_async/cmd.run"] == 1
+
+
+def test_registry_builds_the_facade_on_demand(salt_api):
+    secrets = {
+        "SALTMASTER_HOST": salt_api.url,
+        "SALTMASTER_TOKEN": "abcd1234"
+    }
+    try:
+        client = saltstack_api_client(
+            secrets, {"saltstack_client": "asyncio"})
+        assert isinstance(client, SyncSaltApiClient)
+        assert saltstack_api_client(secrets) is not client
+    finally:
+        close_saltstack_api_clients()
+    assert client.closed is True
+
+
+def test_sync_facade_streams_job_returns(salt_api):
+    with SyncSaltApiClient(configuration(salt_api)) as client:
+        jid = client.async_run_cmd(["CLIENT1", "CLIENT2"], "cmd.run", "ls")
+        returns = list(client.iter_job_returns(
+            {jid: ["CLIENT1", "CLIENT2"]}, 5))
+
+    assert sorted(r.minion for r in returns) == ["CLIENT1", "CLIENT2"]
+    assert all(r.success for r in returns)
+
+
+def test_async_client_reports_its_requests(salt_api):
+    with SyncSaltApiClient(configuration(salt_api)) as client:
+        events = []
+        client.add_hook(events.append)
+        client.run_cmd(["CLIENT1"], "test.ping")
+
+    assert [(e.client, e.fun, e.status) for e in events] == [
+        ("login", "", 200), ("local", "test.ping", 200)]
+    assert client.metrics.snapshot()[("local", "test.ping", "200")] \
+        ["count"] == 1
+
+
+def test_async_client_retries_and_breaks_the_circuit():
+    with SyncSaltApiClient({
+            "url": "http://127.0.0.1:1", "token": "abcd1234",
+            "retries": 1, "retry_backoff": 0,
+            "breaker_threshold": 2}) as client:
+        with pytest.raises(FailedActivity) as x:
+            client.run_cmd(["CLIENT1"], "test.ping")
+        assert "connection failed" in str(x.value)
+        with pytest.raises(FailedActivity) as x:
+            client.run_cmd(["CLIENT1"], "test.ping")
+        assert "unavailable" in str(x.value)
+
+
+def test_sync_facade_stages_files_by_their_hash(salt_api):
+    path = "/var/cache/salt/minion/chaossaltstack/burn_io-0123456789ab.sh"
+    salt_api.files[("CLIENT2", path)] = "planted\n"
+
+    with SyncSaltApiClient(configuration(salt_api)) as client:
+        assert client.stage_file(
+            ["CLIENT1", "CLIENT2"], path, "script", "0700") == \
+            ["CLIENT1", "CLIENT2"]
+    with SyncSaltApiClient(configuration(salt_api)) as client:
+        assert client.stage_file(["CLIENT1", "CLIENT2"], path, "script") == []
+
+    assert salt_api.files[("CLIENT2", path)] == "script\n"
+
+
+def test_sync_facade_caches_grains_lookups(salt_api):
+    with SyncSaltApiClient(configuration(
+            salt_api, grains_timeout=3)) as client:
+        first = client.get_grains_get(["CLIENT1", "OFFLINE"], "kernel")
+        requests = salt_api.stats()["requests"]
+        second = client.get_grains_get(["CLIENT1", "OFFLINE"], "kernel")
+
+    assert first == second == {"CLIENT1": "Linux"}
+    # served from the cache, the offline minion is not asked again
+    assert salt_api.stats()["requests"] == requests
+
+
+def test_sync_facade_prefers_the_grains_cached_by_the_master(salt_api):
+    with SyncSaltApiClient(configuration(salt_api, grains_ttl=0)) as client:
+        assert client.get_grains_get(["CLIENT1"], "kernel") == \
+            {"CLIENT1": "Linux"}
+    with SyncSaltApiClient(configuration(
+            salt_api, grains_ttl=0, grains_master_cache=False)) as client:
+        assert client.get_grains_get(["CLIENT1"], "kernel") == \
+            {"CLIENT1": "Linux"}
+
+    lowstates = salt_api.stats()["lowstates"]
+    assert lowstates["runner/cache.grains"] == 1
+    assert lowstates["local/grains.get"] == 1
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from chaossaltstack.benchmark import find_regressions, main, run_benchmark
+
+
+def test_actions_are_measured():
+    result = run_benchmark("burn_cpu", 5, duration=0, configuration={
+        "saltstack_poll_interval": 0.01})
+
+    assert result["action"] == "burn_cpu"
+    assert result["minions"] == 5
+    assert result["overhead_seconds"] == result["wall_seconds"]
+    # login, cached grains, dispatch and at least one poll
+    assert result["requests"] >= 4
+    assert result["bytes"] > 0
+
+
+def test_peak_rss_is_the_one_of_the_run_alone():
+    pytest.importorskip("resource")
+    # held by this process, where the simulator runs
+    ballast = bytearray(256 * 1024 * 1024)
+
+    result = run_benchmark("burn_cpu", 5, duration=0, configuration={
+        "saltstack_poll_interval": 0.01})
+
+    assert 0 < result["peak_rss_kib"] < len(ballast) // 1024
+
+
+def test_results_are_saved_and_compared_to_a_baseline(tmpdir, capsys):
+    output = str(tmpdir.join("results.json"))
+    assert main(["--actions", "network_loss", "--minions", "3",
+                 "--duration", "0", "--output", output]) == 0
+
+    results = json.loads(tmpdir.join("results.json").read())
+    assert [(r["action"], r["minions"]) for r in results] == \
+        [("network_loss", 3)]
+
+    baseline = dict(results[0], requests=1)
+    tmpdir.join("baseline.json").write(json.dumps([baseline]))
+    assert main(["--actions", "network_loss", "--minions", "3",
+                 "--duration", "0",
+                 "--baseline", str(tmpdir.join("baseline.json"))]) == 1
+    assert "requests went from 1" in capsys.readouterr().err
+
+
+def test_growth_within_tolerance_is_not_a_regression():
+    baseline = [{"action": "burn_io", "minions": 10, "requests": 10,
+                 "bytes": 100000, "overhead_seconds": 1.0}]
+    results = [{"action": "burn_io", "minions": 10, "requests": 12,
+                "bytes": 180000, "overhead_seconds": 1.2}]
+
+    assert find_regressions(results, baseline, tolerance=0.25) == [
+        "burn_io on 10 minions: bytes went from 100000 to 180000"]
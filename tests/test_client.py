@@ -0,0 +1,461 @@
+import hashlib
+import threading
+import time
+from unittest.mock import patch
+
+from chaoslib.exceptions import FailedActivity
+import pytest
+import requests_mock
+
+import chaossaltstack
+from chaossaltstack import JobReturn, close_saltstack_api_clients, \
+    evict_saltstack_api_client, salt_api_client, saltstack_api_client
+
+
+SALT_URL = "https://salt.local:8000"
+LOGIN_RETURN = {"return": [{"token": "abcd1234", "expire": 1e12}]}
+# "script" as file.write leaves it, ended with a newline
+SCRIPT_SHA256 = hashlib.sha256(b"script\n").hexdigest()
+
+
+def build_client(**kwargs):
+    configuration = {"url": SALT_URL, "username": "salt", "password": "pwd"}
+    configuration.update(kwargs)
+    return salt_api_client(configuration)
+
+
+def test_client_uses_a_pooled_session():
+    client = build_client(pool_connections=4, pool_maxsize=32,
+                          pool_block="true")
+
+    adapter = client.session.get_adapter(SALT_URL)
+    assert adapter._pool_connections == 4
+    assert adapter._pool_maxsize == 32
+    assert adapter._pool_block is True
+    assert client.session.verify is False
+    assert client.session.headers["Connection"] == "keep-alive"
+
+
+def test_pool_keeps_a_connection_per_request_in_flight():
+    assert build_client().session.get_adapter(SALT_URL)._pool_maxsize == 17
+    assert build_client(max_in_flight=40).session.get_adapter(
+        SALT_URL)._pool_maxsize == 41
+    assert build_client(max_in_flight=0).session.get_adapter(
+        SALT_URL)._pool_maxsize == 10
+
+
+def test_client_can_disable_keep_alive():
+    client = build_client(keep_alive="false")
+
+    assert client.session.headers["Connection"] == "close"
+
+
+def test_client_reuses_its_session_across_calls():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL + "/login", json=LOGIN_RETURN)
+        m.post(SALT_URL, json={"return": [{"jid": "20190830103239148771"}]})
+        with patch("requests.post") as bare_post:
+            client.async_run_cmd(["CLIENT1"], "cmd.run", "ls")
+            client.async_run_cmd(["CLIENT2"], "cmd.run", "ls")
+            bare_post.assert_not_called()
+
+    assert m.call_count >= 2
+
+
+def test_client_close_releases_the_session():
+    client = build_client()
+
+    with patch.object(client.session, "close") as close:
+        with client:
+            pass
+    close.assert_called_once_with()
+
+
+def test_pool_settings_come_from_the_experiment_configuration():
+    secrets = {
+        "SALTMASTER_HOST": SALT_URL,
+        "SALTMASTER_USER": "salt",
+        "SALTMASTER_PASSWORD": "pwd"
+    }
+    configuration = {"saltstack_pool_maxsize": "64"}
+
+    try:
+        client = saltstack_api_client(secrets, configuration)
+
+        assert client.session.get_adapter(SALT_URL)._pool_maxsize == 64
+    finally:
+        close_saltstack_api_clients()
+
+
+def test_token_is_obtained_once_for_many_calls():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        login = m.post(SALT_URL + "/login", json=LOGIN_RETURN)
+        m.post(SALT_URL, json={"return": [{"CLIENT1": True}]})
+        client.run_cmd(["CLIENT1"], "test.ping")
+        client.async_cmd_exit_success("20190830103239148771")
+        client.get_grains_get(["CLIENT1"], "kernel")
+
+    assert login.call_count == 1
+    assert m.request_history[-1].headers["X-Auth-Token"] == "abcd1234"
+
+
+def test_token_is_refreshed_before_it_expires():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        login = m.post(SALT_URL + "/login", json={
+            "return": [{"token": "abcd1234", "expire": time.time() + 30}]})
+        m.post(SALT_URL, json={"return": [{"CLIENT1": True}]})
+        client.run_cmd(["CLIENT1"], "test.ping")
+        client.run_cmd(["CLIENT1"], "test.ping")
+
+    assert login.call_count == 2
+
+
+def test_unauthorized_call_is_retried_once_with_a_new_token():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        login = m.post(SALT_URL + "/login", json=LOGIN_RETURN)
+        m.post(SALT_URL, [
+            {"status_code": 401, "text": "Unauthorized"},
+            {"json": {"return": [{"CLIENT1": True}]}}
+        ])
+        result = client.run_cmd(["CLIENT1"], "test.ping")
+
+    assert result == {"CLIENT1": True}
+    assert login.call_count == 2
+
+
+def test_unauthorized_call_fails_after_one_retry():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        login = m.post(SALT_URL + "/login", json=LOGIN_RETURN)
+        m.post(SALT_URL, status_code=401, text="Unauthorized")
+        with pytest.raises(FailedActivity, match="refused"):
+            client.run_cmd(["CLIENT1"], "test.ping")
+
+    assert login.call_count == 2
+
+
+def test_static_token_is_never_refreshed():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [{"CLIENT1": True}]})
+        client.run_cmd(["CLIENT1"], "test.ping")
+
+    assert m.call_count == 1
+    assert m.request_history[0].headers["X-Auth-Token"] == "static"
+
+
+def test_registry_hands_back_the_same_client():
+    secrets = {
+        "SALTMASTER_HOST": SALT_URL,
+        "SALTMASTER_USER": "salt",
+        "SALTMASTER_PASSWORD": "pwd"
+    }
+    try:
+        client = saltstack_api_client(secrets)
+        assert saltstack_api_client(dict(secrets)) is client
+
+        other = dict(secrets, SALTMASTER_PASSWORD="other")
+        assert saltstack_api_client(other) is not client
+    finally:
+        close_saltstack_api_clients()
+
+    assert client.closed is True
+
+
+def test_registry_builds_a_client_per_configuration():
+    secrets = {"SALTMASTER_HOST": SALT_URL, "SALTMASTER_TOKEN": "abcd"}
+    try:
+        client = saltstack_api_client(secrets)
+        other = saltstack_api_client(secrets, {
+            "saltstack_read_timeout": 600, "saltstack_output_head": 0})
+
+        assert other is not client
+        assert other.read_timeout == 600
+        assert other.output_limiter.head == 0
+        # settings unknown to the client do not matter
+        assert saltstack_api_client(secrets, {"saltstack_job_grace": 5}) \
+            is client
+    finally:
+        close_saltstack_api_clients()
+
+
+def test_registry_evicts_every_client_of_the_secrets():
+    pytest.importorskip("aiohttp")
+    secrets = {"SALTMASTER_HOST": SALT_URL, "SALTMASTER_TOKEN": "abcd"}
+    try:
+        client = saltstack_api_client(secrets)
+        aio = saltstack_api_client(secrets, {"saltstack_client": "asyncio"})
+        evict_saltstack_api_client(secrets)
+
+        assert client.closed is True
+        assert aio.closed is True
+        assert chaossaltstack.__clients__ == {}
+    finally:
+        close_saltstack_api_clients()
+
+
+def test_registry_replaces_an_evicted_client():
+    secrets = {"SALTMASTER_HOST": SALT_URL, "SALTMASTER_TOKEN": "abcd"}
+    try:
+        client = saltstack_api_client(secrets)
+        evict_saltstack_api_client(secrets)
+
+        assert client.closed is True
+        assert saltstack_api_client(secrets) is not client
+    finally:
+        close_saltstack_api_clients()
+
+
+def test_registry_replaces_a_closed_client():
+    secrets = {"SALTMASTER_HOST": SALT_URL, "SALTMASTER_TOKEN": "abcd"}
+    try:
+        client = saltstack_api_client(secrets)
+        client.close()
+
+        assert saltstack_api_client(secrets) is not client
+    finally:
+        close_saltstack_api_clients()
+
+
+def test_shared_client_logs_in_once_across_threads():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        login = m.post(SALT_URL + "/login", json=LOGIN_RETURN)
+        m.post(SALT_URL, json={"return": [{"CLIENT1": True}]})
+        threads = [
+            threading.Thread(target=client.run_cmd,
+                             args=(["CLIENT1"], "test.ping"))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert login.call_count == 1
+
+
+def test_async_run_cmd_targets_many_minions_in_one_job():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [{"jid": "20190830103239148771"}]})
+        jid = client.async_run_cmd(["CLIENT1", "CLIENT2"], "cmd.run", "ls",
+                                   kwarg={"template": "jinja"})
+
+    assert jid == "20190830103239148771"
+    assert m.request_history[0].json() == {
+        "client": "local_async", "fun": "cmd.run", "arg": "ls",
+        "tgt": ["CLIENT1", "CLIENT2"], "tgt_type": "list",
+        "kwarg": {"template": "jinja"}
+    }
+
+
+def test_wait_for_jobs_returns_as_soon_as_every_minion_reported():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+    jids = {"20190830103239148771": ["CLIENT1", "CLIENT2"]}
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, [
+            {"json": {"return": [{"CLIENT1": "success"},
+                                 {"CLIENT1": True, "CLIENT2": False}]}},
+            {"json": {"return": [{"CLIENT1": "success", "CLIENT2": "fail"},
+                                 {"CLIENT1": True, "CLIENT2": False}]}},
+        ])
+        with patch("time.sleep") as sleep:
+            returns, pending = client.wait_for_jobs(jids, 600)
+
+    assert pending == {}
+    assert returns["CLIENT1"] == JobReturn(
+        "20190830103239148771", "CLIENT1", True, "success")
+    assert returns["CLIENT2"].success is False
+    assert sleep.call_count == 1
+    assert m.call_count == 2
+
+
+def test_wait_for_jobs_backs_off_and_exposes_partial_results():
+    client = salt_api_client({
+        "url": SALT_URL, "token": "static", "poll_interval": 0.01,
+        "poll_max_interval": 0.02
+    })
+    jids = {"20190830103239148771": ["CLIENT1", "CLIENT2"]}
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [{"CLIENT1": "success"},
+                                          {"CLIENT1": True}]})
+        returns, pending = client.wait_for_jobs(jids, 0.1)
+
+    assert list(returns) == ["CLIENT1"]
+    assert pending == {"20190830103239148771": ["CLIENT2"]}
+
+
+def test_run_many_sends_every_chunk_in_one_request():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+    chunks = [
+        {"client": "runner", "fun": "jobs.lookup_jid", "jid": "1"},
+        {"client": "runner", "fun": "jobs.exit_success", "jid": "1"},
+        {"client": "local", "fun": "test.ping", "tgt": ["CLIENT1"],
+         "tgt_type": "list"},
+    ]
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [
+            {"CLIENT1": "success"}, {"CLIENT1": True}, {"CLIENT1": True}]})
+        results = client.run_many(chunks)
+        assert client.run_many([]) == []
+
+    assert results == [
+        {"CLIENT1": "success"}, {"CLIENT1": True}, {"CLIENT1": True}]
+    assert m.call_count == 1
+    assert m.request_history[0].json() == chunks
+
+
+def test_wait_for_jobs_polls_every_job_in_one_request():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+    jids = {"1": ["CLIENT1"], "2": ["CLIENT2"], "3": ["CLIENT3"]}
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [
+            {"CLIENT1": "success"}, {"CLIENT1": True},
+            {"CLIENT2": "success"}, {"CLIENT2": True},
+            {"CLIENT3": "success"}, {"CLIENT3": True}]})
+        returns, pending = client.wait_for_jobs(jids, 10)
+
+    assert sorted(returns) == ["CLIENT1", "CLIENT2", "CLIENT3"]
+    assert m.call_count == 1
+
+
+def test_shared_headers_are_not_mutated_by_the_token():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL + "/login", json=LOGIN_RETURN)
+        m.post(SALT_URL, json={"return": [{"CLIENT1": True}]})
+        client.run_cmd(["CLIENT1"], "test.ping")
+
+    assert client.headers == {"Content-type": "application/json"}
+    assert m.request_history[-1].headers["X-Auth-Token"] == "abcd1234"
+
+
+def test_files_are_only_staged_on_the_minions_missing_them():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+    path = "/var/cache/salt/minion/chaossaltstack/burn_io-0123456789ab.sh"
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, [
+            {"json": {"return": [{
+                "CLIENT1": SCRIPT_SHA256,
+                "CLIENT2": "ERROR: {} not found".format(path)}]}},
+            {"json": {"return": [{"CLIENT2": True}, {"CLIENT2": "Wrote"}]}},
+        ])
+        assert client.stage_file(
+            ["CLIENT1", "CLIENT2", "CLIENT3"], path, "script",
+            "0700") == ["CLIENT2"]
+        # known to be staged, only the minion that did not answer is checked
+        m.post(SALT_URL, json={"return": [{}]})
+        assert client.stage_file(
+            ["CLIENT1", "CLIENT2", "CLIENT3"], path, "script") == []
+
+    assert m.request_history[0].json()["fun"] == "file.get_hash"
+    assert m.request_history[0].json()["arg"] == [path, "sha256"]
+    assert m.request_history[1].json() == [
+        {"client": "local", "fun": "file.mkdir", "tgt": ["CLIENT2"],
+         "arg": ["/var/cache/salt/minion/chaossaltstack"],
+         "kwarg": {"mode": "0700"}, "tgt_type": "list"},
+        {"client": "local", "fun": "file.write", "tgt": ["CLIENT2"],
+         "arg": [path, "script"], "tgt_type": "list"},
+    ]
+    assert m.request_history[2].json()["tgt"] == ["CLIENT3"]
+
+
+def test_staged_files_of_another_content_are_written_again():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+    path = "/var/cache/salt/minion/chaossaltstack/burn_io-0123456789ab.sh"
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, [
+            # planted or partially written
+            {"json": {"return": [{"CLIENT1": "0" * 64}]}},
+            {"json": {"return": [{"CLIENT1": True}, {"CLIENT1": "Wrote"}]}},
+        ])
+        assert client.stage_file(["CLIENT1"], path, "script") == ["CLIENT1"]
+
+    assert m.request_history[1].json()[1]["arg"] == [path, "script"]
+
+
+def test_minions_the_file_could_not_be_written_to_are_not_staged():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+    path = "/var/cache/salt/minion/chaossaltstack/burn_io-0123456789ab.sh"
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, [
+            {"json": {"return": [{"CLIENT1": "", "CLIENT2": ""}]}},
+            {"json": {"return": [
+                {"CLIENT1": True, "CLIENT2": True},
+                {"CLIENT1": "Wrote 1 lines to \"{}\"".format(path),
+                 "CLIENT2": "ERROR: permission denied"}]}},
+        ])
+        with pytest.raises(FailedActivity) as x:
+            client.stage_file(["CLIENT1", "CLIENT2"], path, "script")
+        assert "CLIENT2" in str(x.value)
+        assert "CLIENT1" not in str(x.value)
+
+        # the minion that failed is tried again
+        m.post(SALT_URL, json={"return": [{"CLIENT2": SCRIPT_SHA256}]})
+        assert client.stage_file(
+            ["CLIENT1", "CLIENT2"], path, "script") == []
+
+    assert m.request_history[2].json()["tgt"] == ["CLIENT2"]
+
+
+def test_batches_are_paced_by_the_master():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [
+            {"CLIENT1": "success"}, {"CLIENT2": "success"}]})
+        result = client.run_cmd(
+            ["CLIENT1", "CLIENT2"], "cmd.run", "ls", batch=1, batch_wait=2)
+
+    assert result == {"CLIENT1": "success", "CLIENT2": "success"}
+    assert m.request_history[0].json() == {
+        "client": "local_batch", "fun": "cmd.run", "arg": "ls",
+        "tgt": ["CLIENT1", "CLIENT2"], "tgt_type": "list", "batch": "1",
+        "batch_wait": 2
+    }
+
+
+def test_job_returns_are_yielded_as_they_come():
+    client = salt_api_client({
+        "url": SALT_URL, "token": "static", "poll_interval": 0.01
+    })
+    jids = {"20190830103239148771": ["CLIENT1", "CLIENT2"]}
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, [
+            {"json": {"return": [{"CLIENT1": "success"}, {"CLIENT1": True}]}},
+            {"json": {"return": [{"CLIENT1": "success", "CLIENT2": "fail"},
+                                 {"CLIENT1": True, "CLIENT2": False}]}},
+        ])
+        returns = client.iter_job_returns(jids, 10)
+        first = next(returns)
+        assert m.call_count == 1
+        rest = list(returns)
+
+    assert first == JobReturn(
+        "20190830103239148771", "CLIENT1", True, "success")
+    assert rest == [
+        JobReturn("20190830103239148771", "CLIENT2", False, "fail")]
+    assert m.call_count == 2
+
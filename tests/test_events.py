@@ -0,0 +1,192 @@
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+from chaossaltstack import salt_api_client
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer only comes with Python 3.7
+    daemon_threads = True
+
+
+class SSEStandIn(BaseHTTPRequestHandler):
+    """
+    Just enough of salt-api: /login, a local_async dispatch, the jobs
+    runners and a chunked /events stream fed from the test.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(
+            self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/login":
+            results = [{"token": "abcd1234", "expire": 1e12}]
+        else:
+            chunks = body if isinstance(body, list) else [body]
+            self.server.lowstates.extend(chunks)
+            results = [self.run_chunk(chunk) for chunk in chunks]
+        payload = json.dumps({"return": results}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def run_chunk(self, chunk):
+        if chunk["client"] == "local_async":
+            return {"jid": "20190830103239148771", "minions": chunk["tgt"]}
+        elif chunk["fun"] == "jobs.lookup_jid":
+            return self.server.outputs
+        return {k: True for k in self.server.outputs}
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.write(b"6\r\nretry:\r\n")
+        self.wfile.flush()
+        while not self.server.stopped.is_set():
+            try:
+                event = self.server.events.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            chunk = "tag: {}\ndata: {}\n\n".format(
+                event["tag"], json.dumps(event)).encode("utf-8")
+            self.wfile.write(
+                "{:x}\r\n".format(len(chunk)).encode("ascii") + chunk +
+                b"\r\n")
+            self.wfile.flush()
+
+
+@pytest.fixture
+def salt_api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SSEStandIn)
+    server.daemon_threads = True
+    server.lowstates = []
+    server.outputs = {}
+    server.events = queue.Queue()
+    server.stopped = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.stopped.set()
+    server.shutdown()
+    server.server_close()
+
+
+def publish_return(server, jid, minion, output, retcode=0):
+    server.events.put({
+        "tag": "salt/job/{}/ret/{}".format(jid, minion),
+        "data": {"jid": jid, "id": minion, "return": output,
+                 "retcode": retcode, "success": True}
+    })
+
+
+def build_client(server):
+    return salt_api_client({
+        "url": "http://127.0.0.1:{}".format(server.server_port),
+        "username": "salt", "password": "pwd", "use_events": True
+    })
+
+
+def test_job_returns_are_read_from_the_event_stream(salt_api):
+    with build_client(salt_api) as client:
+        jid = client.async_run_cmd(["CLIENT1", "CLIENT2"], "cmd.run", "ls")
+        publish_return(salt_api, jid, "CLIENT1", "success")
+        publish_return(salt_api, jid, "CLIENT2", "fail", retcode=1)
+
+        returns, pending = client.wait_for_jobs(
+            {jid: ["CLIENT1", "CLIENT2"]}, 5)
+
+    assert pending == {}
+    assert returns["CLIENT1"].success is True
+    assert returns["CLIENT1"].output == "success"
+    assert returns["CLIENT2"].success is False
+    assert [s["client"] for s in salt_api.lowstates] == ["local_async"]
+
+
+def test_returns_published_before_waiting_are_buffered(salt_api):
+    with build_client(salt_api) as client:
+        jid = client.async_run_cmd(["CLIENT1"], "cmd.run", "ls")
+        publish_return(salt_api, jid, "CLIENT1", "success")
+        futures = client.events().watch(jid, ["CLIENT1"])
+        futures["CLIENT1"].result(timeout=5)
+
+        returns, pending = client.wait_for_jobs({jid: ["CLIENT1"]}, 0)
+
+    assert returns["CLIENT1"].output == "success"
+
+
+def test_minions_missing_at_the_deadline_are_polled_once(salt_api):
+    salt_api.outputs = {"CLIENT2": "success"}
+
+    with build_client(salt_api) as client:
+        jid = client.async_run_cmd(["CLIENT1", "CLIENT2"], "cmd.run", "ls")
+        publish_return(salt_api, jid, "CLIENT1", "success")
+
+        returns, pending = client.wait_for_jobs(
+            {jid: ["CLIENT1", "CLIENT2", "CLIENT3"]}, 0.5)
+
+    assert sorted(returns) == ["CLIENT1", "CLIENT2"]
+    assert pending == {jid: ["CLIENT3"]}
+    assert [s["fun"] for s in salt_api.lowstates] == \
+        ["cmd.run", "jobs.lookup_jid", "jobs.exit_success"]
+
+
+def test_job_returns_are_streamed_from_the_event_stream(salt_api):
+    with build_client(salt_api) as client:
+        jid = client.async_run_cmd(["CLIENT1", "CLIENT2"], "cmd.run", "ls")
+        publish_return(salt_api, jid, "CLIENT2", "success")
+
+        returns = client.iter_job_returns({jid: ["CLIENT1", "CLIENT2"]}, 5)
+        assert next(returns).minion == "CLIENT2"
+        publish_return(salt_api, jid, "CLIENT1", "success")
+        assert [r.minion for r in returns] == ["CLIENT1"]
+
+
+class RefusedEvents(SSEStandIn):
+    def do_GET(self):
+        self.server.event_requests += 1
+        payload = b'{"status": 404}'
+        self.send_response(404)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def test_refused_event_stream_falls_back_to_polling():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RefusedEvents)
+    server.daemon_threads = True
+    server.lowstates = []
+    server.outputs = {"CLIENT1": "success"}
+    server.event_requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with build_client(server) as client:
+            started = time.time()
+            jid = client.async_run_cmd(["CLIENT1"], "cmd.run", "ls")
+            jid = client.async_run_cmd(["CLIENT1"], "cmd.run", "ls")
+            returns, pending = client.wait_for_jobs({jid: ["CLIENT1"]}, 30)
+            elapsed = time.time() - started
+            time.sleep(1.5)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert elapsed < 5
+    assert returns["CLIENT1"].output == "success"
+    assert pending == {}
+    assert client.event_listener.refused is True
+    # the stream is not subscribed again once refused
+    assert server.event_requests == 1
@@ -0,0 +1,143 @@
+from unittest.mock import patch
+
+import requests_mock
+
+from chaossaltstack import salt_api_client
+from chaossaltstack.grains import GrainsCache
+
+
+SALT_URL = "https://salt.local:8000"
+
+
+def test_cache_serves_fresh_values_and_expires_them():
+    cache = GrainsCache(ttl=10, missing_ttl=5)
+    with patch("time.time", return_value=1000):
+        cache.update("kernel", {"CLIENT1": "Linux"}, ["CLIENT1", "CLIENT2"])
+
+    with patch("time.time", return_value=1004):
+        assert cache.get("kernel", ["CLIENT1", "CLIENT2", "CLIENT3"]) == \
+            ({"CLIENT1": "Linux"}, ["CLIENT3"])
+    with patch("time.time", return_value=1006):
+        assert cache.get("kernel", ["CLIENT1", "CLIENT2"]) == \
+            ({"CLIENT1": "Linux"}, ["CLIENT2"])
+    with patch("time.time", return_value=1011):
+        assert cache.get("kernel", ["CLIENT1", "CLIENT2"]) == \
+            ({}, ["CLIENT1", "CLIENT2"])
+    assert cache.get("os", ["CLIENT1"]) == ({}, ["CLIENT1"])
+
+
+def test_cache_is_kept_in_its_file(tmpdir):
+    path = str(tmpdir.join("grains.json"))
+    GrainsCache(ttl=60, path=path).update("kernel", {"CLIENT1": "Windows"})
+
+    cache = GrainsCache(ttl=60, path=path)
+
+    assert cache.get("kernel", ["CLIENT1"]) == ({"CLIENT1": "Windows"}, [])
+
+
+def test_unreadable_cache_file_is_ignored(tmpdir):
+    path = tmpdir.join("grains.json")
+    path.write("not json")
+
+    cache = GrainsCache(ttl=60, path=str(path))
+
+    assert cache.get("kernel", ["CLIENT1"]) == ({}, ["CLIENT1"])
+
+
+def test_client_only_queries_minions_missing_from_the_cache():
+    client = salt_api_client({
+        "url": SALT_URL, "token": "static", "grains_timeout": 3,
+        "grains_master_cache": False
+    })
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, [
+            {"json": {"return": [{"CLIENT1": "Linux"}]}},
+            {"json": {"return": [{"CLIENT3": "Windows"}]}},
+        ])
+        first = client.get_grains_get(["CLIENT1", "CLIENT2"], "kernel")
+        second = client.get_grains_get(
+            ["CLIENT1", "CLIENT2", "CLIENT3"], "kernel")
+        third = client.get_grains_get(["CLIENT1", "CLIENT3"], "kernel")
+
+    assert first == {"CLIENT1": "Linux"}
+    assert second == {"CLIENT1": "Linux", "CLIENT3": "Windows"}
+    assert third == second
+    assert m.call_count == 2
+    assert m.request_history[0].json()["timeout"] == 3
+    # CLIENT2 did not answer and is not queried again for a while
+    assert m.request_history[1].json()["tgt"] == ["CLIENT3"]
+
+
+def test_client_cache_can_be_disabled():
+    client = salt_api_client({
+        "url": SALT_URL, "token": "static", "grains_ttl": 0,
+        "grains_master_cache": "false"
+    })
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [{"CLIENT1": "Linux"}]})
+        client.get_grains_get(["CLIENT1"], "kernel")
+        client.get_grains_get(["CLIENT1"], "kernel")
+
+    assert m.call_count == 2
+    assert "timeout" not in m.request_history[0].json()
+
+
+def test_client_prefers_the_grains_cached_by_the_master():
+    client = salt_api_client({
+        "url": SALT_URL, "token": "static", "grains_ttl": 0
+    })
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, [
+            {"json": {"return": [{
+                "CLIENT1": {"kernel": "Linux", "os": "Ubuntu"},
+                "CLIENT2": {"os": "Windows"}
+            }]}},
+            {"json": {"return": [{"CLIENT2": "Windows"}]}},
+        ])
+        result = client.get_grains_get(
+            ["CLIENT1", "CLIENT2", "CLIENT3"], "kernel")
+
+    assert result == {"CLIENT1": "Linux", "CLIENT2": "Windows"}
+    assert m.request_history[0].json() == {
+        "client": "runner", "fun": "cache.grains",
+        "tgt": ["CLIENT1", "CLIENT2", "CLIENT3"], "tgt_type": "list"
+    }
+    # only the minions the master does not know are queried live
+    assert m.request_history[1].json()["client"] == "local"
+    assert m.request_history[1].json()["tgt"] == ["CLIENT2", "CLIENT3"]
+
+
+def test_client_skips_the_live_lookup_when_the_master_knows_all():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [{
+            "CLIENT1": {"kernel": "Linux", "ip_interfaces": {"eth0": []}}
+        }]})
+        assert client.get_grains_get(["CLIENT1"], "kernel") == \
+            {"CLIENT1": "Linux"}
+        assert client.get_cached_grains_get(
+            ["CLIENT1"], "ip_interfaces:eth0") == {"CLIENT1": []}
+        assert client.get_grains_get(["CLIENT1"], "kernel") == \
+            {"CLIENT1": "Linux"}
+
+    assert m.call_count == 2
+
+
+def test_target_expressions_are_queried_live():
+    client = salt_api_client({"url": SALT_URL, "token": "static"})
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [{"web1": "Linux"}]})
+        client.get_grains_get("G@role:web", "kernel", "compound")
+        client.get_grains_get("G@role:web", "kernel", "compound")
+
+    assert m.call_count == 2
+    assert m.request_history[0].json() == {
+        "client": "local", "fun": "grains.get", "tgt": "G@role:web",
+        "arg": "kernel", "tgt_type": "compound"
+    }
+
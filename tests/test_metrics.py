@@ -0,0 +1,112 @@
+import json
+
+import requests_mock
+
+from chaossaltstack import salt_api_client
+from chaossaltstack.metrics import MetricsCollector, RequestEvent, \
+    export_metrics, lowstate_labels, summarize, to_prometheus
+
+
+SALT_URL = "https://salt.local:8000"
+LOGIN_RETURN = {"return": [{"token": "abcd1234", "expire": 1e12}]}
+
+
+def event(client="local", fun="test.ping", status=200, latency=0.5,
+          retry=False):
+    return RequestEvent(client, fun, status, latency, 100, 2048, retry)
+
+
+def test_collector_aggregates_by_client_fun_and_status():
+    collector = MetricsCollector()
+    collector(event(latency=0.5))
+    collector(event(latency=1.5, retry=True))
+    collector(event(status=500))
+
+    snapshot = collector.snapshot()
+
+    assert snapshot[("local", "test.ping", "200")] == {
+        "count": 2, "seconds": 2.0, "max_seconds": 1.5,
+        "request_bytes": 200, "response_bytes": 4096, "retries": 1
+    }
+    assert snapshot[("local", "test.ping", "500")]["count"] == 1
+
+
+def test_snapshots_are_exported_as_prometheus_textfile(tmpdir):
+    collector = MetricsCollector()
+    collector(event(client="runner", fun="jobs.lookup_jid"))
+    path = str(tmpdir.join("saltstack.prom"))
+
+    export_metrics(collector.snapshot(), path)
+
+    content = open(path).read()
+    assert content == to_prometheus(collector.snapshot())
+    assert "# TYPE saltstack_api_requests_total counter" in content
+    assert 'saltstack_api_requests_total{client="runner",' \
+           'fun="jobs.lookup_jid",status="200"} 1' in content
+    assert tmpdir.listdir() == [tmpdir.join("saltstack.prom")]
+
+
+def test_snapshots_are_exported_as_json(tmpdir):
+    collector = MetricsCollector()
+    collector(event())
+    path = str(tmpdir.join("saltstack.json"))
+
+    export_metrics(collector.snapshot(), path, "json")
+
+    assert json.load(open(path)) == [{
+        "client": "local", "fun": "test.ping", "status": "200",
+        "count": 1, "seconds": 0.5, "max_seconds": 0.5,
+        "request_bytes": 100, "response_bytes": 2048, "retries": 0
+    }]
+
+
+def test_summary_only_counts_the_requests_since_a_snapshot():
+    collector = MetricsCollector()
+    collector(event())
+    before = collector.snapshot()
+    collector(event(client="runner", fun="jobs.lookup_jid", latency=2))
+    collector(event(status=401, retry=True))
+
+    summary = summarize(collector.snapshot(), before)
+
+    assert summary.startswith(
+        "2 requests in 2.500s (runner/jobs.lookup_jid: 1 in 2.000s, "
+        "local/test.ping: 1 in 0.500s)")
+    assert summary.endswith("1 retries, 1 errors")
+
+
+def test_mixed_chunks_are_labelled_as_such():
+    assert lowstate_labels({"client": "local", "fun": "cmd.run"}) == \
+        ("local", "cmd.run")
+    assert lowstate_labels([
+        {"client": "runner", "fun": "jobs.lookup_jid"},
+        {"client": "runner", "fun": "jobs.exit_success"}
+    ]) == ("runner", "mixed")
+
+
+def test_client_reports_every_request_to_its_hooks():
+    client = salt_api_client({
+        "url": SALT_URL, "username": "salt", "password": "pwd"
+    })
+    events = []
+    client.add_hook(events.append)
+    client.add_hook(lambda e: 1 / 0)
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL + "/login", json=LOGIN_RETURN)
+        m.post(SALT_URL, [
+            {"status_code": 401, "text": "Unauthorized"},
+            {"json": {"return": [{"CLIENT1": True}]}},
+        ])
+        client.run_cmd(["CLIENT1"], "test.ping")
+
+    assert [(e.client, e.fun, e.status, e.retry) for e in events] == [
+        ("login", "", 200, False),
+        ("local", "test.ping", 401, False),
+        ("login", "", 200, False),
+        ("local", "test.ping", 200, True),
+    ]
+    assert events[-1].response_bytes == \
+        len(json.dumps({"return": [{"CLIENT1": True}]}))
+    assert client.metrics.snapshot()[("local", "test.ping", "200")] \
+        ["retries"] == 1
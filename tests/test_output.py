@@ -0,0 +1,68 @@
+import requests_mock
+
+from chaossaltstack import salt_api_client
+from chaossaltstack.output import TRUNCATED_MARKER, OutputLimiter
+
+
+SALT_URL = "https://salt.local:8000"
+
+
+def test_outputs_are_truncated_between_head_and_tail():
+    limiter = OutputLimiter(head=3, tail=4)
+
+    assert limiter.limit("CLIENT1", "short") == "short"
+    assert limiter.limit("CLIENT1", "0123456789") == \
+        "012\n... [3 characters truncated] ...\n6789"
+    assert limiter.limit("CLIENT1", True) is True
+
+
+def test_outputs_are_kept_whole_without_bounds():
+    limiter = OutputLimiter(head=0, tail=0)
+
+    assert limiter.limit("CLIENT1", "x" * 100000) == "x" * 100000
+
+
+def test_outputs_bounded_by_the_minions_are_left_alone():
+    limiter = OutputLimiter(head=100, tail=100)
+    bounded = "h" * 100 + "\n... [99801 bytes truncated] ...\n" + "t" * 100
+
+    assert limiter.limit("CLIENT1", bounded) == bounded
+    # a marker does not save a longer output
+    assert "characters truncated" in limiter.limit("CLIENT1", bounded + "x")
+
+
+def test_truncated_outputs_are_spooled(tmpdir):
+    limiter = OutputLimiter(head=1, tail=1, spool_dir=str(tmpdir))
+
+    limiter.limit("CLIENT1", "abc", "20190830103239148771")
+    limiter.limit("CLIENT2", "ab", "20190830103239148771")
+
+    assert tmpdir.join("20190830103239148771", "CLIENT1.log").read() == "abc"
+    assert not tmpdir.join("20190830103239148771", "CLIENT2.log").exists()
+
+
+def test_client_bounds_the_job_returns():
+    client = salt_api_client({
+        "url": SALT_URL, "token": "static", "output_head": 2,
+        "output_tail": 2
+    })
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [
+            {"CLIENT1": "dd: 1000+0 records in"}, {"CLIENT1": True}]})
+        returns, pending = client.wait_for_jobs(
+            {"20190830103239148771": ["CLIENT1"]}, 10)
+
+    assert returns["CLIENT1"].output == \
+        "dd\n... [17 characters truncated] ...\nin"
+
+
+def test_run_all_returns_have_their_streams_bounded():
+    limiter = OutputLimiter(head=2, tail=2)
+
+    output = limiter.limit("CLIENT1", {
+        "retcode": 1, "stdout": "0123456789", "stderr": "err"})
+
+    assert output["retcode"] == 1
+    assert output["stdout"] == "01" + TRUNCATED_MARKER.format(6) + "89"
+    assert output["stderr"] == "err"
@@ -0,0 +1,154 @@
+from unittest.mock import patch
+
+from chaoslib.exceptions import FailedActivity
+import pytest
+import requests
+import requests_mock
+
+from chaossaltstack import salt_api_client
+from chaossaltstack.resilience import CircuitBreaker, RetryPolicy, \
+    TransientError, is_idempotent
+
+
+SALT_URL = "https://salt.local:8000"
+LOOKUP = {"client": "runner", "fun": "jobs.lookup_jid", "jid": "1"}
+JOB_RETURN = {"json": {"return": [{"CLIENT1": "done"}]}}
+
+
+def build_client(**kwargs):
+    configuration = {"url": SALT_URL, "token": "static",
+                     "retry_backoff": 0}
+    configuration.update(kwargs)
+    return salt_api_client(configuration)
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(retries=3, backoff=1, max_backoff=3)
+
+    with patch("random.uniform", side_effect=lambda a, b: b):
+        assert [policy.delay(n) for n in range(4)] == [1, 2, 3, 3]
+    assert all(0 <= policy.delay(5) <= 3 for _ in range(20))
+
+
+def test_only_idempotent_or_unsent_requests_are_retried():
+    policy = RetryPolicy(retries=1)
+
+    assert policy.should_retry(0, TransientError("503"), idempotent=True)
+    assert not policy.should_retry(0, TransientError("503"), False)
+    assert policy.should_retry(0, TransientError("refused", sent=False),
+                               idempotent=False)
+    assert not policy.should_retry(1, TransientError("503"), True)
+    assert is_idempotent([LOOKUP, {"fun": "jobs.exit_success"}])
+    assert not is_idempotent({"client": "local_async", "fun": "cmd.run"})
+
+
+def test_breaker_opens_after_failures_in_a_row_and_resets():
+    breaker = CircuitBreaker(threshold=2, reset=30)
+    with patch("time.time", return_value=1000):
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        breaker.check()
+        breaker.failure()
+        with pytest.raises(FailedActivity):
+            breaker.check()
+
+    with patch("time.time", return_value=1031):
+        breaker.check()
+        breaker.failure()
+        assert breaker.open
+
+
+def test_breaker_lets_a_single_probe_through_once_reset():
+    breaker = CircuitBreaker(threshold=1, reset=30)
+    with patch("time.time", return_value=1000):
+        breaker.failure()
+
+    with patch("time.time", return_value=1031):
+        breaker.check()
+        with pytest.raises(FailedActivity):
+            breaker.check()
+        breaker.release()
+        breaker.check()
+        breaker.success()
+        breaker.check()
+        breaker.check()
+
+
+def test_transient_errors_of_idempotent_requests_are_retried():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, [
+            {"status_code": 503, "text": "Service Unavailable"},
+            {"text": "<html>truncated"},
+            {"exc": requests.exceptions.ReadTimeout},
+            JOB_RETURN,
+        ])
+        assert client.run_many([LOOKUP]) == [{"CLIENT1": "done"}]
+
+    assert m.call_count == 4
+    assert sum(stats["retries"]
+               for stats in client.metrics.snapshot().values()) == 3
+
+
+def test_jobs_are_not_dispatched_twice():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, status_code=503, reason="Service Unavailable")
+        with pytest.raises(FailedActivity) as x:
+            client.async_run_cmd(["CLIENT1"], "cmd.run", "ls")
+
+    assert m.call_count == 1
+    assert "503 Service Unavailable" in str(x.value)
+
+
+def test_jobs_are_retried_when_the_master_was_not_reached():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, [
+            {"exc": requests.exceptions.ConnectTimeout},
+            {"json": {"return": [{"jid": "1", "minions": ["CLIENT1"]}]}},
+        ])
+        assert client.async_run_cmd(["CLIENT1"], "cmd.run", "ls") == "1"
+
+
+def test_client_errors_are_not_retried():
+    client = build_client()
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, status_code=400, reason="Bad Request")
+        with pytest.raises(FailedActivity):
+            client.run_many([LOOKUP])
+
+    assert m.call_count == 1
+
+
+def test_requests_are_bounded_by_timeouts():
+    client = build_client(connect_timeout=2, read_timeout=30)
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, json={"return": [{"CLIENT1": "done"}]})
+        client.run_many([LOOKUP])
+        client.run_cmd(["CLIENT1"], "cmd.run", "ls", batch="10%")
+
+    assert m.request_history[0].timeout == (2, 30)
+    # batches keep the request open until they all ran
+    assert m.request_history[1].timeout == (2, None)
+
+
+def test_client_fails_fast_once_the_master_is_down():
+    client = build_client(retries=1, breaker_threshold=4)
+
+    with requests_mock.Mocker() as m:
+        m.post(SALT_URL, exc=requests.exceptions.ConnectionError)
+        for _ in range(2):
+            with pytest.raises(FailedActivity):
+                client.run_many([LOOKUP])
+        with pytest.raises(FailedActivity) as x:
+            client.run_many([LOOKUP])
+
+    assert m.call_count == 4
+    assert "unavailable" in str(x.value)
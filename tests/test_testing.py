@@ -0,0 +1,87 @@
+import pytest
+from chaoslib.exceptions import FailedActivity
+
+from chaossaltstack import close_saltstack_api_clients, salt_api_client
+from chaossaltstack.machine.actions import burn_cpu, network_latency
+from chaossaltstack.machine.probes import is_minion_online
+from chaossaltstack.testing import FakeSaltApi
+
+
+@pytest.fixture(autouse=True)
+def close_clients():
+    yield
+    close_saltstack_api_clients()
+
+
+def grains(minion):
+    kernel = "Windows" if minion.endswith(("0", "5")) else "Linux"
+    return {"kernel": kernel, "role": "web" if minion < "minion00010" else "db"}
+
+
+def test_actions_run_against_the_simulated_minions():
+    with FakeSaltApi(minions=20, latency=(0, 0.05), seed=1) as salt_api:
+        burn_cpu(salt_api.minion_ids, execution_duration="1",
+                 secrets=salt_api.secrets(),
+                 configuration={"saltstack_poll_interval": 0.01})
+        stats = salt_api.stats()
+
+    assert stats["lowstates"]["local_async/cmd.run"] == 1
+    assert stats["lowstates"]["runner/jobs.lookup_jid"] >= 1
+    assert stats["requests"] < 20
+
+
+def test_failing_minions_fail_the_action():
+    with FakeSaltApi(minions=5, failure_rate=1) as salt_api:
+        with pytest.raises(FailedActivity, match="One of experiments"):
+            network_latency(salt_api.minion_ids, execution_duration="1",
+                            secrets=salt_api.secrets(),
+                            configuration={"saltstack_poll_interval": 0.01})
+
+
+def test_returns_are_published_on_the_event_stream():
+    with FakeSaltApi(minions=10, latency=0.05) as salt_api:
+        client = salt_api_client({
+            "url": salt_api.url, "username": "salt", "password": "salt",
+            "use_events": True
+        })
+        with client:
+            jid = client.async_run_cmd(salt_api.minion_ids, "cmd.run", "ls")
+            returns, pending = client.wait_for_jobs(
+                {jid: salt_api.minion_ids}, 5)
+
+        assert salt_api.stats()["lowstates"].get(
+            "runner/jobs.lookup_jid") is None
+    assert pending == {}
+    assert sorted(returns) == salt_api.minion_ids
+
+
+def test_target_expressions_and_batches():
+    nodegroups = {"frontends": "G@role:web and not G@kernel:Windows"}
+    with FakeSaltApi(minions=20, grains=grains,
+                     nodegroups=nodegroups) as salt_api:
+        assert salt_api.match("frontends", "nodegroup") == [
+            "minion00001", "minion00002", "minion00003", "minion00004",
+            "minion00006", "minion00007", "minion00008", "minion00009"]
+
+        client = salt_api_client({
+            "url": salt_api.url, "username": "salt", "password": "salt"
+        })
+        returns = client.run_cmd(
+            "G@kernel:Linux and ( N@frontends )", "cmd.run", "ls",
+            tgt_type="compound", batch="50%")
+
+    assert sorted(returns) == salt_api.match("frontends", "nodegroup")
+
+
+def test_unknown_minions_and_credentials():
+    with FakeSaltApi(minions=2) as salt_api:
+        result = is_minion_online(
+            ["minion00000", "other"], secrets=salt_api.secrets())
+
+        client = salt_api_client({
+            "url": salt_api.url, "username": "salt", "password": "wrong"
+        })
+        with pytest.raises(FailedActivity, match="refused the login"):
+            client.run_cmd(["minion00000"], "test.ping")
+
+    assert result == {"minion00000": "Online", "other": "Not a Salt Minion"}
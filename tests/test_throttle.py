@@ -0,0 +1,140 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from chaossaltstack import salt_api_client
+from chaossaltstack.testing import FakeSaltApi
+from chaossaltstack.metrics import RequestEvent
+from chaossaltstack.throttle import ConcurrencyWindow, RequestThrottle, \
+    TokenBucket
+
+
+def test_bucket_allows_a_burst_then_paces_callers():
+    with patch("time.monotonic", return_value=100):
+        bucket = TokenBucket(rate=10, burst=2)
+        assert [bucket.reserve() for _ in range(4)] == \
+            [0, 0, 0.1, 0.2]
+
+    # the debt is paid back as time goes
+    with patch("time.monotonic", return_value=100.5):
+        assert bucket.reserve() == 0
+
+
+def test_bucket_without_rate_never_waits():
+    bucket = TokenBucket(rate=0)
+
+    assert {bucket.reserve() for _ in range(100)} == {0}
+
+
+def test_throttle_bounds_requests_in_flight():
+    throttle = RequestThrottle(rate=0, window=ConcurrencyWindow(
+        limit=2, max_limit=2, adaptive=False))
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def request(_):
+        with throttle:
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(request, range(16)))
+
+    assert in_flight[1] == 2
+
+
+def test_client_throttles_every_thread():
+    with FakeSaltApi(minions=4, request_latency=0.02) as salt_api:
+        client = salt_api_client({
+            "url": salt_api.url, "username": "salt", "password": "salt",
+            "max_in_flight": 2, "adaptive_concurrency": False,
+            "rate_limit": 50, "rate_burst": 1
+        })
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(
+                lambda i: client.run_cmd(salt_api.minion_ids, "test.ping"),
+                range(8)))
+        elapsed = time.time() - started
+        client.close()
+        stats = salt_api.stats()
+
+    assert stats["max_in_flight"] <= 2
+    # a login and 8 requests at 50 per second, the first one without waiting
+    assert elapsed >= 0.16
+
+
+def request(latency=0.01, status=200, client="runner"):
+    return RequestEvent(client, "jobs.lookup_jid", status, latency, 10, 10,
+                        False)
+
+
+def test_window_grows_by_one_request_per_window():
+    window = ConcurrencyWindow(limit=2, max_limit=4)
+
+    # 2 + 1/2 + 1/2.5 + 1/2.9
+    for _ in range(3):
+        window(request())
+    assert int(window.limit) == 3
+    for _ in range(100):
+        window(request())
+    assert window.limit == 4
+
+
+def test_window_is_halved_once_per_window_on_errors():
+    window = ConcurrencyWindow(limit=8, max_limit=8)
+    for _ in range(8):
+        window(request())
+
+    window(request(status=503))
+    window(request(status=0))
+
+    assert window.limit == 4
+    for _ in range(4):
+        window(request(status=503))
+    assert window.limit == 2
+
+
+def test_window_shrinks_when_the_master_slows_down():
+    window = ConcurrencyWindow(limit=8, max_limit=8)
+    for _ in range(8):
+        window(request(latency=0.1))
+
+    # blocking calls wait for minions, not for the master
+    window(request(latency=2, client="local"))
+    assert window.limit == 8
+    window(request(latency=0.2))
+    assert window.limit == 8
+    window(request(latency=2))
+    assert window.limit == 4
+
+
+def test_fixed_window_ignores_the_load():
+    window = ConcurrencyWindow(limit=3, max_limit=3, adaptive=False)
+
+    window(request(status=503))
+
+    assert window.limit == 3
+
+
+def test_client_window_follows_its_requests():
+    client = salt_api_client({
+        "url": "https://salt.local:8000", "token": "static",
+        "max_in_flight": 32, "initial_in_flight": 4
+    })
+    window = client.throttle.window
+
+    client.__notify_hooks__(request(status=503))
+    for _ in range(4):
+        client.__notify_hooks__(request(status=503))
+
+    assert window.limit == 2
+    assert salt_api_client({
+        "url": "https://salt.local:8000", "token": "static",
+        "max_in_flight": 0
+    }).throttle.window is None
@@ -0,0 +1,115 @@
+import json
+import threading
+
+from chaoslib.exceptions import FailedActivity
+import pytest
+
+from chaossaltstack import close_saltstack_api_clients
+from chaossaltstack.machine.actions import burn_cpu
+from chaossaltstack.metrics import RequestEvent
+from chaossaltstack.testing import FakeSaltApi
+from chaossaltstack.tracing import Tracer
+
+
+def read_spans(path):
+    return [json.loads(line) for line in open(path)]
+
+
+def test_spans_nest_and_are_written_when_the_outermost_ends(tmpdir):
+    path = str(tmpdir.join("trace.jsonl"))
+    tracer = Tracer(path)
+
+    with tracer.span("action", tgt_type="list"):
+        with tracer.span("grains"):
+            pass
+        worker = threading.Thread(target=lambda: tracer.record("job", 1, 2))
+        worker.start()
+        worker.join()
+        assert not tmpdir.join("trace.jsonl").exists()
+
+    spans = {span["name"]: span for span in read_spans(path)}
+    assert spans["action"]["parent"] is None
+    assert spans["action"]["args"] == {"tgt_type": "list"}
+    assert spans["grains"]["parent"] == spans["action"]["id"]
+    # spans of other threads hang from the outermost span
+    assert spans["job"]["parent"] == spans["action"]["id"]
+    assert spans["job"]["duration"] == 1
+    assert spans["grains"]["start"] >= spans["action"]["start"]
+    assert spans["grains"]["end"] <= spans["action"]["end"]
+
+
+def test_traces_are_appended_in_chrome_format(tmpdir):
+    path = str(tmpdir.join("trace.json"))
+    for name in ("first", "second"):
+        tracer = Tracer(path, "chrome")
+        with tracer.span(name):
+            pass
+
+    # the array may be left unterminated, close it to load it here
+    events = json.loads(open(path).read().rstrip(",\n") + "]")
+    assert [e["name"] for e in events] == ["first", "second"]
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+
+
+def test_tracer_without_file_records_nothing(tmpdir):
+    tracer = Tracer.from_configuration({})
+
+    with tracer.span("action"):
+        tracer.record("job", 1, 2)
+
+    assert not tracer.enabled
+    assert tracer.spans == []
+
+
+def test_unknown_trace_format_is_refused():
+    with pytest.raises(FailedActivity):
+        Tracer.from_configuration({
+            "saltstack_trace_file": "trace", "saltstack_trace_format": "xml"
+        })
+
+
+def test_followed_clients_are_released_with_the_outermost_span(tmpdir):
+    class Client:
+        hooks = []
+
+        def add_hook(self, hook):
+            self.hooks.append(hook)
+
+        def remove_hook(self, hook):
+            self.hooks.remove(hook)
+
+    path = str(tmpdir.join("trace.jsonl"))
+    tracer = Tracer(path)
+    client = Client()
+    with tracer.span("action"):
+        tracer.follow(client)
+        for hook in client.hooks:
+            hook(RequestEvent("runner", "jobs.lookup_jid", 200, 0.1, 10, 20,
+                              False))
+
+    assert client.hooks == []
+    request = [s for s in read_spans(path) if s["name"] != "action"][0]
+    assert request["name"] == "runner/jobs.lookup_jid"
+    assert request["args"]["status"] == 200
+
+
+def test_actions_trace_each_phase(tmpdir):
+    path = str(tmpdir.join("trace.jsonl"))
+    try:
+        with FakeSaltApi(minions=3, latency=0, seed=0) as salt_api:
+            burn_cpu(instance_ids=salt_api.minion_ids,
+                     execution_duration="0",
+                     configuration={"saltstack_trace_file": path,
+                                    "saltstack_poll_interval": 0.01},
+                     secrets=salt_api.secrets())
+    finally:
+        close_saltstack_api_clients()
+
+    spans = read_spans(path)
+    names = {span["name"] for span in spans}
+    assert {"burn_cpu", "grains", "render", "dispatch", "submit", "collect",
+            "job", "fault_window", "runner/cache.grains",
+            "local_async/cmd.run"} <= names
+    root = [span for span in spans if span["name"] == "burn_cpu"][0]
+    assert all(span["parent"] is not None for span in spans
+               if span is not root)